@@ -11,31 +11,79 @@
 
     Author: Phil Owen, 05/10/2023
 """
+import os
 import sys
 import argparse
 
-from src.sync.psc_sync import PSCDataSync
+from src.sync.collab_sync import CollabDataSync
+from src.sync.sync_daemon import SyncDaemon
 
 
-def run_psc_collab_sync(run_id: str, physical_location: str) -> bool:
+def run_psc_collab_sync(run_id: str, physical_location: str, full_resync: bool = False) -> bool:
     """
-    Runs thd PSC collaborator sync
+    Runs thd collaborator sync
 
     :param run_id
     :param physical_location:
+    :param full_resync:
     :return:
     """
 
-    # create the PSC data sync component
-    psc_sync = PSCDataSync()
+    # create the collaborator data sync component
+    psc_sync = CollabDataSync()
 
-    # initiate the PSC sync. return value of True indicates success
-    retval: bool = psc_sync.run(run_id, physical_location)
+    # initiate the sync to every collaborator of the run. return value of True indicates success for all of them
+    retval: bool = all(psc_sync.run(run_id, physical_location, full_resync).values())
+
+    # clean up and write out the metrics
+    psc_sync.close()
 
     # return to the caller
     return retval
 
 
+def run_psc_collab_backfill(run_ids: list = None, window: dict = None, full_resync: bool = False) -> bool:
+    """
+    Re-syncs a list of runs, or the runs of a project code and/or time window, with the collaborators
+
+    :param run_ids:
+    :param window: the project_code, start_date and/or end_date of the runs
+    :param full_resync:
+    :return:
+    """
+    # create the collaborator data sync component
+    psc_sync = CollabDataSync()
+
+    try:
+        # replay the runs
+        results: dict = psc_sync.backfill(run_ids, window, full_resync)
+    finally:
+        # clean up and write out the metrics
+        psc_sync.close()
+
+    # return to the caller
+    return all(all(target_results.values()) for target_results in results.values())
+
+
+def run_psc_outbox_drain() -> bool:
+    """
+    Resends the failed pushes waiting in the outbox
+
+    :return: True if the outbox is empty
+    """
+    # create the collaborator data sync component
+    psc_sync = CollabDataSync()
+
+    # send everything that is due
+    _, depth = psc_sync.drain_outbox(limit=1000000)
+
+    # clean up and write out the metrics
+    psc_sync.close()
+
+    # return to the caller
+    return depth == 0
+
+
 if __name__ == '__main__':
     #
     # main entry point for the sync run.
@@ -45,14 +93,44 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='help', formatter_class=argparse.RawDescriptionHelpFormatter)
 
     # assign the expected input args
-    parser.add_argument('-r', '--run_id', help='Input is a valid APSViz supervisor run ID.')
+    parser.add_argument('-r', '--run_id', help='Input is a valid APSViz supervisor run ID. In backfill mode a comma separated list of run IDs.')
     parser.add_argument('-p', '--physical_location', help='The name of the physical location of the compute cluster.')
+    parser.add_argument('-f', '--full_resync', action='store_true', help='Send all catalog members, not just the ones changed since the last sync.')
+    parser.add_argument('-b', '--backfill', action='store_true', help='Re-sync the run IDs or the runs of the project code and/or time window.')
+    parser.add_argument('--project_code', help='Backfill mode: the project code of the runs to re-sync.')
+    parser.add_argument('--start_date', help='Backfill mode: the start (inclusive) of the time window of the runs to re-sync.')
+    parser.add_argument('--end_date', help='Backfill mode: the end (exclusive) of the time window of the runs to re-sync.')
+    parser.add_argument('-d', '--daemon', action='store_true', help='Run as a long-running daemon taking "<run_id> <physical_location>" jobs.')
+    parser.add_argument('-s', '--socket_path', help='Daemon mode: read jobs from this Unix socket instead of stdin.')
+    parser.add_argument('-l', '--listen', action='store_true', help='Daemon mode: take jobs from Postgres notifications of catalog member inserts.')
+    parser.add_argument('--drain_outbox', action='store_true', help='Resend the failed pushes waiting in the outbox (PSC_SYNC_OUTBOX_DB).')
+    parser.add_argument('--profile', help='Profile the runs: a comma separated list of cprofile, tracemalloc and/or sampling. '
+                                          'The results go in LOG_PATH. Overrides PSC_SYNC_PROFILE.')
 
     # parse the command line
     args = parser.parse_args()
 
-    # execute the rule file(s)
-    ret_val: bool = run_psc_collab_sync(args.run_id, args.physical_location)
+    # turn on profiling if requested
+    if args.profile:
+        os.environ['PSC_SYNC_PROFILE'] = args.profile
+
+    # are we running as a daemon
+    if args.daemon:
+        # process jobs until told to stop
+        SyncDaemon().run(args.socket_path, args.listen)
+    # are we resending failed pushes
+    elif args.drain_outbox:
+        # send what is due
+        ret_val: bool = run_psc_outbox_drain()
+    # are we replaying runs
+    elif args.backfill:
+        # re-sync the runs
+        ret_val: bool = run_psc_collab_backfill(args.run_id.split(',') if args.run_id else None,
+                                                {'project_code': args.project_code, 'start_date': args.start_date, 'end_date': args.end_date},
+                                                args.full_resync)
+    else:
+        # execute the rule file(s)
+        ret_val: bool = run_psc_collab_sync(args.run_id, args.physical_location, args.full_resync)
 
     # exit with pass/fail
     sys.exit(0)
@@ -0,0 +1,13 @@
+-- SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+--
+-- SPDX-License-Identifier: GPL-3.0-or-later
+-- SPDX-License-Identifier: LicenseRef-RENCI
+-- SPDX-License-Identifier: MIT
+
+-- Indexes the run id of the catalog members, so the run probe (PSC_SYNC_PROBE) is an index scan.
+-- text_pattern_ops lets the run id prefix match (LIKE '<run id>%') use the index.
+-- Apply once to the apsviz DB: psql -d apsviz -f migrations/001_catalog_member_run_id_index.sql
+
+CREATE INDEX IF NOT EXISTS catalog_member_run_id_idx ON public.catalog_member ((member_def->>'run_id') text_pattern_ops);
@@ -0,0 +1,27 @@
+-- SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+--
+-- SPDX-License-Identifier: GPL-3.0-or-later
+-- SPDX-License-Identifier: LicenseRef-RENCI
+-- SPDX-License-Identifier: MIT
+
+-- Keeps a version row per catalog table that a statement trigger bumps in the same transaction as every insert, update,
+-- delete and truncate, so a new version is visible no earlier than the data it is for. The catalog query result cache
+-- (APSVIZ_DB_CACHE_MAX_ENTRIES) is turned off at startup if the table is missing.
+-- Apply once to the apsviz DB: psql -d apsviz -f migrations/002_catalog_data_version.sql
+-- Repeat the INSERT and CREATE TRIGGER for any other table listed in APSVIZ_DB_CACHE_TABLES.
+
+CREATE TABLE IF NOT EXISTS public.catalog_data_version (table_name text PRIMARY KEY, version bigint NOT NULL DEFAULT 0);
+
+CREATE OR REPLACE FUNCTION public.bump_catalog_data_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE public.catalog_data_version SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO public.catalog_data_version (table_name) VALUES ('catalog_member') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE TRIGGER catalog_member_data_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON public.catalog_member FOR EACH STATEMENT EXECUTE FUNCTION public.bump_catalog_data_version();
@@ -0,0 +1,23 @@
+-- SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+--
+-- SPDX-License-Identifier: GPL-3.0-or-later
+-- SPDX-License-Identifier: LicenseRef-RENCI
+-- SPDX-License-Identifier: MIT
+
+-- Sends a notification with the run id for each catalog member inserted, which the listening daemon (--daemon --listen)
+-- turns into sync jobs. Identical notifications sent in one transaction are delivered once. The payload is a bare run id,
+-- so the daemon looks up the physical location in the ASGS run properties (COLLAB_SYNC_RUN_PROPS_DB and its ASGS_DB_* settings).
+-- Apply once to the apsviz DB: psql -d apsviz -f migrations/003_catalog_member_notify.sql
+-- Change the channel name if COLLAB_SYNC_LISTEN_CHANNEL is not the default.
+
+CREATE OR REPLACE FUNCTION public.notify_catalog_member_inserted() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('catalog_member_inserted', NEW.member_def->>'run_id');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER catalog_member_inserted AFTER INSERT ON public.catalog_member
+    FOR EACH ROW EXECUTE FUNCTION public.notify_catalog_member_inserted();
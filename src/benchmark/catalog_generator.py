@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Synthetic catalog data and a DB stand-in for benchmarking the sync without a database.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import random
+
+from src.common.payload_utils import PayloadUtils
+
+
+class CatalogGenerator:
+    """
+    Class that creates catalog member records shaped like the ones from public.get_catalog_member_records()
+    """
+
+    # the products of a run. each becomes a member of the run catalog
+    PRODUCTS: tuple = ('maxele63', 'maxwvel63', 'swan', 'obs', 'maxinundepth63', 'maxele_level_downscaled', 'hsign63', 'tps63')
+
+    # the event types of a run
+    EVENT_TYPES: tuple = ('nowcast', 'forecast', 'ofcl', 'trackRight50', 'gfsforecast')
+
+    def __init__(self, psc_projects: tuple = ('psc_test',), other_projects: tuple = ('nopp', 'lffs', 'ncsc123_gfs_sb55.01'), seed: int = 0):
+        """
+        Initializes this class
+
+        :param psc_projects: the project codes of the catalogs
+        :param other_projects: the project codes of the past runs that are not for PSC
+        :param seed: the random seed, the same seed creates the same data
+        """
+        self.psc_projects: tuple = psc_projects
+        self.other_projects: tuple = other_projects
+        self.seed: int = seed
+
+    def generate(self, member_count: int, members_per_catalog: int = 8, past_run_ratio: float = 0.2, psc_past_run_share: float = 0.25) -> dict:
+        """
+        Creates catalog data with the number of members requested.
+
+        :param member_count: the number of catalog members
+        :param members_per_catalog: the number of members of each run catalog
+        :param past_run_ratio: the number of past runs per catalog member
+        :param psc_past_run_share: the share of the past runs that are for PSC, the rest are for other projects
+        :return:
+        """
+        # init the random generator so the data is repeatable
+        rand = random.Random(self.seed)
+
+        # init the catalog members
+        catalogs: list = []
+
+        # for each member
+        for index in range(member_count):
+            # get the run this member is in
+            run: int = index // max(1, members_per_catalog)
+
+            # get the product, adding a suffix once the product names are used up
+            product: int = index % max(1, members_per_catalog)
+            product_name: str = self.PRODUCTS[product % len(self.PRODUCTS)]
+
+            if product >= len(self.PRODUCTS):
+                product_name += f'{product // len(self.PRODUCTS)}'
+
+            # add the member
+            catalogs.append(self.get_member(rand, run, product_name))
+
+        # create the past runs
+        past_runs: list = [self.get_past_run(rand, index, rand.random() < psc_past_run_share) for index in range(int(member_count * past_run_ratio))]
+
+        # return to the caller
+        return {'catalogs': catalogs, 'past_runs': past_runs}
+
+    def get_member(self, rand: random.Random, run: int, product_name: str) -> dict:
+        """
+        Creates a catalog member
+
+        :param rand:
+        :param run:
+        :param product_name:
+        :return:
+        """
+        # get the run id
+        run_id: str = f'{4000 + run}-{2023072100 + run % 24}-{self.EVENT_TYPES[run % len(self.EVENT_TYPES)]}'
+
+        # return the member
+        return {'project_code': self.psc_projects[run % len(self.psc_projects)],
+                'member_def': {'id': f'{run_id}-{product_name}', 'run_id': run_id, 'name': f'{product_name} {run_id}',
+                               'layers': [f'{run_id}-{product_name}_{layer}' for layer in range(rand.randint(1, 3))],
+                               'url': f'https://apsviz-geoserver.renci.org/geoserver/wms?layers={run_id}-{product_name}',
+                               'event_type': self.EVENT_TYPES[run % len(self.EVENT_TYPES)], 'grid_type': 'hsofs', 'instance_name': 'ec95d',
+                               'advisory_number': f'{2023072100 + run % 24}', 'storm_name': 'NA', 'meteorological_model': 'GFS',
+                               'product_type': product_name, 'insert_date': f'2023-07-{1 + run % 28:02}T{run % 24:02}:00:00'}}
+
+    def get_past_run(self, rand: random.Random, index: int, is_psc: bool) -> dict:
+        """
+        Creates a past run
+
+        :param rand:
+        :param index:
+        :param is_psc:
+        :return:
+        """
+        # get the project code
+        project_code: str = rand.choice(self.psc_projects if is_psc else self.other_projects)
+
+        # return the past run
+        return {'project_code': project_code, 'run_id': f'{3000 + index}-{2023060100 + index % 24}-{self.EVENT_TYPES[index % len(self.EVENT_TYPES)]}',
+                'event_type': self.EVENT_TYPES[index % len(self.EVENT_TYPES)], 'grid_type': 'hsofs', 'insert_date': f'2023-06-{1 + index % 28:02}'}
+
+
+class FakePGImplementation:
+    """
+    Class that stands in for PGImplementation with a fixed catalog. Each call decodes the catalog
+    JSON again, like the DB driver does, so callers can change what they get back.
+    """
+
+    def __init__(self, catalog_data: dict):
+        """
+        Initializes this class
+
+        :param catalog_data: the catalog data returned for every run
+        """
+        # save the catalog data as the JSON text the DB would return
+        self.catalog_text: str = PayloadUtils.encode_json(catalog_data).decode('utf-8')
+
+        # the project codes and member count of the catalog
+        self.probe: dict = {'project_codes': sorted({item['project_code'] for item in catalog_data.get('catalogs') or []}),
+                            'member_count': len(catalog_data.get('catalogs') or [])}
+
+        # the number of catalog and probe calls made
+        self.calls: int = 0
+        self.probe_calls: int = 0
+
+    @staticmethod
+    def is_pooled(_db_name: str) -> bool:
+        """
+        there is no connection pool
+
+        :return:
+        """
+        return False
+
+    def get_catalog_member_records(self, **_) -> dict:
+        """
+        gets the catalog data
+
+        :return:
+        """
+        # count the call
+        self.calls += 1
+
+        # return a new copy of the data
+        return PayloadUtils.decode_json(self.catalog_text)
+
+    def get_catalog_member_records_filtered(self, **kwargs) -> dict:
+        """
+        gets the catalog data. it is not filtered
+
+        :return:
+        """
+        return self.get_catalog_member_records(**kwargs)
+
+    def stream_catalog_member_records(self, projects=None, **_):
+        """
+        streams the catalog data as (section, project code, record JSON text) rows like the DB cursor does
+
+        :param projects: if passed, the past runs are filtered to these project codes
+        :return:
+        """
+        # count the call
+        self.calls += 1
+
+        # get a new copy of the data
+        catalog_data: dict = PayloadUtils.decode_json(self.catalog_text)
+
+        # the catalog members and then the past runs
+        for section in ('catalogs', 'past_runs'):
+            for record in catalog_data.get(section) or []:
+                if section == 'catalogs' or projects is None or record['project_code'] in projects:
+                    yield section, record['project_code'], PayloadUtils.encode_json(record).decode('utf-8')
+
+    def get_catalog_member_probe(self, **_) -> dict:
+        """
+        gets the project codes and member count of the catalog data
+
+        :return:
+        """
+        # count the call
+        self.probe_calls += 1
+
+        # return a copy
+        return dict(self.probe)
+
+    def close_conn(self):
+        """
+        nothing to close
+
+        :return:
+        """
@@ -0,0 +1,342 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Offline benchmarks for the PSC data sync. The DB and PSC are replaced with local stand-ins
+    and the results are written as JSON so they can be compared across commits.
+
+    usage: python -m src.benchmark.psc_sync_benchmark --sizes 10,1000,100000 --output results.json
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import sys
+import gzip
+import time
+import json
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.common.payload_utils import PayloadUtils
+from src.sync.psc_sync import PSCDataSync
+
+# the modules a run that no collaborator gets must not load
+HEAVY_MODULES: tuple = ('psycopg2', 'requests', 'slack_sdk')
+
+# runs a job for a physical location no collaborator gets in a new process and reports the time and the heavy modules loaded
+STARTUP_SCRIPT: str = f"""
+import sys, json, time
+start = time.perf_counter()
+import main
+main.run_psc_collab_sync('4441-2023072106-gfsforecast', 'RENCI')
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': [name for name in {HEAVY_MODULES} if name in sys.modules]}}))
+"""
+
+
+class PSCStandInHandler(BaseHTTPRequestHandler):
+    """
+    Class that accepts PSC sync requests and counts what it received
+    """
+    # use keep-alive connections like PSC
+    protocol_version: str = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Reads the request body and returns the next scripted status, a success by default
+
+        :return:
+        """
+        # read the body, chunked or not
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks: list = []
+
+            # read each chunk
+            while True:
+                chunk_size: int = int(self.rfile.readline().strip(), 16)
+                chunks.append(self.rfile.read(chunk_size))
+                self.rfile.readline()
+
+                # the last chunk is empty
+                if chunk_size == 0:
+                    break
+
+            body: bytes = b''.join(chunks)
+        else:
+            body: bytes = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+
+        # get the encoding of the body
+        encoding: str = self.headers.get('Content-Encoding')
+
+        # get the status to return, refusing encoded bodies if told to
+        status: int = self.server.statuses.pop(0) if self.server.statuses else 200
+
+        if encoding is not None and not self.server.accept_encoding:
+            status = 415
+
+        # count it
+        self.server.stats['requests'] += 1
+        self.server.stats['bytes'] += len(body)
+
+        # keep the documents that were accepted if asked to
+        if self.server.keep_bodies and status == 200:
+            self.server.bodies.append(PayloadUtils.decode_json(gzip.decompress(body) if encoding == 'gzip' else body))
+
+        # send the response
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *_):
+        """
+        keeps the requests out of the output
+
+        :return:
+        """
+
+
+class PSCStandIn:
+    """
+    Class that runs a local HTTP server in place of the PSC sync endpoint.
+
+    The statuses to return for the next requests can be queued on server.statuses, encoded
+    bodies are refused with a 415 if server.accept_encoding is cleared and the JSON documents
+    accepted are kept on server.bodies if server.keep_bodies is set.
+    """
+
+    def __init__(self):
+        """
+        Initializes this class
+
+        """
+        # create the server on a free port
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PSCStandInHandler)
+        self.server.daemon_threads = True
+        self.server.stats = {'requests': 0, 'bytes': 0}
+        self.server.statuses = []
+        self.server.accept_encoding = True
+        self.server.keep_bodies = False
+        self.server.bodies = []
+
+        # get the URL to use for PSC_SYNC_URL
+        self.url: str = f'http://127.0.0.1:{self.server.server_address[1]}/sync'
+
+        # create the server thread
+        self.thread = threading.Thread(target=self.server.serve_forever, name='psc-stand-in', daemon=True)
+
+    def __enter__(self):
+        """
+        Starts the server
+
+        :return:
+        """
+        self.thread.start()
+
+        return self
+
+    def __exit__(self, *_):
+        """
+        Stops the server
+
+        :return:
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def measure(setup, func, repeat: int = 3) -> dict:
+    """
+    Times a function and gets its peak memory use. Each call gets new arguments from the setup
+    function, which is not timed. The time is taken without tracemalloc, which slows things down.
+
+    :param setup: returns the tuple of arguments for the function
+    :param func: the function to measure
+    :param repeat: the number of timed calls
+    :return:
+    """
+    # init the call times
+    times: list = []
+
+    # for each timed call
+    for _ in range(max(1, repeat)):
+        call_args: tuple = setup()
+
+        start: float = time.perf_counter()
+        func(*call_args)
+        times.append(time.perf_counter() - start)
+
+    # make one more call to get the memory used
+    call_args = setup()
+
+    tracemalloc.start()
+    func(*call_args)
+    peak_bytes: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # return the results
+    return {'seconds_min': min(times), 'seconds_median': statistics.median(times), 'peak_bytes': peak_bytes, 'repeat': len(times)}
+
+
+def measure_startup(repeat: int = 3) -> dict:
+    """
+    Times the start of a new sync process that gets a job no collaborator gets, which should
+    exit without loading the DB driver, the HTTP client or the Slack SDK.
+
+    :param repeat: the number of processes started
+    :return:
+    """
+    # init the process times, the import and run times and the heavy modules loaded
+    times: list = []
+    run_times: list = []
+    modules: set = set()
+
+    # keep the process logs out of the source tree
+    with tempfile.TemporaryDirectory() as log_path:
+        # for each process
+        for _ in range(max(1, repeat)):
+            start: float = time.perf_counter()
+            output: str = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True, timeout=60,
+                                         cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                         env={**os.environ, 'LOG_PATH': log_path}).stdout
+            times.append(time.perf_counter() - start)
+
+            # get what the process reported
+            result: dict = json.loads(output.strip().splitlines()[-1])
+            run_times.append(result['seconds'])
+            modules.update(result['modules'])
+
+    # return the results
+    return {'seconds_min': min(times), 'seconds_median': statistics.median(times), 'import_and_run_seconds_min': min(run_times),
+            'heavy_modules': sorted(modules), 'repeat': len(times)}
+
+
+def run_benchmarks(sizes: list, repeat: int = 3, projects: tuple = ('psc_test',)) -> dict:
+    """
+    Runs the benchmarks for each catalog size
+
+    :param sizes: the catalog member counts
+    :param repeat: the number of timed calls per benchmark
+    :param projects: the PSC project codes
+    :return: the results document
+    """
+    # the sync reads its settings from the environment, use the ones the benchmark needs
+    os.environ['PSC_SYNC_PROJECTS'] = ','.join(projects)
+    os.environ.setdefault('PSC_SYNC_TOKEN', 'benchmark')
+
+    # keep the sync logging quiet
+    logger = logging.getLogger('APSVIZ.PSCSync.Benchmark')
+    logger.setLevel(logging.WARNING)
+
+    # init the results
+    results: list = []
+
+    # start the PSC stand-in
+    with PSCStandIn() as psc:
+        # for each catalog size
+        for size in sizes:
+            # create the catalog data and the DB stand-in
+            db_info = FakePGImplementation(CatalogGenerator(projects).generate(size))
+
+            # create the sync object
+            psc_sync = PSCDataSync(logger, db_info)
+            psc_sync.components.transport.url = psc.url
+
+            # run each benchmark
+            for name, setup, func in get_benchmarks(psc_sync, db_info):
+                results.append({'benchmark': name, 'members': size, 'payload_bytes': len(db_info.catalog_text), **measure(setup, func, repeat)})
+
+            # clean up
+            psc_sync.close()
+
+        # get what PSC received
+        psc_stats: dict = dict(psc.server.stats)
+
+    # return the results document
+    return {'commit': get_commit(), 'python': platform.python_version(), 'json_backend': PayloadUtils.json_backend(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'psc_stand_in': psc_stats, 'startup': measure_startup(repeat), 'results': results}
+
+
+def get_benchmarks(psc_sync: PSCDataSync, db_info: FakePGImplementation) -> list:
+    """
+    Gets the benchmarks to run
+
+    :param psc_sync:
+    :param db_info:
+    :return: a list of (name, setup, function) tuples
+    """
+    # gets a fresh copy of the catalog data
+    def get_data():
+        return (db_info.get_catalog_member_records(),)
+
+    # gets a fresh copy of the catalog data that has been through the filtering
+    def get_filtered_data():
+        return (psc_sync.filter_catalog_past_runs(db_info.get_catalog_member_records()),)
+
+    # return the benchmarks
+    return [('run', lambda: ('4441-2023072106-gfsforecast', 'PSC'), psc_sync.run),
+            ('check_project_codes', get_data, psc_sync.check_project_codes),
+            ('filter_catalog_past_runs', get_data, psc_sync.filter_catalog_past_runs),
+            ('get_unique_catalog_ids', get_data, psc_sync.get_unique_catalog_ids),
+            ('push_to_psc', get_filtered_data, psc_sync.push_to_psc)]
+
+
+def get_commit():
+    """
+    Gets the git commit the benchmarks are run on
+
+    :return: the commit hash or None if it is not known
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    """
+    Runs the benchmarks from the command line
+
+    :return:
+    """
+    # create a command line parser
+    parser = argparse.ArgumentParser(description='Runs the offline PSC data sync benchmarks.')
+
+    # assign the expected input args
+    parser.add_argument('-s', '--sizes', default='10,1000,10000,100000', help='Comma separated catalog member counts')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='The number of timed calls per benchmark')
+    parser.add_argument('-o', '--output', default=None, help='The results file, the results are printed if not set')
+
+    # collect the input arguments
+    args = parser.parse_args()
+
+    # run the benchmarks
+    output: str = json.dumps(run_benchmarks([int(size) for size in args.sizes.split(',')], args.repeat), indent=2)
+
+    # save or print the results
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    # run the benchmarks
+    main()
+
+    # exit the app gracefully
+    sys.exit(0)
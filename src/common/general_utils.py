@@ -14,19 +14,20 @@
 
 import os
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
 from src.common.logger import LoggingUtil
+from src.common.slack_notifier import SlackNotifier
 
 
 class GeneralUtils:
     """
     Utility methods used for components in this project.
     """
-    def __init__(self, _logger=None):
+    def __init__(self, _logger=None, _notifier=None):
         """
         Initializes this class
 
+        :param _logger:
+        :param _notifier: the Slack notifier to use, one is created if not passed
         """
         # if a reference to a logger passed in use it
         if _logger is not None:
@@ -46,6 +47,9 @@ class GeneralUtils:
         # get the environment this instance is running on
         self.system = os.getenv('SYSTEM', 'System name not set')
 
+        # the notifier sends the Slack messages in the background
+        self.notifier: SlackNotifier = _notifier if _notifier is not None else SlackNotifier(self.logger)
+
     def send_slack_msg(self, msg, channel, debug_mode=False):
         """
         sends a msg to the Slack channel
@@ -63,15 +67,19 @@ class GeneralUtils:
 
         # send the message to Slack if not in debug mode and not running locally
         if not debug_mode and self.system in ['Dev', 'Prod', 'AWS/EKS']:
-            # determine the client based on the channel
+            # determine the token based on the channel
             if channel == 'slack_status_channel':
-                client = WebClient(token=os.getenv('SLACK_STATUS_TOKEN'))
+                token = os.getenv('SLACK_STATUS_TOKEN')
             else:
-                client = WebClient(token=os.getenv('SLACK_ISSUES_TOKEN'))
-
-            try:
-                # send the message
-                client.chat_postMessage(channel=self.slack_channels[channel], text=final_msg)
-            except SlackApiError:
-                # log the error
-                self.logger.exception('Slack %s messaging failed. msg: %s', self.slack_channels[channel], final_msg)
+                token = os.getenv('SLACK_ISSUES_TOKEN')
+
+            # queue the message. it is sent in the background, combined with others for the channel
+            self.notifier.send(final_msg, self.slack_channels[channel], token)
+
+    def close(self):
+        """
+        sends any queued Slack messages and stops the notifier
+
+        :return:
+        """
+        self.notifier.close()
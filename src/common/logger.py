@@ -13,14 +13,104 @@
 """
 
 import os
+import json
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+import contextvars
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+
+class RunIdFilter(logging.Filter):
+    """
+        Adds the run id being synced to the log records
+    """
+    def filter(self, record):
+        # add the run id of the current context
+        record.run_id = LoggingUtil.run_id.get()
+
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+        Drops repeats of the same message (by logger, level and format string) beyond a count per time window.
+        The next message let through says how many were dropped.
+    """
+    def __init__(self, count: int, seconds: float):
+        super().__init__()
+
+        # the number of repeats allowed per window
+        self.count: int = count
+        self.seconds: float = seconds
+
+        # the [window start, messages in the window, messages dropped] per message key
+        self.windows: dict = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def filter(self, record):
+        # get the message key and the time
+        key: tuple = (record.name, record.levelno, str(record.msg))
+        now: float = time.monotonic()
+
+        with self.lock:
+            # get the window of this message, starting a new one if it is over
+            window: list = self.windows.get(key)
+
+            if window is None or now - window[0] >= self.seconds:
+                # say how many were dropped in the last window
+                if window is not None and window[2]:
+                    record.msg = f'{record.msg} ({window[2]} similar messages suppressed)'
+
+                # start the new window
+                window = self.windows[key] = [now, 0, 0]
+
+            # is this one over the limit
+            if window[1] >= self.count:
+                window[2] += 1
+
+                return False
+
+            # count it
+            window[1] += 1
+
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+        Formats log records as JSON lines
+    """
+    def format(self, record):
+        # get the fields
+        fields: dict = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name, 'function': record.funcName,
+                        'message': record.getMessage(), 'run_id': getattr(record, 'run_id', None)}
+
+        # add any exception
+        if record.exc_info:
+            fields['exception'] = self.formatException(record.exc_info)
+
+        # return the line
+        return json.dumps(fields, default=str)
 
 
 class LoggingUtil:
     """
         Creates and configures a logger
+
+        The logging environment settings are:
+         - LOG_QUEUE: true to write the log lines on a background thread so logging never blocks the caller
+         - LOG_FORMAT: text (the default) or json for JSON lines with the run id
+         - LOG_RATE_LIMIT_COUNT/LOG_RATE_LIMIT_SECONDS: let a repeated message through this many times per window (0 is off)
     """
+    # the run id being synced in the current context, added to the log records
+    run_id: contextvars.ContextVar = contextvars.ContextVar('run_id', default=None)
+
+    # the background log writers of the queued loggers
+    listeners: list = []
+
     @staticmethod
     def init_logging(name, level=logging.INFO, line_format='short', log_file_path=None):
         """
@@ -41,7 +131,7 @@ class LoggingUtil:
         stream_handler = logging.StreamHandler()
 
         # create a formatter
-        formatter = logging.Formatter(format_type)
+        formatter = JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else logging.Formatter(format_type)
 
         # set the formatter on the console stream
         stream_handler.setFormatter(formatter)
@@ -49,12 +139,26 @@ class LoggingUtil:
         # get the name of this logger
         logger = logging.getLogger(name)
 
+        # it is already set up if it has handlers
+        if logger.handlers:
+            return logger
+
         # set the logging level
         logger.setLevel(level)
 
         # dont allow message propagation
         logger.propagate = False
 
+        # add the run id to the records
+        logger.addFilter(RunIdFilter())
+
+        # limit repeated messages if requested
+        if int(os.getenv('LOG_RATE_LIMIT_COUNT', '0')) > 0:
+            logger.addFilter(RateLimitFilter(int(os.getenv('LOG_RATE_LIMIT_COUNT')), float(os.getenv('LOG_RATE_LIMIT_SECONDS', '60'))))
+
+        # init the list of handlers
+        handlers: list = []
+
         # if there was a file path passed in use it
         if log_file_path is not None:
             # create a rotating file handler, 1mb max per file with a max number of 10 files
@@ -66,15 +170,65 @@ class LoggingUtil:
             # set the log level
             file_handler.setLevel(level)
 
-            # add the handler to the logger
-            logger.addHandler(file_handler)
+            # add the handler
+            handlers.append(file_handler)
+
+        # add the console handler
+        handlers.append(stream_handler)
+
+        # are the log lines written on a background thread
+        if os.getenv('LOG_QUEUE', 'false').lower() in ('true', '1', 'yes'):
+            # create the queue and its listener, which does the writing
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            listener: QueueListener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            listener.start()
 
-        # add the console handler to the logger
-        logger.addHandler(stream_handler)
+            # stop it at exit so everything queued gets written
+            if not LoggingUtil.listeners:
+                atexit.register(LoggingUtil.stop_listeners)
+
+            LoggingUtil.listeners.append(listener)
+
+            # the logger only queues the records
+            handlers = [QueueHandler(log_queue)]
+
+        # add the handlers to the logger
+        for handler in handlers:
+            logger.addHandler(handler)
 
         # return to the caller
         return logger
 
+    @staticmethod
+    def set_run_id(run_id: str):
+        """
+        sets the run id added to the log records of the current context.
+
+        :param run_id:
+        :return: the token to pass to reset_run_id()
+        """
+        return LoggingUtil.run_id.set(run_id)
+
+    @staticmethod
+    def reset_run_id(token):
+        """
+        puts back the run id that was set before set_run_id().
+
+        :param token:
+        :return:
+        """
+        LoggingUtil.run_id.reset(token)
+
+    @staticmethod
+    def stop_listeners():
+        """
+        stops the background log writers after they write what is queued.
+
+        :return:
+        """
+        while LoggingUtil.listeners:
+            LoggingUtil.listeners.pop().stop()
+
     @staticmethod
     def prep_for_logging() -> (int, str):
         """
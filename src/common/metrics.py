@@ -0,0 +1,419 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Sync metrics in the Prometheus text format.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import copy
+import time
+import bisect
+import threading
+import contextlib
+
+from src.common.logger import LoggingUtil
+
+
+class SyncMetrics:
+    """
+    Class that collects the per-stage sync timers and counters and exports them in the Prometheus
+    text format, either to a file for the node exporter textfile collector or over HTTP.
+    """
+
+    # the latency buckets in seconds
+    SECONDS_BUCKETS: tuple = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    # the size buckets in bytes, powers of 4 from 1K to 1G
+    SIZE_BUCKETS: tuple = tuple(4 ** power for power in range(5, 16))
+
+    # the record count buckets
+    COUNT_BUCKETS: tuple = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    # the metrics: name: (type, help, buckets)
+    METRICS: dict = {
+        'runs_total': ('counter', 'Sync runs by result.', None),
+        'run_seconds': ('histogram', 'Time to sync a run.', SECONDS_BUCKETS),
+        'last_run_timestamp_seconds': ('gauge', 'When the last run finished.', None),
+        'db_query_seconds': ('histogram', 'Time spent in the catalog DB queries.', SECONDS_BUCKETS),
+        'db_result_bytes': ('histogram', 'Size of the catalog DB query results.', SIZE_BUCKETS),
+        'db_errors_total': ('counter', 'Catalog DB query failures.', None),
+        'query_cache_requests_total': ('counter', 'Catalog query cache lookups by result.', None),
+        'query_cache_bytes': ('gauge', 'Size of the catalog query results in the cache.', None),
+        'db_reconnect_total': ('counter', 'Catalog DB connection attempts, failed attempts and times the reconnect policy limits were hit, by event.',
+                               None),
+        'db_reconnect_wait_seconds_total': ('counter', 'Time spent waiting to reconnect to the catalog DB.', None),
+        'db_pool_connections': ('gauge', 'Catalog DB pool connections by DB and state.', None),
+        'db_pool_events_total': ('counter', 'Catalog DB pool checkouts, timeouts, failed checks and connection changes, by DB and event.', None),
+        'members_total': ('counter', 'Catalog members fetched from the DB and left to send after filtering, by stage.', None),
+        'past_runs_total': ('counter', 'Past runs fetched from the DB and left to send after filtering, by stage.', None),
+        'members_per_run': ('histogram', 'Catalog members fetched per run.', COUNT_BUCKETS),
+        'probe_skipped_total': ('counter', 'Runs not fetched because the probe found no catalogs or catalogs not for the collaborator, by reason.',
+                                None),
+        'pipeline_stage_seconds_total': ('counter', 'Time spent in each catalog pipeline stage.', None),
+        'serialize_seconds': ('histogram', 'Time to serialize a request body.', SECONDS_BUCKETS),
+        'request_bytes': ('histogram', 'Size of the request bodies before compression.', SIZE_BUCKETS),
+        'sent_bytes_total': ('counter', 'Bytes sent in request bodies after compression.', None),
+        'post_seconds': ('histogram', 'Latency of the POST requests.', SECONDS_BUCKETS),
+        'post_requests_total': ('counter', 'POST requests by HTTP status.', None),
+        'post_retries_total': ('counter', 'POST requests that were resent, by reason.', None),
+        'outbox_depth': ('gauge', 'Failed pushes waiting in the outbox.', None),
+        'outbox_drained_total': ('counter', 'Failed pushes sent from the outbox.', None)
+    }
+
+    # the metrics of the DB fetch, which is shared by the collaborators of a run, so child labels are not added to them
+    SHARED_METRICS: tuple = ('db_query_seconds', 'db_result_bytes', 'db_errors_total', 'query_cache_requests_total', 'query_cache_bytes',
+                             'db_reconnect_total', 'db_reconnect_wait_seconds_total', 'db_pool_connections', 'db_pool_events_total')
+
+    def __init__(self, namespace: str = 'psc_sync', _logger=None):
+        """
+        Initializes this class
+
+        :param namespace: the prefix of the metric names
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.SyncMetrics", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the prefix of the metric names
+        self.namespace: str = namespace
+
+        # the values by metric name and label tuple. histograms have a [bucket counts, sum, count] list
+        self.values: dict = {name: {} for name in self.METRICS}
+
+        # guards the values
+        self.lock: threading.Lock = threading.Lock()
+
+        # the labels added to everything recorded through this object
+        self.labels: dict = {}
+
+        # the HTTP server in long-running mode
+        self.http_server = None
+
+        # the callables that update the metrics kept elsewhere before they are rendered
+        self.collectors: list = []
+
+    def add_collector(self, collector):
+        """
+        Adds a callable that is run before the metrics are rendered, e.g. to copy in the counters of another object
+
+        :param collector:
+        :return:
+        """
+        self.collectors.append(collector)
+
+    def child(self, **labels):
+        """
+        Gets a view of these metrics that adds labels to everything recorded through it. The
+        values, lock and HTTP server stay with this object.
+
+        :param labels:
+        :return:
+        """
+        # copy this object, sharing the values and the lock
+        ret_val = copy.copy(self)
+
+        # add the labels
+        ret_val.labels = {**self.labels, **labels}
+        ret_val.http_server = None
+
+        # return to the caller
+        return ret_val
+
+    def get_key(self, name: str, labels: dict) -> tuple:
+        """
+        Gets the label key of a value
+
+        :param name:
+        :param labels:
+        :return:
+        """
+        # add the child labels unless this metric is shared
+        if self.labels and name not in self.SHARED_METRICS:
+            labels = {**self.labels, **labels}
+
+        # return to the caller
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Adds to a counter
+
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        # get the label key
+        key: tuple = self.get_key(name, labels)
+
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Sets a gauge
+
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        with self.lock:
+            self.values[name][self.get_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Adds a value to a histogram
+
+        :param name:
+        :param value:
+        :param labels:
+        :return:
+        """
+        # get the histogram buckets and the label key
+        buckets: tuple = self.METRICS[name][2]
+        key: tuple = self.get_key(name, labels)
+
+        with self.lock:
+            # get the histogram, creating it if this is the first value
+            histogram: list = self.values[name].setdefault(key, [[0] * len(buckets), 0, 0])
+
+            # count the value in the first bucket it fits in. the buckets are made cumulative when rendered
+            index: int = bisect.bisect_left(buckets, value)
+
+            if index < len(buckets):
+                histogram[0][index] += 1
+
+            # add it to the sum and count
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Times the code in a with block and adds it to a histogram
+
+        :param name:
+        :param labels:
+        :return:
+        """
+        # get the start time
+        start: float = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def count_records(self, catalog_data: dict, stage: str):
+        """
+        Adds the catalog member and past run counts of a run to the metrics
+
+        :param catalog_data:
+        :param stage: fetched or filtered
+        :return:
+        """
+        self.inc('members_total', len(catalog_data.get('catalogs') or []), stage=stage)
+        self.inc('past_runs_total', len(catalog_data.get('past_runs') or []), stage=stage)
+
+    def collect_db_stats(self, db_info):
+        """
+        Copies the query cache, reconnect and connection pool counters of a DB connection object into the metrics.
+        The counters the DB object does not have are skipped.
+
+        :param db_info: the DB connection object, nothing is done if it is None
+        :return:
+        """
+        # get the query cache counts if there is a cache
+        query_cache = getattr(db_info, 'query_cache', None)
+
+        if query_cache is not None:
+            stats: dict = query_cache.get_stats()
+
+            self.set('query_cache_requests_total', stats['hits'], result='hit')
+            self.set('query_cache_requests_total', stats['misses'], result='miss')
+            self.set('query_cache_bytes', stats['bytes'])
+
+        # get the reconnect counts
+        if hasattr(db_info, 'get_reconnect_stats'):
+            stats: dict = db_info.get_reconnect_stats()
+
+            for event, name in (('attempt', 'attempts'), ('failure', 'failures'), ('exhausted', 'exhausted')):
+                self.set('db_reconnect_total', stats[name], event=event)
+
+            self.set('db_reconnect_wait_seconds_total', stats['wait_seconds'])
+
+        # get the counts of each pooled DB
+        if hasattr(db_info, 'get_pool_stats'):
+            for db_name, stats in db_info.get_pool_stats().items():
+                for state, name in (('open', 'size'), ('idle', 'idle'), ('in_use', 'in_use')):
+                    self.set('db_pool_connections', stats[name], db=db_name, state=state)
+
+                for event in ('checkouts', 'waits', 'timeouts', 'failed_checks', 'created', 'closed', 'discarded', 'evicted_idle',
+                              'evicted_lifetime'):
+                    self.set('db_pool_events_total', stats[event], db=db_name, event=event)
+
+    @staticmethod
+    def format_labels(key: tuple, extra: tuple = ()) -> str:
+        """
+        Formats a label key for the text format
+
+        :param key:
+        :param extra: more label pairs to add
+        :return:
+        """
+        # get all the labels
+        labels: tuple = key + extra
+
+        # no labels means no braces
+        if not labels:
+            return ''
+
+        # escape the values
+        return '{' + ','.join(f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                              for name, value in labels) + '}'
+
+    def render(self) -> str:
+        """
+        Gets the metrics in the Prometheus text format
+
+        :return:
+        """
+        # bring in the metrics kept elsewhere
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                self.logger.exception('Error: Failed to collect the metrics.')
+
+        # init the output lines
+        lines: list = []
+
+        with self.lock:
+            # for each metric
+            for name, (kind, help_text, buckets) in self.METRICS.items():
+                # get the full name
+                full_name: str = f'{self.namespace}_{name}'
+
+                # add the header
+                lines.extend([f'# HELP {full_name} {help_text}', f'# TYPE {full_name} {kind}'])
+
+                # for each label set
+                for key, value in sorted(self.values[name].items()):
+                    if kind == 'histogram':
+                        # add the cumulative buckets
+                        total: int = 0
+
+                        for bound, count in zip(buckets, value[0]):
+                            total += count
+                            lines.append(f'{full_name}_bucket{self.format_labels(key, (("le", f"{bound:g}"),))} {total}')
+
+                        # add the rest
+                        lines.extend([f'{full_name}_bucket{self.format_labels(key, (("le", "+Inf"),))} {value[2]}',
+                                      f'{full_name}_sum{self.format_labels(key)} {value[1]:g}',
+                                      f'{full_name}_count{self.format_labels(key)} {value[2]}'])
+                    else:
+                        lines.append(f'{full_name}{self.format_labels(key)} {value:g}')
+
+        # return the text
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, file_path: str):
+        """
+        Writes the metrics to a file for the textfile collector. The file is replaced in one step
+        so the collector never reads a partial file.
+
+        :param file_path:
+        :return:
+        """
+        try:
+            # write to a temp file next to the target
+            temp_path: str = f'{file_path}.{os.getpid()}.tmp'
+
+            with open(temp_path, 'w', encoding='utf-8') as fp:
+                fp.write(self.render())
+
+            # move it into place
+            os.replace(temp_path, file_path)
+        except OSError:
+            self.logger.exception('Error: Failed to write the metrics file %s.', file_path)
+
+    def start_http_server(self, port: int, address: str = '0.0.0.0'):
+        """
+        Serves the metrics over HTTP on a background thread
+
+        :param port:
+        :param address:
+        :return: the server
+        """
+        # the HTTP server is only loaded when it is needed
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # pylint: disable=import-outside-toplevel
+
+        # get a reference to this object for the handler
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """
+            Class that returns the metrics for any GET request
+            """
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Sends the metrics
+
+                :return:
+                """
+                # get the metrics
+                body: bytes = metrics.render().encode('utf-8')
+
+                # send them
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                """
+                keeps the scrapes out of the log
+
+                :return:
+                """
+
+        # create the server
+        self.http_server = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.http_server.daemon_threads = True
+
+        # serve the requests
+        threading.Thread(target=self.http_server.serve_forever, name='sync-metrics', daemon=True).start()
+
+        self.logger.info('Serving sync metrics on %s:%s.', address, self.http_server.server_address[1])
+
+        # return to the caller
+        return self.http_server
+
+    def close(self):
+        """
+        Stops the HTTP server if there is one
+
+        :return:
+        """
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
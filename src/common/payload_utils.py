@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Payload utilities - serialization and compression of request bodies.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import json
+import gzip
+import zlib
+
+# zstd support is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the fast JSON backend is optional and can be turned off with JSON_BACKEND=json
+try:
+    if os.getenv('JSON_BACKEND', 'auto').lower() == 'json':
+        raise ImportError('The standard library JSON backend was requested.')
+
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PayloadUtils:
+    """
+    Methods to serialize and compress the payloads sent to collaborators.
+    """
+    @staticmethod
+    def supported_encodings() -> list:
+        """
+        gets the content encodings available in this environment
+
+        :return:
+        """
+        # gzip is always there
+        ret_val: list = ['gzip']
+
+        # zstd is only there if the package is installed
+        if zstandard is not None:
+            ret_val.append('zstd')
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def json_backend() -> str:
+        """
+        gets the name of the JSON backend in use
+
+        :return:
+        """
+        return 'orjson' if orjson is not None else 'json'
+
+    @staticmethod
+    def encode_json(data) -> bytes:
+        """
+        serializes data to a compact UTF-8 JSON body
+
+        :param data:
+        :return:
+        """
+        # use the fast backend if it is there
+        if orjson is not None:
+            return orjson.dumps(data)
+
+        # return the encoded data
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def decode_json(data):
+        """
+        deserializes a JSON document from bytes or a string
+
+        :param data:
+        :return:
+        """
+        # use the fast backend if it is there
+        if orjson is not None:
+            return orjson.loads(data)
+
+        # return the decoded data
+        return json.loads(data)
+
+    @staticmethod
+    def compress(body: bytes, encoding: str) -> bytes:
+        """
+        compresses a request body with the content encoding specified
+
+        :param body:
+        :param encoding:
+        :return:
+        """
+        # compress with the requested encoding
+        if encoding == 'gzip':
+            ret_val: bytes = gzip.compress(body, compresslevel=6)
+        elif encoding == 'zstd' and zstandard is not None:
+            ret_val: bytes = zstandard.ZstdCompressor(level=3).compress(body)
+        else:
+            raise ValueError(f'Unsupported content encoding: {encoding}')
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def compress_stream(chunks, encoding: str):
+        """
+        compresses a stream of body chunks with the content encoding specified
+
+        :param chunks: an iterable of bytes
+        :param encoding:
+        :return: a generator of compressed bytes
+        """
+        # create the incremental compressor
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif encoding == 'zstd' and zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError(f'Unsupported content encoding: {encoding}')
+
+        # compress each chunk, only passing on output when there is some
+        for chunk in chunks:
+            # compress the chunk
+            data: bytes = compressor.compress(chunk)
+
+            if data:
+                yield data
+
+        # send what is left
+        yield compressor.flush()
+
+    @staticmethod
+    def buffer_stream(chunks, size: int = 65536):
+        """
+        joins small body chunks into larger ones so each HTTP chunk is worth sending
+
+        :param chunks: an iterable of bytes
+        :param size: the minimum size of the chunks returned, except the last one
+        :return: a generator of bytes
+        """
+        # init the buffer
+        buffer: list = []
+        buffered: int = 0
+
+        # for each chunk
+        for chunk in chunks:
+            # add it to the buffer
+            buffer.append(chunk)
+            buffered += len(chunk)
+
+            # send the buffer when it is full
+            if buffered >= size:
+                yield b''.join(buffer)
+
+                # reset the buffer
+                buffer = []
+                buffered = 0
+
+        # send what is left
+        if buffer:
+            yield b''.join(buffer)
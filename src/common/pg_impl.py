@@ -12,7 +12,10 @@
     Author: Phil Owen, RENCI.org
 """
 
+import os
+
 from src.common.pg_utils_multi import PGUtilsMultiConnect
+from src.common.query_cache import QueryCache
 from src.common.logger import LoggingUtil
 
 
@@ -24,6 +27,93 @@ class PGImplementation(PGUtilsMultiConnect):
         which has all the connection and cursor handling.
     """
 
+    # the catalog member SP call with bound parameters
+    CATALOG_MEMBER_SQL: str = ("SELECT public.get_catalog_member_records(_run_id := %s, _project_code := %s, _filter_event_type := %s, "
+                               "_limit := %s);")
+
+    # the same call as a server-side prepared statement
+    CATALOG_MEMBER_STMT: str = 'get_catalog_member_records_stmt'
+    CATALOG_MEMBER_PREPARE_SQL: str = (f"PREPARE {CATALOG_MEMBER_STMT} (text, text, text, integer) AS SELECT public.get_catalog_member_records("
+                                       f"_run_id := $1, _project_code := $2, _filter_event_type := $3, _limit := $4);")
+
+    # wraps a catalog member SP call to apply the project code filter in the DB. the past runs not for one of the project
+    # codes are removed, leaving an empty list if none are, and the catalogs are passed through untouched. if a catalog is
+    # not for one of the project codes the catalogs are dropped and the codes found are returned in excluded_project_codes
+    # so the caller can reject the run without downloading it
+    CATALOG_MEMBER_FILTER_SQL: str = ("SELECT CASE WHEN json_typeof(sp.data->'catalogs') IS DISTINCT FROM 'array' THEN sp.data "
+                                      "WHEN excluded.codes IS NOT NULL THEN json_build_object('catalogs', '[]'::json, 'past_runs', NULL, "
+                                      "'excluded_project_codes', excluded.codes) "
+                                      "WHEN json_typeof(sp.data->'past_runs') IS DISTINCT FROM 'array' THEN sp.data "
+                                      "ELSE json_build_object('catalogs', sp.data->'catalogs', 'past_runs', COALESCE((SELECT json_agg(rec.value "
+                                      "ORDER BY rec.pos) FROM json_array_elements(CASE WHEN json_typeof(sp.data->'past_runs') = 'array' "
+                                      "THEN sp.data->'past_runs' ELSE '[]'::json END) WITH ORDINALITY AS rec (value, pos) "
+                                      "WHERE rec.value->>'project_code' = ANY({projects})), '[]'::json)) END "
+                                      "FROM (SELECT {records}::json AS data) AS sp "
+                                      "CROSS JOIN LATERAL (SELECT json_agg(DISTINCT rec->>'project_code') AS codes "
+                                      "FROM json_array_elements(CASE WHEN json_typeof(sp.data->'catalogs') = 'array' THEN sp.data->'catalogs' "
+                                      "ELSE '[]'::json END) AS rec WHERE (rec->>'project_code' = ANY({projects})) IS NOT TRUE) AS excluded")
+
+    # the filtered catalog member SP call with bound parameters
+    CATALOG_MEMBER_FILTERED_SQL: str = CATALOG_MEMBER_FILTER_SQL.format(
+        records="public.get_catalog_member_records(_run_id := %(run_id)s, _project_code := %(project_code)s, "
+                "_filter_event_type := %(filter_event_type)s, _limit := %(limit)s)", projects='%(projects)s::text[]') + ';'
+
+    # the same call as a server-side prepared statement
+    CATALOG_MEMBER_FILTERED_STMT: str = 'get_catalog_member_records_filtered_stmt'
+    CATALOG_MEMBER_FILTERED_PREPARE_SQL: str = (f"PREPARE {CATALOG_MEMBER_FILTERED_STMT} (text, text, text, integer, text[]) AS " +
+                                                CATALOG_MEMBER_FILTER_SQL.format(
+                                                    records="public.get_catalog_member_records(_run_id := $1, _project_code := $2, "
+                                                            "_filter_event_type := $3, _limit := $4)", projects='$5') + ';')
+
+    # the catalog member SP call returned as JSON text prefixed with a flag: N - no catalogs, P - every catalog and past run
+    # has one of the project codes passed so the text can be sent as is, F - some records need to be filtered out
+    CATALOG_MEMBER_TEXT_SQL: str = ("SELECT CASE WHEN json_typeof(sp.data->'catalogs') IS DISTINCT FROM 'array' THEN 'N' "
+                                    "WHEN EXISTS (SELECT 1 FROM json_array_elements(sp.data->'catalogs') AS rec "
+                                    "WHERE (rec->>'project_code' = ANY(%(projects)s::text[])) IS NOT TRUE) "
+                                    "OR (json_typeof(sp.data->'past_runs') = 'array' "
+                                    "AND EXISTS (SELECT 1 FROM json_array_elements(sp.data->'past_runs') AS rec "
+                                    "WHERE (rec->>'project_code' = ANY(%(projects)s::text[])) IS NOT TRUE)) "
+                                    "THEN 'F' ELSE 'P' END || sp.data::text "
+                                    "FROM (SELECT public.get_catalog_member_records(_run_id := %(run_id)s, _project_code := %(project_code)s, "
+                                    "_filter_event_type := %(filter_event_type)s, _limit := %(limit)s)::json AS data) AS sp;")
+
+    # the catalog member SP call split into rows of (section, project code, record JSON text), catalogs first, in SP order.
+    # past runs not for one of the project codes passed are left out, all are returned if no project codes are passed
+    CATALOG_MEMBER_ROWS_SQL: str = ("WITH sp AS (SELECT public.get_catalog_member_records(_run_id := %(run_id)s, _project_code := %(project_code)s, "
+                                    "_filter_event_type := %(filter_event_type)s, _limit := %(limit)s)::json AS data) "
+                                    "SELECT sections.name, rec.value->>'project_code', rec.value::text FROM sp "
+                                    "CROSS JOIN (VALUES (1, 'catalogs'), (2, 'past_runs')) AS sections (ord, name) "
+                                    "CROSS JOIN LATERAL json_array_elements(CASE WHEN json_typeof(sp.data->sections.name) = 'array' "
+                                    "THEN sp.data->sections.name ELSE '[]'::json END) WITH ORDINALITY AS rec (value, pos) "
+                                    "WHERE %(projects)s::text[] IS NULL OR sections.name = 'catalogs' "
+                                    "OR rec.value->>'project_code' = ANY(%(projects)s::text[]) "
+                                    "ORDER BY sections.ord, rec.pos;")
+
+    # counts the catalog members of a run and gets their distinct, non-null project codes straight from the catalog member table,
+    # selecting the members like the SP does (run id prefix), so the catalog document is never built. the run id expression
+    # index in migrations/001_catalog_member_run_id_index.sql keeps this an index scan
+    CATALOG_MEMBER_PROBE_SQL: str = ("SELECT json_build_object('project_codes', COALESCE(json_agg(DISTINCT project_code) FILTER "
+                                     "(WHERE project_code IS NOT NULL), '[]'::json), 'member_count', COUNT(*)) "
+                                     "FROM public.catalog_member WHERE member_def->>'run_id' LIKE %(run_id)s;")
+
+    # checks that the catalog table version rows are installed (migrations/002_catalog_data_version.sql) without failing if they are not
+    CATALOG_VERSION_TABLE_SQL: str = "SELECT to_regclass('public.catalog_data_version') IS NOT NULL;"
+
+    # gets the version of the catalog tables from their version rows. -1 if one of the tables has no version row, so the cache is not used
+    CATALOG_VERSION_SQL: str = ("SELECT CASE WHEN COUNT(*) = cardinality(%(tables)s::text[]) THEN SUM(version)::bigint ELSE -1 END "
+                                "FROM public.catalog_data_version WHERE table_name = ANY(%(tables)s::text[]);")
+
+    # selects the run ids (and when they were first seen) of the catalog members inserted in a time window. all criteria are optional
+    RUN_ID_WINDOW_SQL: str = ("SELECT member_def->>'run_id' AS run_id, MIN(insert_date) AS first_insert FROM public.catalog_member "
+                              "WHERE (%(project_code)s::text IS NULL OR project_code = %(project_code)s) "
+                              "AND (%(start_date)s::timestamp IS NULL OR insert_date >= %(start_date)s::timestamp) "
+                              "AND (%(end_date)s::timestamp IS NULL OR insert_date < %(end_date)s::timestamp) "
+                              "GROUP BY member_def->>'run_id'")
+
+    # gets a run property, e.g. the physical location, from the ASGS run properties. the run id is the instance id and the uid
+    RUN_PROPERTY_SQL: str = ('SELECT value FROM public."ASGS_Mon_config_item" WHERE instance_id = %(instance_id)s AND uid = %(uid)s '
+                             'AND key = %(key)s ORDER BY id DESC LIMIT 1;')
+
     def __init__(self, db_names: tuple, _logger=None, _auto_commit=True):
         # if a reference to a logger passed in use it
         if _logger is not None:
@@ -40,6 +130,25 @@ class PGImplementation(PGUtilsMultiConnect):
         # init the base class
         PGUtilsMultiConnect.__init__(self, 'APSViz.Collab_sync.PGImplementation', db_names, _logger=self.logger, _auto_commit=_auto_commit)
 
+        # use server-side prepared statements unless turned off (e.g. behind a transaction pooling proxy)
+        self.use_prepared: bool = os.getenv('APSVIZ_DB_PREPARED_STATEMENTS', 'true').lower() in ('true', '1', 'yes')
+
+        # create the catalog query result cache if enabled. it is emptied when the version of the catalog tables changes
+        cache_max_entries: int = int(os.getenv('APSVIZ_DB_CACHE_MAX_ENTRIES', '0'))
+
+        self.query_cache = QueryCache(cache_max_entries, int(os.getenv('APSVIZ_DB_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+                                      float(os.getenv('APSVIZ_DB_CACHE_TTL', '300')), self.logger) if cache_max_entries > 0 else None
+
+        # the tables whose changes empty the cache
+        self.cache_tables: list = os.getenv('APSVIZ_DB_CACHE_TABLES', 'catalog_member').split(',')
+
+        # the cache can't tell when the catalogs change without the version table, so it is turned off
+        if self.query_cache is not None and self.exec_sql('apsviz', self.CATALOG_VERSION_TABLE_SQL) is not True:
+            self.logger.warning('Warning: public.catalog_data_version is not installed (migrations/002_catalog_data_version.sql), '
+                                'the catalog query cache is off.')
+
+            self.query_cache = None
+
     def __del__(self):
         """
         Calls super base class to clean up DB connections and cursors.
@@ -60,39 +169,235 @@ class PGImplementation(PGUtilsMultiConnect):
         :param limit:
         :return:
         """
+        # create the bound parameters. note we are appending a '%' wildcard to the run id to get all products for this run
+        params: tuple = (f'{run_id}%' if run_id is not None else None, project_code, filter_event_type, limit)
+
+        # get the records, from the cache if there is one
+        return self.get_cached((run_id, project_code, filter_event_type, limit, None), lambda: self.query_catalog_member_records(params))
+
+    def get_catalog_member_records_filtered(self, run_id: str = None, projects=None) -> dict:
+        """
+        gets the apsviz catalog member record for the run id passed, filtered to the project codes passed in the DB
+
+        :param run_id:
+        :param projects: the project codes the records are filtered to
+        :return:
+        """
+        # create the bound parameters. note we are appending a '%' wildcard to the run id to get all products for this run
+        params: tuple = (f'{run_id}%' if run_id is not None else None, None, None, None)
+
+        # get the records, from the cache if there is one
+        return self.get_cached((run_id, None, None, None, tuple(sorted(projects))), lambda: self.query_catalog_member_records(params, projects))
+
+    def get_cached(self, key: tuple, query) -> dict:
+        """
+        gets the result of a catalog member query from the cache, making the query on a miss.
+        the run id must be the first item of the key, see invalidate_run().
+
+        :param key: the cache key
+        :param query: makes the DB call
+        :return:
+        """
+        # is there a cache
+        if self.query_cache is None:
+            return query()
+
+        # get the version of the catalog data. the cache can't be used if it is not known
+        version = self.exec_sql('apsviz', self.CATALOG_VERSION_SQL, {'tables': self.cache_tables})
+
+        if not isinstance(version, int) or version < 0:
+            return query()
+
+        # empty the cache if the data changed
+        self.query_cache.check_version(version)
+
+        # look for the result
+        ret_val = self.query_cache.get(key)
+
+        # was it a miss
+        if ret_val is None:
+            # get the result
+            ret_val = query()
+
+            # save it if the query worked
+            if isinstance(ret_val, dict):
+                self.query_cache.put(key, ret_val, version)
 
+        # return the data
+        return ret_val
+
+    def invalidate_run(self, run_id: str):
+        """
+        drops the cached catalog member records of a run, e.g. when it is known to have new members
+
+        :param run_id:
+        :return:
+        """
+        if self.query_cache is not None:
+            self.query_cache.invalidate(lambda key: key[0] == run_id)
+
+    def query_catalog_member_records(self, params: tuple, projects=None) -> dict:
+        """
+        gets the apsviz catalog member record for the run id passed from the DB. see get_catalog_member_records()
+
+        :param params: the run id pattern, project code, event type filter and limit
+        :param projects: if passed, the project codes the records are filtered to in the DB
+        :return:
+        """
         # init the return
         ret_val: dict = {}
 
-        # did we get a run id
-        if run_id is not None:
-            run_id = f"_run_id := '{run_id}%'"
+        # are the records filtered in the DB
+        if projects is not None:
+            # use the statement prepared on this connection if enabled
+            if self.use_prepared:
+                # get the layer list
+                ret_val = self.exec_sql('apsviz', f'EXECUTE {self.CATALOG_MEMBER_FILTERED_STMT} (%s, %s, %s, %s, %s);', params + (sorted(projects),),
+                                        prepare=(self.CATALOG_MEMBER_FILTERED_STMT, self.CATALOG_MEMBER_FILTERED_PREPARE_SQL))
+            else:
+                # get the layer list
+                ret_val = self.exec_sql('apsviz', self.CATALOG_MEMBER_FILTERED_SQL,
+                                        {'run_id': params[0], 'project_code': params[1], 'filter_event_type': params[2], 'limit': params[3],
+                                         'projects': sorted(projects)})
+        # use the statement prepared on this connection if enabled
+        elif self.use_prepared:
+            # get the layer list
+            ret_val = self.exec_sql('apsviz', f'EXECUTE {self.CATALOG_MEMBER_STMT} (%s, %s, %s, %s);', params,
+                                    prepare=(self.CATALOG_MEMBER_STMT, self.CATALOG_MEMBER_PREPARE_SQL))
         else:
-            run_id = '_run_id := NULL'
+            # get the layer list
+            ret_val = self.exec_sql('apsviz', self.CATALOG_MEMBER_SQL, params)
 
-        # did we get a project code
-        if project_code is not None:
-            project_code = f", _project_code := '{project_code}'"
-        else:
-            project_code = ', _project_code := NULL'
+        # return the data
+        return ret_val
 
-        # did we get a filter event type
-        if filter_event_type is not None:
-            filter_event_type = f", _filter_event_type := '{filter_event_type}'"
-        else:
-            filter_event_type = ', _filter_event_type := NULL'
+    def get_catalog_member_records_text(self, run_id: str = None, projects: list = None):
+        """
+        gets the apsviz catalog member record for the run id passed as undecoded JSON text, along with
+        whether every record already has one of the project codes passed.
 
-        # did we get a limit
-        if limit is not None:
-            limit = f', _limit := {limit}'
-        else:
-            limit = ', _limit := NULL'
+        :param run_id:
+        :param projects: the project codes that do not need to be filtered out
+        :return: a (flag, JSON text) tuple, flag is N - no catalogs, P - nothing to filter, F - needs filtering. 0 if the SP
+                 returned nothing, -1 on error
+        """
+        # create the bound parameters. note we are appending a '%' wildcard to the run id to get all products for this run
+        params: dict = {'run_id': f'{run_id}%' if run_id is not None else None, 'projects': list(projects or []), 'project_code': None,
+                        'filter_event_type': None, 'limit': None}
+
+        # get the flagged text
+        ret_val = self.exec_sql('apsviz', self.CATALOG_MEMBER_TEXT_SQL, params)
+
+        # split the flag off the text
+        if isinstance(ret_val, str):
+            ret_val = (ret_val[0], ret_val[1:])
+
+        # return the data
+        return ret_val
+
+    def stream_catalog_member_records(self, run_id: str = None, projects=None, itersize: int = 1000):
+        """
+        streams the apsviz catalog member records for the run id passed one record at a time,
+        without building the whole document in memory. errors are raised to the caller.
+
+        :param run_id:
+        :param projects: if passed, the past runs are filtered to these project codes in the DB
+        :param itersize: the number of records fetched per round trip
+        :return: a generator of (section, project code, record JSON text) tuples. section is catalogs or past_runs
+        """
+        # create the bound parameters. note we are appending a '%' wildcard to the run id to get all products for this run
+        params: dict = {'run_id': f'{run_id}%' if run_id is not None else None, 'project_code': None, 'filter_event_type': None, 'limit': None,
+                        'projects': sorted(projects) if projects is not None else None}
+
+        # return the record generator
+        return self.stream_sql('apsviz', self.CATALOG_MEMBER_ROWS_SQL, params, itersize)
+
+    def get_catalog_member_probe(self, run_id: str = None) -> dict:
+        """
+        gets the distinct project codes and the number of the catalog members of a run, which
+        is much cheaper than sending the catalog member records back.
+
+        :param run_id:
+        :return: a dict with project_codes and member_count, -1 on error
+        """
+        # get the counts. note we are appending a '%' wildcard to the run id to get all products for this run
+        return self.exec_sql('apsviz', self.CATALOG_MEMBER_PROBE_SQL, {'run_id': f'{run_id}%' if run_id is not None else None})
+
+    def get_run_physical_location(self, run_id: str, db_name: str = 'asgs'):
+        """
+        gets the physical location of a run from the ASGS run properties
+
+        :param run_id: <instance id>-<uid>
+        :param db_name: the DB with the run properties
+        :return: the physical location or None if it is not known
+        """
+        # split the run id into the instance id and the uid
+        instance_id, _, uid = run_id.partition('-')
+
+        # is it a legit run id
+        if not instance_id.isdigit() or not uid:
+            return None
+
+        # get the property
+        ret_val = self.exec_sql(db_name, self.RUN_PROPERTY_SQL, {'instance_id': int(instance_id), 'uid': uid, 'key': 'physical_location'})
+
+        # return the data, nothing found is not known
+        return ret_val if isinstance(ret_val, str) and ret_val else None
+
+    def get_catalog_run_ids(self, project_code: str = None, start_date: str = None, end_date: str = None):
+        """
+        gets the run ids that have catalog members inserted in the time window specified.
+        all of the criteria are optional.
+
+        :param project_code:
+        :param start_date: inclusive start of the window
+        :param end_date: exclusive end of the window
+        :return: a list of run ids, oldest first
+        """
+        # create the sql
+        sql: str = f"SELECT json_agg(run_id ORDER BY first_insert) FROM ({self.RUN_ID_WINDOW_SQL}) AS runs;"
+
+        # get the run ids
+        ret_val = self.exec_sql('apsviz', sql, {'project_code': project_code, 'start_date': start_date, 'end_date': end_date})
+
+        # an empty result means no runs
+        if ret_val == 0:
+            ret_val = []
+
+        # return the data
+        return ret_val
+
+    def get_catalog_member_records_bulk(self, run_ids: list = None, window: dict = None, projects=None):
+        """
+        gets the apsviz catalog member records for many runs in a single database call. the runs
+        are either the list of run ids passed or the ones that got catalog members in the time window.
+
+        :param run_ids:
+        :param window: the project_code, start_date (inclusive) and/or end_date (exclusive) of the runs if a list is not passed
+        :param projects: if passed, the project codes the records are filtered to in the DB
+        :return: a dict of run id to catalog member records
+        """
+        # get the source of the run ids, either the list passed or the runs in the time window
+        run_id_sql: str = "SELECT unnest(%(run_ids)s::text[]) AS run_id" if run_ids is not None else self.RUN_ID_WINDOW_SQL
+
+        # get the SP call that gets the results for all the products of a run
+        records_sql: str = ("public.get_catalog_member_records(_run_id := runs.run_id || '%%', _project_code := %(project_code)s, "
+                            "_filter_event_type := %(filter_event_type)s, _limit := %(limit)s)")
+
+        # filter the records of each run in the DB if requested
+        if projects is not None:
+            records_sql = f"({self.CATALOG_MEMBER_FILTER_SQL.format(records=records_sql, projects='%(projects)s::text[]')})"
+
+        # create the sql
+        sql: str = f"SELECT json_object_agg(runs.run_id, {records_sql}) FROM ({run_id_sql}) AS runs;"
 
-        # create the sql. note we are appending a '%' wildcard to get all products for this run
-        sql: str = f"SELECT public.get_catalog_member_records({run_id}{project_code}{filter_event_type}{limit});"
+        # get the catalogs for all the runs
+        ret_val = self.exec_sql('apsviz', sql, dict({'project_code': None, 'start_date': None, 'end_date': None}, **(window or {}), run_ids=run_ids,
+                                                     filter_event_type=None, limit=None, projects=sorted(projects) if projects is not None else None))
 
-        # get the layer list
-        ret_val = self.exec_sql('apsviz', sql)
+        # an empty result means no runs
+        if ret_val == 0:
+            ret_val = {}
 
         # return the data
         return ret_val
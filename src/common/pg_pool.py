@@ -0,0 +1,514 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Thread-safe database connection pool and reconnect policy
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from src.common.logger import LoggingUtil
+
+
+class PGPoolTimeout(Exception):
+    """
+    Raised when a connection could not be checked out of the pool in time
+    """
+
+
+class PGConnectionError(Exception):
+    """
+    Raised when a DB connection could not be made within the reconnect policy limits
+    """
+
+
+class PGConnectionPool:
+    """
+    Class that hands out database connections to threads.
+
+    Connections are created on demand up to the maximum size. Idle connections above the
+    minimum size are closed after the max idle time and every connection is retired once
+    it reaches the max lifetime. A connection that sat idle longer than the check time is
+    tested with a cheap query before it is handed out and replaced if it fails.
+    """
+
+    # the default pool settings. the times are in seconds
+    DEFAULT_CONFIG: dict = {'min_size': 1, 'max_size': 10, 'max_idle': 300, 'max_lifetime': 3600, 'checkout_timeout': 30, 'check_idle': 30}
+
+    def __init__(self, name: str, connect, config: dict = None, _logger=None):
+        """
+        Initializes this class
+
+        :param name: the name of the DB this pool is for
+        :param connect: a callable that returns a new connection
+        :param config: the pool settings, overriding DEFAULT_CONFIG:
+            min_size: the number of connections kept open
+            max_size: the maximum number of connections open at once
+            max_idle: seconds an idle connection above the minimum is kept
+            max_lifetime: seconds a connection is used before it is replaced
+            checkout_timeout: seconds to wait for a free connection
+            check_idle: seconds a connection can sit idle before it is tested on checkout
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSViz.Collab_sync.PGConnectionPool", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # save the pool settings
+        self.connect = connect
+        self.config: dict = dict(self.DEFAULT_CONFIG, **(config or {}), name=name)
+
+        # keep the sizes sane
+        self.config['max_size'] = max(1, self.config['max_size'])
+        self.config['min_size'] = min(self.config['min_size'], self.config['max_size'])
+
+        # the idle connections as (connection, created, last used) tuples, most recently used last
+        self.idle: deque = deque()
+
+        # the creation time of the connections that are checked out, by connection id
+        self.in_use: dict = {}
+
+        # guards the pool state and signals when a connection is returned
+        self.cond: threading.Condition = threading.Condition()
+
+        # the number of connections open or being opened and the pool statistics
+        self.stats: dict = {'size': 0, 'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0, 'timeouts': 0, 'evicted_idle': 0,
+                            'evicted_lifetime': 0, 'discarded': 0, 'failed_checks': 0}
+
+        # open the minimum number of connections
+        for _ in range(self.config['min_size']):
+            # reserve the slot
+            with self.cond:
+                self.stats['size'] += 1
+
+            # create the connection
+            conn = self.create_connection()
+
+            # add it to the idle list
+            with self.cond:
+                self.idle.append((conn, time.monotonic(), time.monotonic()))
+
+    @staticmethod
+    def get_config(db_name: str) -> dict:
+        """
+        Gets the connection pool settings for a DB from the environment. A max size of zero (the default) turns pooling off.
+
+        :param db_name:
+        :return:
+        """
+        # insure the env parameter prefix is uppercase
+        db_name: str = db_name.upper().replace('-', '_')
+
+        # return the settings. the times are in seconds
+        return {'min_size': int(os.environ.get(f'{db_name}_DB_POOL_MIN_SIZE', '1')),
+                'max_size': int(os.environ.get(f'{db_name}_DB_POOL_MAX_SIZE', '0')),
+                'max_idle': float(os.environ.get(f'{db_name}_DB_POOL_MAX_IDLE', '300')),
+                'max_lifetime': float(os.environ.get(f'{db_name}_DB_POOL_MAX_LIFETIME', '3600')),
+                'checkout_timeout': float(os.environ.get(f'{db_name}_DB_POOL_TIMEOUT', '30')),
+                'check_idle': float(os.environ.get(f'{db_name}_DB_POOL_CHECK_IDLE', '30'))}
+
+    def create_connection(self):
+        """
+        Opens a new connection in a slot that the caller already reserved by
+        incrementing the pool size. The slot is released if the connect fails.
+
+        :return:
+        """
+        try:
+            # create the connection
+            conn = self.connect()
+        except Exception:
+            # release the slot
+            with self.cond:
+                self.stats['size'] -= 1
+                self.cond.notify()
+
+            raise
+
+        # count it
+        with self.cond:
+            self.stats['created'] += 1
+
+        # return to the caller
+        return conn
+
+    def close_connection(self, conn):
+        """
+        Closes a connection and releases its slot. Must be called with the lock held.
+
+        :param conn:
+        :return:
+        """
+        try:
+            # close it
+            conn.close()
+        except Exception:
+            self.logger.warning('Error detected closing a %s DB pool connection.', self.config['name'])
+
+        # release the slot
+        self.stats['size'] -= 1
+        self.stats['closed'] += 1
+
+        # let a waiting thread open a new one
+        self.cond.notify()
+
+    def evict(self):
+        """
+        Closes the idle connections that are past the max idle time or max lifetime. Must be called with the lock held.
+
+        :return:
+        """
+        # get the current time
+        now: float = time.monotonic()
+
+        # init the connections to keep
+        keep: deque = deque()
+
+        # check each idle connection, oldest use first
+        while self.idle:
+            # get the next one
+            conn, created, last_used = self.idle.popleft()
+
+            # is it too old
+            if now - created > self.config['max_lifetime']:
+                self.close_connection(conn)
+                self.stats['evicted_lifetime'] += 1
+            # has it been idle too long and is it above the minimum
+            elif now - last_used > self.config['max_idle'] and self.stats['size'] > self.config['min_size']:
+                self.close_connection(conn)
+                self.stats['evicted_idle'] += 1
+            else:
+                keep.append((conn, created, last_used))
+
+        # save the connections we kept
+        self.idle = keep
+
+    def evict_idle(self):
+        """
+        Closes the idle and expired connections
+
+        :return:
+        """
+        with self.cond:
+            self.evict()
+
+    @staticmethod
+    def is_alive(conn) -> bool:
+        """
+        Checks that a connection still works with a cheap query
+
+        :param conn:
+        :return:
+        """
+        try:
+            # run the query
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+
+            # do not leave a transaction open
+            if not conn.autocommit:
+                conn.rollback()
+
+            return True
+        except Exception:
+            return False
+
+    def checkout(self, timeout: float = None):
+        """
+        Gets a connection from the pool, opening a new one if there is room.
+
+        :param timeout: seconds to wait for a free connection, defaults to the pool checkout timeout
+        :return:
+        """
+        # get the time we give up waiting
+        deadline: float = time.monotonic() + (self.config['checkout_timeout'] if timeout is None else timeout)
+
+        # until we get a working connection
+        while True:
+            # get an idle connection or a slot for a new one
+            conn, check = self.take(deadline)
+
+            # open a new connection outside the lock
+            if conn is None:
+                conn = self.create_connection()
+
+                # mark it in use
+                with self.cond:
+                    self.in_use[id(conn)] = time.monotonic()
+                    self.stats['checkouts'] += 1
+
+                return conn
+
+            # an idle connection that was not used for a while is tested outside the lock first
+            if not check or self.is_alive(conn):
+                with self.cond:
+                    self.stats['checkouts'] += 1
+
+                return conn
+
+            self.logger.warning('An idle %s DB pool connection failed its check, replacing it.', self.config['name'])
+
+            # replace it
+            with self.cond:
+                self.in_use.pop(id(conn), None)
+                self.stats['failed_checks'] += 1
+                self.close_connection(conn)
+
+    def take(self, deadline: float) -> tuple:
+        """
+        Takes an idle connection, or reserves a slot for a new one if there is room, waiting until the deadline.
+
+        :param deadline: the monotonic time we give up waiting
+        :return: a (connection, needs a check) tuple. the connection is None if a slot was reserved
+        """
+        with self.cond:
+            # until we get a connection or run out of time
+            while True:
+                # drop the stale idle connections
+                self.evict()
+
+                # use the most recently used idle connection, it is the least likely to have timed out
+                if self.idle:
+                    # get the connection
+                    conn, created, last_used = self.idle.pop()
+
+                    # a connection that broke while idle is not reused
+                    if conn.closed:
+                        self.close_connection(conn)
+                        self.stats['discarded'] += 1
+                        continue
+
+                    # mark it in use
+                    self.in_use[id(conn)] = created
+
+                    return conn, time.monotonic() - last_used > self.config['check_idle']
+
+                # is there room for another connection
+                if self.stats['size'] < self.config['max_size']:
+                    # reserve the slot
+                    self.stats['size'] += 1
+
+                    return None, False
+
+                # get the time left to wait
+                remaining: float = deadline - time.monotonic()
+
+                # did we run out of time
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PGPoolTimeout(f'Timed out waiting for a {self.config["name"]} DB connection.')
+
+                # wait for a connection to be returned
+                self.stats['waits'] += 1
+                self.cond.wait(remaining)
+
+    def checkin(self, conn, discard: bool = False):
+        """
+        Returns a connection to the pool
+
+        :param conn:
+        :param discard: close the connection instead of reusing it, e.g. after a connection error
+        :return:
+        """
+        with self.cond:
+            # get when the connection was created
+            created: float = self.in_use.pop(id(conn), time.monotonic())
+
+            # close it if it is broken or expired
+            if discard or conn.closed or time.monotonic() - created > self.config['max_lifetime']:
+                self.close_connection(conn)
+                self.stats['discarded'] += 1
+            else:
+                # put it back
+                self.idle.append((conn, created, time.monotonic()))
+
+                # let a waiting thread have it
+                self.cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """
+        Checks out a connection for the duration of a with block. The connection is discarded
+        if the block raises a connection error.
+
+        :param timeout:
+        :return:
+        """
+        # get a connection
+        conn = self.checkout(timeout)
+
+        # init the discard flag
+        discard: bool = False
+
+        try:
+            yield conn
+        except Exception:
+            # only drop the connection if it is no longer usable
+            discard = bool(conn.closed)
+
+            # otherwise clear any failed transaction before it is reused
+            if not discard:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+            raise
+        finally:
+            # return it to the pool
+            self.checkin(conn, discard)
+
+    def close(self):
+        """
+        Closes all the idle connections. Checked out connections are closed when they are returned.
+
+        :return:
+        """
+        with self.cond:
+            # close each idle connection
+            while self.idle:
+                self.close_connection(self.idle.pop()[0])
+
+            # retire the checked out connections when they come back
+            self.config['max_lifetime'] = -1
+
+    def get_stats(self) -> dict:
+        """
+        gets the pool statistics
+
+        :return:
+        """
+        with self.cond:
+            # return a copy of the counters plus the current sizes
+            return dict(self.stats, idle=len(self.idle), in_use=len(self.in_use), min_size=self.config['min_size'],
+                        max_size=self.config['max_size'])
+
+
+class PGReconnectPolicy:
+    """
+    Class that decides how long to wait between DB connection attempts and when to give up,
+    and counts the attempts for the metrics.
+
+    The delay before each retry is picked at random up to base delay * 2^attempt (capped at the
+    max delay) so that clients do not reconnect in lockstep. A max attempts or deadline of zero
+    means no limit.
+    """
+
+    def __init__(self, _logger=None):
+        """
+        Initializes this class
+
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSViz.Collab_sync.PGReconnectPolicy", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # the reconnect counters and the lock that guards them
+        self.stats: dict = {'attempts': 0, 'failures': 0, 'wait_seconds': 0.0, 'exhausted': 0}
+        self.lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def get_config(db_name: str) -> dict:
+        """
+        Gets the reconnect policy settings for a DB from the environment.
+
+        :param db_name:
+        :return:
+        """
+        # insure the env parameter prefix is uppercase
+        db_name: str = db_name.upper().replace('-', '_')
+
+        # return the settings. the times are in seconds
+        return {'base_delay': float(os.environ.get(f'{db_name}_DB_RECONNECT_BASE_DELAY', '1')),
+                'max_delay': float(os.environ.get(f'{db_name}_DB_RECONNECT_MAX_DELAY', '30')),
+                'max_attempts': int(os.environ.get(f'{db_name}_DB_RECONNECT_MAX_ATTEMPTS', '10')),
+                'deadline': float(os.environ.get(f'{db_name}_DB_RECONNECT_DEADLINE', '300'))}
+
+    def count(self, name: str, value: float = 1):
+        """
+        Adds to a reconnect counter
+
+        :param name:
+        :param value:
+        :return:
+        """
+        with self.lock:
+            self.stats[name] += value
+
+    def wait(self, db_name: str, attempt: int, start_time: float):
+        """
+        Waits before the next connection attempt, or raises if the policy limits were hit.
+
+        :param db_name:
+        :param attempt: the number of the attempt that just failed, starting at 1
+        :param start_time: when the first attempt was made (time.monotonic())
+        :return:
+        :raises PGConnectionError: if the limits were hit
+        """
+        # get the policy
+        config: dict = self.get_config(db_name)
+
+        # get the jittered exponential delay
+        delay: float = random.uniform(0, min(config['max_delay'], config['base_delay'] * 2 ** (attempt - 1)))
+
+        # get the time spent so far
+        elapsed: float = time.monotonic() - start_time
+
+        # count the failure
+        self.count('failures')
+
+        # have we run out of attempts or time
+        if (0 < config['max_attempts'] <= attempt) or (0 < config['deadline'] < elapsed + delay):
+            # count it
+            self.count('exhausted')
+
+            self.logger.error('DB Connection failed to %s after %s attempts in %.1f seconds. Giving up.', db_name, attempt, elapsed)
+
+            raise PGConnectionError(f'Could not connect to the {db_name} DB after {attempt} attempts in {elapsed:.1f} seconds.')
+
+        self.logger.error('DB Connection failed to %s. Retrying in %.1f seconds...', db_name, delay)
+
+        # wait
+        time.sleep(delay)
+
+        # count the time spent waiting
+        self.count('wait_seconds', delay)
+
+    def get_stats(self) -> dict:
+        """
+        Gets the reconnect counters: connection attempts, failed attempts, seconds spent
+        waiting to retry and the number of times the policy limits were hit.
+
+        :return:
+        """
+        with self.lock:
+            return dict(self.stats)
@@ -14,11 +14,19 @@
 
 import os
 import time
+import uuid
+import select
+import weakref
+import threading
 from collections import namedtuple
 
 import psycopg2
+import psycopg2.sql
+import psycopg2.extras
 
 from src.common.logger import LoggingUtil
+from src.common.pg_pool import PGConnectionPool, PGConnectionError, PGReconnectPolicy
+from src.common.payload_utils import PayloadUtils
 
 
 class PGUtilsMultiConnect:
@@ -31,8 +39,22 @@ class PGUtilsMultiConnect:
         final environment parameter should be all uppercase.
 
         Please see the get_conn_config() method below for more details.
+
+        Setting <DB name>_DB_POOL_MAX_SIZE to a value greater than zero switches that
+        database to a thread-safe connection pool. Please see PGConnectionPool.get_config()
+        for the other pool settings.
+
+        Failed connections are retried with jittered exponential backoff until the
+        attempt or time limit is hit. Please see PGReconnectPolicy for details.
     """
 
+    # the size of the JSON results decoded on each thread, see take_json_result_size()
+    json_result_size = threading.local()
+
+    # the names of the statements prepared on each connection and the lock that guards them. entries go away with their connection
+    prepared_stmts: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    prepared_lock: threading.Lock = threading.Lock()
+
     def __init__(self, app_name, db_names: tuple, _logger=None, _auto_commit=True):
         """
         Entry point for the db connection creation and operations
@@ -53,6 +75,12 @@ class PGUtilsMultiConnect:
         # create a dict for the DB connection details
         self.dbs: dict = {}
 
+        # create a dict for the connection pools of the DBs that use them
+        self.pools: dict = {}
+
+        # the reconnect policy and counters
+        self.reconnect: PGReconnectPolicy = PGReconnectPolicy(self.logger)
+
         # set the autocommit
         self.auto_commit = _auto_commit
 
@@ -62,16 +90,32 @@ class PGUtilsMultiConnect:
         # save the DB names for connection/cursor closing on class tear-down
         self.db_names: tuple = db_names
 
+        # decode json/jsonb results with the fast JSON backend if there is one, counting the result sizes
+        psycopg2.extras.register_default_json(globally=True, loads=self.decode_json_result)
+        psycopg2.extras.register_default_jsonb(globally=True, loads=self.decode_json_result)
+
         # get the details loaded into a tuple for all the DBs
         for db_name in self.db_names:
             # get the connection string
             conn_config = self.get_conn_config(db_name)
 
-            # create a temporary tuple to get the discovery process started
-            temp_tuple: namedtuple = self.db_info_tpl(db_name, conn_config, None)
+            # get the pool settings
+            pool_config: dict = PGConnectionPool.get_config(db_name)
+
+            # is this DB pooled
+            if pool_config['max_size'] > 0:
+                # save the DB info. pooled DBs do not have a single connection
+                self.dbs.update({db_name: self.db_info_tpl(db_name, conn_config, None)})
 
-            # get the connection
-            self.get_db_connection(temp_tuple)
+                # create the pool
+                self.pools[db_name] = PGConnectionPool(db_name, lambda name=db_name, conn_str=conn_config: self.connect_with_retry(name, conn_str),
+                                                       pool_config, self.logger)
+            else:
+                # create a temporary tuple to get the discovery process started
+                temp_tuple: namedtuple = self.db_info_tpl(db_name, conn_config, None)
+
+                # get the connection
+                self.get_db_connection(temp_tuple)
 
     def __del__(self):
         """
@@ -92,6 +136,10 @@ class PGUtilsMultiConnect:
         :return:
         """
         try:
+            # if there is a pool, close it
+            if db_name in self.pools:
+                self.pools[db_name].close()
+
             # if there is a connection, close it
             if self.dbs[db_name].conn is not None:
                 # get the item out of the tuple
@@ -126,17 +174,136 @@ class PGUtilsMultiConnect:
         # return to the caller
         return connection_str
 
+    def get_reconnect_stats(self) -> dict:
+        """
+        Gets the reconnect counters, see PGReconnectPolicy.get_stats()
+
+        :return:
+        """
+        return self.reconnect.get_stats()
+
+    @classmethod
+    def decode_json_result(cls, text):
+        """
+        Decodes a json/jsonb result, adding its size to the count for this thread.
+
+        :param text:
+        :return:
+        """
+        # count the result size
+        cls.json_result_size.count = getattr(cls.json_result_size, 'count', 0) + cls.get_text_size(text)
+
+        # decode it
+        return PayloadUtils.decode_json(text)
+
+    @staticmethod
+    def get_text_size(text) -> int:
+        """
+        Gets the UTF-8 size in bytes of a result returned as text. ASCII text, the usual case, is not encoded to measure it.
+
+        :param text:
+        :return:
+        """
+        return len(text) if isinstance(text, (bytes, bytearray)) or text.isascii() else len(text.encode('utf-8'))
+
+    @classmethod
+    def take_json_result_size(cls) -> int:
+        """
+        Gets the size (in bytes) of the JSON results decoded on this thread since the last
+        call and resets the count.
+
+        :return:
+        """
+        # get the count
+        count: int = getattr(cls.json_result_size, 'count', 0)
+
+        # reset it
+        cls.json_result_size.count = 0
+
+        # return to the caller
+        return count
+
+    def connect_with_retry(self, db_name: str, conn_str: str):
+        """
+        Opens a new DB connection, retrying according to the reconnect policy.
+
+        :param db_name:
+        :param conn_str:
+        :return:
+        """
+        # get the start time
+        start_time: float = time.monotonic()
+
+        # init the attempt counter
+        attempt: int = 0
+
+        # until we connect or give up
+        while True:
+            # count the attempt
+            attempt += 1
+
+            self.reconnect.count('attempts')
+
+            try:
+                # try to connect
+                return self.create_connection(conn_str)
+            except Exception:
+                self.logger.exception('Error getting connection %s.', db_name)
+
+            # wait or give up
+            self.reconnect.wait(db_name, attempt, start_time)
+
+    def is_pooled(self, db_name: str) -> bool:
+        """
+        Checks if a DB uses a connection pool and is therefore safe to use from many threads.
+
+        :param db_name:
+        :return:
+        """
+        return db_name in self.pools
+
+    def get_pool_stats(self) -> dict:
+        """
+        Gets the connection pool statistics of the pooled DBs
+
+        :return:
+        """
+        return {db_name: pool.get_stats() for db_name, pool in self.pools.items()}
+
+    def create_connection(self, conn_str: str):
+        """
+        Opens a new DB connection with the configured autocommit setting.
+
+        :param conn_str:
+        :return:
+        """
+        # try to connect to the DB
+        conn = psycopg2.connect(conn_str)
+
+        # set the autocommit on the connection
+        conn.autocommit = self.auto_commit
+
+        # return to the caller
+        return conn
+
     def get_db_connection(self, db_info: namedtuple) -> bool:
         """
         Gets a connection to the DB. performs a check to continue trying until
-        a connection is made.
+        a connection is made or the reconnect policy limits are hit.
 
         :return:
+        :raises PGConnectionError: if no connection could be made
         """
         # init the connection status indicator
         good_conn: bool = False
 
-        # until forever
+        # get the start time
+        start_time: float = time.monotonic()
+
+        # init the attempt counter
+        attempt: int = 0
+
+        # until we connect or give up
         while not good_conn:
             try:
                 # check the DB connection
@@ -144,11 +311,13 @@ class PGUtilsMultiConnect:
 
                 # try to get a connection if the check failed
                 if not good_conn:
-                    # try to connect to the DB
-                    conn = psycopg2.connect(db_info.conn_str)
+                    # count the attempt
+                    attempt += 1
 
-                    # set the autocommit on the connection
-                    conn.autocommit = self.auto_commit
+                    self.reconnect.count('attempts')
+
+                    # try to connect to the DB
+                    conn = self.create_connection(db_info.conn_str)
 
                     # create a new db info tuple
                     verified_tuple: namedtuple = self.db_info_tpl(db_info.name, db_info.conn_str, conn)
@@ -174,8 +343,8 @@ class PGUtilsMultiConnect:
 
             # are we still looking for a connection
             if good_conn is False:
-                self.logger.error('DB Connection failed to %s. Retrying...', db_info.name)
-                time.sleep(5)
+                # wait or give up
+                self.reconnect.wait(db_info.name, max(attempt, 1), start_time)
 
         # return pass/fail flag
         return good_conn
@@ -234,14 +403,20 @@ class PGUtilsMultiConnect:
         # return to the caller
         return ret_val
 
-    def exec_sql(self, db_name: str, sql_stmt: str):
+    def exec_sql(self, db_name: str, sql_stmt: str, params=None, prepare: tuple = None):
         """
         Executes a sql statement.
 
         :param db_name:
         :param sql_stmt:
+        :param params: the values bound to the statement placeholders
+        :param prepare: a (statement name, PREPARE sql) tuple of a statement that sql_stmt EXECUTEs
         :return:
         """
+        # use the pool if this DB has one
+        if db_name in self.pools:
+            return self.exec_pooled_sql(db_name, sql_stmt, params, prepare)
+
         # init the return
         ret_val = None
 
@@ -253,41 +428,18 @@ class PGUtilsMultiConnect:
 
         # did we get a connection
         if success:
-            # init the cursor
-            cursor = None
-
             try:
                 # make sure the latest db_info is used
                 db_info = self.dbs[db_name]
 
-                # get a cursor
-                cursor = db_info.conn.cursor()
-
                 # execute the sql
-                cursor.execute(sql_stmt)
-
-                # get the returned value
-                ret_data = cursor.fetchone()
-
-                # trap the return
-                if ret_data is None or ret_data[0] is None:
-                    # specify a return code on an empty result
-                    ret_val = 0
-                else:
-                    # get the one and only record of json
-                    ret_val = ret_data[0]
+                ret_val = self.fetch_sql_result(db_info.conn, sql_stmt, params, prepare)
 
             except Exception:
                 self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
 
                 # set the error code
                 ret_val = -1
-            finally:
-                # in there is a cursor, close it
-                if cursor is not None:
-                    # close it
-                    cursor.close()
-
         else:
             # set the error code
             ret_val = -1
@@ -295,6 +447,226 @@ class PGUtilsMultiConnect:
         # return to the caller
         return ret_val
 
+    def exec_pooled_sql(self, db_name: str, sql_stmt: str, params=None, prepare: tuple = None):
+        """
+        Executes a sql statement on a connection checked out of the DB pool.
+
+        :param db_name:
+        :param sql_stmt:
+        :param params:
+        :param prepare:
+        :return:
+        """
+        # init the return
+        ret_val = None
+
+        try:
+            # get a connection for the duration of the call
+            with self.pools[db_name].connection() as conn:
+                # execute the sql
+                ret_val = self.fetch_sql_result(conn, sql_stmt, params, prepare)
+
+                # pooled connections are shared so the transaction cannot be left open
+                if not conn.autocommit:
+                    conn.commit()
+
+        except PGConnectionError:
+            # let the caller know the DB is unavailable
+            raise
+
+        except Exception:
+            self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
+
+            # set the error code
+            ret_val = -1
+
+        # return to the caller
+        return ret_val
+
+    def fetch_sql_result(self, conn, sql_stmt: str, params=None, prepare: tuple = None):
+        """
+        Executes a sql statement and gets the single value it returns.
+
+        :param conn:
+        :param sql_stmt:
+        :param params:
+        :param prepare:
+        :return: the value, or 0 if there was none
+        """
+        # get a cursor
+        with conn.cursor() as cursor:
+            # make sure the statement is prepared on this connection
+            if prepare is not None:
+                self.prepare_stmt(conn, cursor, *prepare)
+
+            # execute the sql
+            cursor.execute(sql_stmt, params)
+
+            # get the returned value
+            ret_data = cursor.fetchone()
+
+        # trap the return
+        if ret_data is None or ret_data[0] is None:
+            # specify a return code on an empty result
+            ret_val = 0
+        else:
+            # get the one and only record of json
+            ret_val = ret_data[0]
+
+        # return to the caller
+        return ret_val
+
+    def prepare_stmt(self, conn, cursor, stmt_name: str, prepare_sql: str):
+        """
+        Prepares a statement on a connection the first time it is used there.
+
+        :param conn:
+        :param cursor:
+        :param stmt_name:
+        :param prepare_sql:
+        :return:
+        """
+        # get the statements already prepared on this connection
+        with self.prepared_lock:
+            prepared: set = self.prepared_stmts.setdefault(conn, set())
+
+        # prepare it if needed
+        if stmt_name not in prepared:
+            # have the server parse and plan it once
+            cursor.execute(prepare_sql)
+
+            # remember it
+            with self.prepared_lock:
+                prepared.add(stmt_name)
+
+            self.logger.debug('Prepared statement %s.', stmt_name)
+
+    def stream_sql(self, db_name: str, sql_stmt: str, params=None, itersize: int = 1000):
+        """
+        Executes a row returning sql statement on a server-side cursor and yields the rows
+        as they are fetched, itersize rows per round trip. Unlike exec_sql() errors are raised
+        to the caller. A pooled connection is held until the generator is exhausted or closed.
+
+        :param db_name:
+        :param sql_stmt:
+        :param params:
+        :param itersize:
+        :return:
+        """
+        # get a connection from the pool or the verified single connection
+        if db_name in self.pools:
+            conn = self.pools[db_name].checkout()
+        else:
+            self.get_db_connection(self.dbs[db_name])
+            conn = self.dbs[db_name].conn
+
+        # init the cursor and the connection discard flag
+        cursor = None
+        discard: bool = False
+
+        try:
+            # create a named (server-side) cursor. WITH HOLD lets it work in autocommit mode
+            cursor = conn.cursor(name=f'stream_{uuid.uuid4().hex}', withhold=True)
+
+            # set the number of rows fetched per round trip
+            cursor.itersize = itersize
+
+            # execute the sql
+            cursor.execute(sql_stmt, params)
+
+            # hand back the rows
+            yield from cursor
+
+        except Exception:
+            # a broken connection is not reused
+            discard = bool(conn.closed)
+
+            raise
+
+        finally:
+            try:
+                # close the cursor
+                if cursor is not None and not conn.closed:
+                    cursor.close()
+
+                # end the read-only transaction
+                if not conn.closed and not conn.autocommit:
+                    conn.rollback()
+            except Exception:
+                self.logger.warning('Error detected closing the %s DB streaming cursor.', db_name)
+
+                # do not reuse the connection
+                discard = True
+
+            # return a pooled connection
+            if db_name in self.pools:
+                self.pools[db_name].checkin(conn, discard)
+
+    def listen(self, db_name: str, channels: tuple):
+        """
+        Opens a dedicated autocommit connection that LISTENs on the channels, retrying according to
+        the reconnect policy. The connection is not pooled or shared and the caller closes it.
+
+        :param db_name:
+        :param channels: the notification channel names
+        :return: the connection
+        """
+        # connect
+        conn = self.connect_with_retry(db_name, self.get_conn_config(db_name))
+
+        try:
+            # notifications are only delivered outside of a transaction
+            conn.autocommit = True
+
+            # listen on each channel
+            with conn.cursor() as cursor:
+                for channel in channels:
+                    cursor.execute(psycopg2.sql.SQL('LISTEN {};').format(psycopg2.sql.Identifier(channel)))
+        except Exception:
+            conn.close()
+            raise
+
+        # return to the caller
+        return conn
+
+    @staticmethod
+    def get_notifications(conn, timeout: float) -> list:
+        """
+        Waits for notifications on a listening connection. Errors are raised to the caller.
+
+        :param conn: a connection from listen()
+        :param timeout: the most seconds to wait
+        :return: a list of (channel, payload) tuples
+        """
+        # wait for something to arrive unless there is already something there
+        if not conn.notifies:
+            select.select([conn], [], [], timeout)
+
+        # read what arrived
+        conn.poll()
+
+        # take the notifications
+        ret_val: list = [(notify.channel, notify.payload) for notify in conn.notifies]
+        conn.notifies.clear()
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def get_db_time(conn):
+        """
+        Gets the current time of the DB server, which also checks that the connection is alive.
+        Errors are raised to the caller.
+
+        :param conn:
+        :return: a datetime
+        """
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT localtimestamp;')
+
+            # return to the caller
+            return cursor.fetchone()[0]
+
     def commit(self, db_name: str):
         """
         issues a transaction commit
@@ -302,7 +674,7 @@ class PGUtilsMultiConnect:
         :param db_name:
         :return:
         """
-        # if this connection is set to not auto commit
-        if not self.dbs[db_name].conn.autocommit:
+        # if this connection is set to not auto commit. pooled DBs commit after each statement
+        if db_name not in self.pools and not self.dbs[db_name].conn.autocommit:
             # issue the commit
             self.dbs[db_name].conn.commit()
@@ -0,0 +1,266 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    On-demand profiling of sync runs.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import re
+import sys
+import time
+import cProfile
+import threading
+import tracemalloc
+import contextlib
+from collections import Counter
+
+from src.common.logger import LoggingUtil
+
+
+class StackSampler:
+    """
+    Class that samples the stack of a thread on a timer and counts the stacks seen.
+    It is cheap enough to leave on for long-running daemon jobs.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.01):
+        """
+        Initializes this class
+
+        :param thread_id: the ident of the thread to sample
+        :param interval: the seconds between samples
+        """
+        self.thread_id: int = thread_id
+        self.interval: float = interval
+
+        # the number of times each stack was seen, keyed by the stack in the collapsed (flame graph) format
+        self.stacks: Counter = Counter()
+
+        # the sampling thread and its stop flag
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.sample, name='sync-profile-sampler', daemon=True)
+
+    def sample(self):
+        """
+        Samples the stack until stopped
+
+        :return:
+        """
+        while not self.stop_event.wait(self.interval):
+            # get the current frame of the thread
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+
+            # it is gone if the thread ended
+            if frame is None:
+                break
+
+            # get the stack, outermost call first
+            stack: list = []
+
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})')
+                frame = frame.f_back
+
+            # count it
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        """
+        Starts sampling
+
+        :return:
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops sampling
+
+        :return:
+        """
+        self.stop_event.set()
+        self.thread.join()
+
+
+class SyncProfiler:
+    """
+    Class that profiles sync runs and writes the results to the log directory with the run id in the file names.
+
+    The modes are any of:
+     - cprofile: a cProfile dump, for pstats or snakeviz
+     - tracemalloc: the top allocations by line
+     - sampling: a sampled stack profile in the collapsed format used by flame graph tools
+
+    Only one run is profiled at a time, as cProfile and tracemalloc are process wide. Runs started
+    while another run is being profiled are not profiled.
+    """
+
+    # the profiling modes
+    MODES: tuple = ('cprofile', 'tracemalloc', 'sampling')
+
+    def __init__(self, modes: list, output_path: str, _logger=None, top: int = 25, interval: float = 0.01):
+        """
+        Initializes this class
+
+        :param modes: the profiling modes to use
+        :param output_path: the directory the results go in
+        :param _logger:
+        :param top: the number of allocation lines to save
+        :param interval: the seconds between stack samples
+        """
+        # make sure the modes are legit
+        unknown: set = set(modes) - set(self.MODES)
+
+        if unknown:
+            raise ValueError(f'Unknown profiling mode(s): {sorted(unknown)}')
+
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.SyncProfiler", level=log_level, line_format='medium', log_file_path=log_path)
+
+        self.modes: list = list(modes)
+        self.output_path: str = output_path
+        self.top: int = top
+        self.interval: float = interval
+
+        # only one run is profiled at a time
+        self.lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def get_modes(setting: str) -> list:
+        """
+        Gets the profiling modes from a setting. true, yes or 1 are cprofile and tracemalloc,
+        everything else is a comma separated list of modes.
+
+        :param setting:
+        :return: the modes, empty if profiling is off
+        """
+        # get the setting
+        setting = (setting or '').strip().lower()
+
+        # is it turned off
+        if setting in ('', 'false', 'no', '0', 'none'):
+            return []
+
+        # is it the default modes
+        if setting in ('true', 'yes', '1'):
+            return ['cprofile', 'tracemalloc']
+
+        # return to the caller
+        return [mode.strip() for mode in setting.split(',') if mode.strip()]
+
+    def get_file_path(self, run_id: str, suffix: str) -> str:
+        """
+        Gets the path of a results file
+
+        :param run_id:
+        :param suffix:
+        :return:
+        """
+        # make the run id safe to use in a file name
+        name: str = re.sub(r'[^A-Za-z0-9._-]', '_', str(run_id))
+
+        # return to the caller
+        return os.path.join(self.output_path, f'profile-{name}-{time.strftime("%Y%m%d-%H%M%S")}.{suffix}')
+
+    @contextlib.contextmanager
+    def profile(self, run_id: str):
+        """
+        Profiles the code in a with block
+
+        :param run_id:
+        :return:
+        """
+        # skip this run if another one is being profiled
+        if not self.lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            self.logger.debug('Not profiling run id %s, another run is being profiled.', run_id)
+            yield
+            return
+
+        # init the profilers
+        profiler = cProfile.Profile() if 'cprofile' in self.modes else None
+        sampler = StackSampler(threading.get_ident(), self.interval) if 'sampling' in self.modes else None
+
+        try:
+            # start the profilers
+            if 'tracemalloc' in self.modes:
+                tracemalloc.start()
+
+            if sampler is not None:
+                sampler.start()
+
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # another profiler (e.g. a coverage tool) is already running
+                    self.logger.warning('Warning: cProfile is not available for run id %s, another profiler is active.', run_id)
+                    profiler = None
+
+            # run the code
+            yield
+        finally:
+            try:
+                # stop the profilers and save the results
+                self.save_results(run_id, profiler, sampler)
+            finally:
+                self.lock.release()
+
+    def save_results(self, run_id: str, profiler, sampler):
+        """
+        Stops the profilers and writes out what they found
+
+        :param run_id:
+        :param profiler: the cProfile profiler, if any
+        :param sampler: the stack sampler, if any
+        :return:
+        """
+        # init the list of files written
+        file_paths: list = []
+
+        try:
+            # save the cProfile dump
+            if profiler is not None:
+                profiler.disable()
+                file_paths.append(self.get_file_path(run_id, 'prof'))
+                profiler.dump_stats(file_paths[-1])
+
+            # save the top allocations
+            if 'tracemalloc' in self.modes:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                file_paths.append(self.get_file_path(run_id, 'tracemalloc.txt'))
+
+                with open(file_paths[-1], 'w', encoding='utf-8') as fp:
+                    fp.write(f'run id: {run_id}, current: {current} bytes, peak: {peak} bytes\n')
+                    fp.writelines(f'{stat}\n' for stat in snapshot.statistics('lineno')[:self.top])
+
+            # save the stack samples
+            if sampler is not None:
+                sampler.stop()
+
+                file_paths.append(self.get_file_path(run_id, 'stacks.txt'))
+
+                with open(file_paths[-1], 'w', encoding='utf-8') as fp:
+                    fp.writelines(f'{stack} {count}\n' for stack, count in sampler.stacks.most_common())
+
+            self.logger.info('Profile results for run id %s: %s', run_id, file_paths)
+        except Exception:
+            self.logger.exception('Error: Failed to save the profile results for run id %s.', run_id)
@@ -0,0 +1,197 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Bounded in-memory cache of DB query results.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from src.common.logger import LoggingUtil
+from src.common.payload_utils import PayloadUtils
+
+
+class QueryCache:
+    """
+    Class that keeps DB query results by their arguments, with a time to live, least recently
+    used eviction and limits on the entry count and the total size.
+
+    The results are kept as encoded JSON, which is what the size limit counts, and every hit
+    is decoded again so callers can change what they get back. The cache is tied to a data
+    version, e.g. a version row of the tables queried, and is emptied when it changes.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 256 * 1024 * 1024, ttl: float = 300, _logger=None):
+        """
+        Initializes this class
+
+        :param max_entries: the most entries kept
+        :param max_bytes: the most encoded bytes kept
+        :param ttl: the seconds an entry is used for
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.QueryCache", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the limits
+        self.limits: dict = {'max_entries': max_entries, 'max_bytes': max_bytes, 'ttl': ttl}
+
+        # the entries by key, least recently used first: key: (encoded value, expiry time)
+        self.entries: OrderedDict = OrderedDict()
+
+        # the total size of the entries
+        self.size: int = 0
+
+        # the data version the entries are for
+        self.version = None
+
+        # the counts of what happened
+        self.stats: dict = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+        # guards everything
+        self.lock: threading.Lock = threading.Lock()
+
+    def check_version(self, version):
+        """
+        Empties the cache if the data version changed
+
+        :param version: the current data version
+        :return:
+        """
+        with self.lock:
+            # did the data change
+            if version != self.version:
+                # count it unless this is the first version seen
+                if self.version is not None and self.entries:
+                    self.logger.debug('Query cache data version changed, %s entries dropped.', len(self.entries))
+
+                    self.stats['invalidations'] += 1
+
+                # start over
+                self.entries.clear()
+                self.size = 0
+                self.version = version
+
+    def invalidate(self, match=None):
+        """
+        Empties the cache, or drops the entries whose key matches
+
+        :param match: a function that is passed a key and returns True if the entry is to be dropped
+        :return:
+        """
+        with self.lock:
+            # get the entries to drop
+            keys: list = [key for key in self.entries if match is None or match(key)]
+
+            # count it if there was something to drop
+            if keys:
+                self.stats['invalidations'] += 1
+
+            # drop them
+            for key in keys:
+                self.remove(key)
+
+    def get(self, key):
+        """
+        Gets a result
+
+        :param key:
+        :return: a new copy of the result or None if it is not cached
+        """
+        with self.lock:
+            # get the entry
+            entry: tuple = self.entries.get(key)
+
+            # has it expired
+            if entry is not None and entry[1] <= time.monotonic():
+                # drop it
+                self.remove(key)
+
+                self.stats['expirations'] += 1
+
+                entry = None
+
+            # was it a miss
+            if entry is None:
+                self.stats['misses'] += 1
+
+                return None
+
+            # it is now the most recently used
+            self.entries.move_to_end(key)
+
+            self.stats['hits'] += 1
+
+        # decode a new copy outside the lock
+        return PayloadUtils.decode_json(entry[0])
+
+    def put(self, key, value, version=None):
+        """
+        Saves a result, evicting the least recently used ones to make room
+
+        :param key:
+        :param value:
+        :param version: the data version the result was read at. it is not saved if the version changed since
+        :return:
+        """
+        # encode the value
+        body: bytes = PayloadUtils.encode_json(value)
+
+        # don't bother if it would push out everything else
+        if len(body) > self.limits['max_bytes']:
+            return
+
+        with self.lock:
+            # was it read from data that has changed
+            if version is not None and version != self.version:
+                return
+
+            # replace any older entry
+            if key in self.entries:
+                self.remove(key)
+
+            # save it
+            self.entries[key] = (body, time.monotonic() + self.limits['ttl'])
+            self.size += len(body)
+
+            # evict until it is all under the limits
+            while len(self.entries) > self.limits['max_entries'] or self.size > self.limits['max_bytes']:
+                self.remove(next(iter(self.entries)))
+
+                self.stats['evictions'] += 1
+
+    def remove(self, key):
+        """
+        Removes an entry. the lock must be held
+
+        :param key:
+        :return:
+        """
+        # remove it and its size
+        self.size -= len(self.entries.pop(key)[0])
+
+    def get_stats(self) -> dict:
+        """
+        Gets the hit, miss, eviction, expiration and invalidation counts and the current entry count and size
+
+        :return:
+        """
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries), 'bytes': self.size}
@@ -0,0 +1,278 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Batched, asynchronous Slack notifications.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import time
+import atexit
+import threading
+
+from src.common.logger import LoggingUtil
+
+
+class SlackNotifier:
+    """
+    Class that sends Slack messages from a background thread. The messages for a channel
+    that arrive within a time window are sent as one digest. See SlackPoster for the sending.
+    """
+
+    # the most characters sent in one Slack message
+    MAX_TEXT_LENGTH: int = 39000
+
+    def __init__(self, _logger=None, client_factory=None, window: float = None, max_retries: int = None):
+        """
+        Initializes this class
+
+        :param _logger:
+        :param client_factory: creates a client for a token, see SlackPoster
+        :param window: the seconds messages for a channel are collected before sending, defaults to SLACK_COALESCE_SECONDS
+        :param max_retries: the number of times a rate limited message is retried, see SlackPoster
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.SlackNotifier", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the window
+        self.window: float = window if window is not None else float(os.getenv('SLACK_COALESCE_SECONDS', '5'))
+
+        # create the poster that keeps the clients
+        self.poster: SlackPoster = SlackPoster(self.logger, client_factory, max_retries)
+
+        # the messages waiting to be sent by (token, channel): [when the channel is due to be sent, messages]
+        self.pending: dict = {}
+
+        # guards the pending messages and signals the sender
+        self.condition: threading.Condition = threading.Condition()
+
+        # the sender thread, started on the first message, and the stop flag
+        self.thread: threading.Thread = None
+        self.stopping: bool = False
+
+    def send(self, text: str, channel: str, token: str):
+        """
+        Queues a message for a channel
+
+        :param text:
+        :param channel:
+        :param token:
+        :return:
+        """
+        with self.condition:
+            # nothing more is sent once closed
+            if self.stopping:
+                self.logger.warning('Slack notifier closed, message for %s not sent: %s', channel, text)
+                return
+
+            # add the message, starting the window if it is the first one for the channel
+            self.pending.setdefault((token, channel), [time.monotonic() + self.window, []])[1].append(text)
+
+            # start the sender if needed
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.process, name='slack-notifier', daemon=True)
+                self.thread.start()
+
+                # send what is left at exit
+                atexit.register(self.close)
+
+            self.condition.notify()
+
+    def process(self):
+        """
+        Sends the pending messages as their windows close, and everything that is left once stopped
+
+        :return:
+        """
+        while True:
+            with self.condition:
+                # wait for a channel to be due or for the stop
+                while not self.stopping and (not self.pending or self.get_next_due() > time.monotonic()):
+                    self.condition.wait(self.get_next_due() - time.monotonic() if self.pending else None)
+
+                # get the channels to send. everything goes when stopping
+                keys: list = [key for key, (due, _) in self.pending.items() if self.stopping or due <= time.monotonic()]
+                batches: list = [(key, self.pending.pop(key)[1]) for key in keys]
+
+                # are we done
+                if not batches and self.stopping:
+                    break
+
+            # send the digests outside the lock
+            for (token, channel), messages in batches:
+                for text in self.get_digests(messages):
+                    self.poster.post(token, channel, text)
+
+    def get_next_due(self) -> float:
+        """
+        Gets when the next channel is due to be sent. Must be called with the lock held and messages pending.
+
+        :return:
+        """
+        return min(due for due, _ in self.pending.values())
+
+    def get_digests(self, messages: list) -> list:
+        """
+        Combines the messages for a channel into as few Slack messages as possible
+
+        :param messages:
+        :return:
+        """
+        # a single message goes as is
+        if len(messages) == 1:
+            return [messages[0][:self.MAX_TEXT_LENGTH]]
+
+        # init the digests
+        digests: list = []
+        lines: list = []
+        size: int = 0
+
+        # add the messages, starting a new digest when one is full
+        for text in messages:
+            if lines and size + len(text) > self.MAX_TEXT_LENGTH:
+                digests.append(lines)
+                lines, size = [], 0
+
+            lines.append(text[:self.MAX_TEXT_LENGTH])
+            size += len(lines[-1]) + 3
+
+        digests.append(lines)
+
+        # return the digests
+        return [f'{len(digest)} messages:\n' + '\n'.join(f'• {line}' for line in digest) if len(digest) > 1 else digest[0] for digest in digests]
+
+    def flush(self):
+        """
+        Sends everything that is pending now, without waiting for the windows to close
+
+        :return:
+        """
+        with self.condition:
+            for entry in self.pending.values():
+                entry[0] = 0
+
+            self.condition.notify()
+
+    def close(self, timeout: float = 30):
+        """
+        Sends everything that is pending and stops the sender
+
+        :param timeout: the most seconds to wait for the sends
+        :return:
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+        # wait for the sender to finish
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+class SlackPoster:
+    """
+    Class that posts Slack messages, keeping one client per token and waiting out the Slack
+    rate limits (HTTP 429 with Retry-After).
+    """
+
+    def __init__(self, _logger=None, client_factory=None, max_retries: int = None):
+        """
+        Initializes this class
+
+        :param _logger:
+        :param client_factory: creates a client for a token, defaults to the Slack WebClient
+        :param max_retries: the number of times a rate limited message is retried, defaults to SLACK_MAX_RETRIES
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.SlackPoster", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the settings
+        self.client_factory = client_factory if client_factory is not None else self.create_client
+        self.max_retries: int = max_retries if max_retries is not None else int(os.getenv('SLACK_MAX_RETRIES', '3'))
+
+        # the clients by token
+        self.clients: dict = {}
+
+    @staticmethod
+    def create_client(token: str):
+        """
+        Creates a Slack client for a token
+
+        :param token:
+        :return:
+        """
+        # the Slack SDK is only loaded when a message is sent
+        from slack_sdk import WebClient  # pylint: disable=import-outside-toplevel
+
+        # return to the caller
+        return WebClient(token=token)
+
+    def post(self, token: str, channel: str, text: str):
+        """
+        Posts a message, waiting out any rate limits
+
+        :param token:
+        :param channel:
+        :param text:
+        :return:
+        """
+        # the Slack SDK is only loaded when a message is sent
+        from slack_sdk.errors import SlackApiError  # pylint: disable=import-outside-toplevel
+
+        # get the client for this token
+        client = self.clients.get(token)
+
+        if client is None:
+            client = self.clients[token] = self.client_factory(token)
+
+        # send the message, retrying when rate limited
+        for attempt in range(self.max_retries + 1):
+            try:
+                client.chat_postMessage(channel=channel, text=text)
+
+                # no need to continue
+                break
+            except SlackApiError as e:
+                # is this a rate limit that can be retried
+                if getattr(e.response, 'status_code', None) == 429 and attempt < self.max_retries:
+                    # get how long to wait
+                    retry_after: float = float(e.response.headers.get('Retry-After', '1'))
+
+                    self.logger.warning('Slack rate limited for %s, retrying in %s seconds.', channel, retry_after)
+
+                    time.sleep(retry_after)
+                else:
+                    # log the error
+                    self.logger.exception('Slack %s messaging failed. msg: %s', channel, text)
+
+                    # no need to continue
+                    break
+            except Exception:
+                # log the error
+                self.logger.exception('Slack %s messaging failed. msg: %s', channel, text)
+
+                # no need to continue
+                break
@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Local durable outbox of the pushes that failed, so they can be sent again later.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import time
+import random
+import sqlite3
+import threading
+from collections import namedtuple
+
+from src.common.logger import LoggingUtil
+
+# an outbox entry. a new entry has no id yet and no attempts
+OutboxEntry = namedtuple('OutboxEntry', ['entry_id', 'target', 'run_id', 'part', 'body', 'attempts'], defaults=(0,))
+
+
+class SyncOutbox:
+    """
+    Class that keeps the request bodies of failed pushes in a SQLite database.
+
+    There is one entry per target, run id and part (the batch number, 0 if the run was not
+    batched), so a newer body for the same run replaces the older one. Entries are handed
+    out oldest first and a failed send holds back the whole target, so newer entries never
+    overtake it. It is retried with jittered exponential backoff.
+    """
+
+    def __init__(self, db_path: str, _logger=None, base_delay: float = 30, max_delay: float = 3600):
+        """
+        Initializes this class
+
+        :param db_path: the path to the SQLite database file
+        :param _logger:
+        :param base_delay: the seconds to wait after the first failed retry
+        :param max_delay: the most seconds to wait between retries
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.PSCSync.SyncOutbox", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the retry settings
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+
+        # serialize access to the connection across threads
+        self.lock: threading.Lock = threading.Lock()
+
+        # open the database
+        self.conn: sqlite3.Connection = sqlite3.connect(db_path, check_same_thread=False)
+
+        # create the outbox table if needed
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS outbox (entry_id INTEGER PRIMARY KEY AUTOINCREMENT, target TEXT NOT NULL, '
+                              'run_id TEXT NOT NULL, part INTEGER NOT NULL, body BLOB NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+                              'next_attempt REAL NOT NULL, created REAL NOT NULL, last_error TEXT, UNIQUE (target, run_id, part))')
+
+    def close(self):
+        """
+        closes the database
+
+        :return:
+        """
+        # close the connection
+        with self.lock:
+            self.conn.close()
+
+    def add(self, entry: OutboxEntry, error: str = None):
+        """
+        adds a failed push, replacing any older one for the same run and part. a whole run
+        (part 0) replaces all the parts of the run. the entry id and attempts are not used.
+
+        :param entry: the target, run id, part and body of the push
+        :param error: why the push failed
+        :return:
+        """
+        # get the time
+        now: float = time.time()
+
+        # save it. a replaced entry keeps its place in line and its backoff
+        with self.lock, self.conn:
+            if entry.part == 0:
+                self.conn.execute('DELETE FROM outbox WHERE target = ? AND run_id = ? AND part > 0', (entry.target, entry.run_id))
+
+            self.conn.execute('INSERT INTO outbox (target, run_id, part, body, next_attempt, created, last_error) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                              'ON CONFLICT (target, run_id, part) DO UPDATE SET body = excluded.body, last_error = excluded.last_error',
+                              (entry.target, entry.run_id, entry.part, entry.body, now, now, error))
+
+        self.logger.warning('Push for run id %s (part %s) saved in the %s outbox.', entry.run_id, entry.part, entry.target)
+
+    def remove(self, target: str, run_id: str, part: int = None):
+        """
+        removes the entries of a run, or of one part of a run
+
+        :param target:
+        :param run_id:
+        :param part: the part to remove, all of them if not specified
+        :return:
+        """
+        with self.lock, self.conn:
+            if part is None:
+                self.conn.execute('DELETE FROM outbox WHERE target = ? AND run_id = ?', (target, run_id))
+            else:
+                self.conn.execute('DELETE FROM outbox WHERE target = ? AND run_id = ? AND part = ?', (target, run_id, part))
+
+    def has_run(self, target: str, run_id: str) -> bool:
+        """
+        checks if there are entries of a run waiting to be sent
+
+        :param target:
+        :param run_id:
+        :return:
+        """
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM outbox WHERE target = ? AND run_id = ? LIMIT 1', (target, run_id)).fetchone() is not None
+
+    def get_due(self, target: str, limit: int = 100) -> list:
+        """
+        gets the entries to send again, oldest first. nothing is due while the oldest entry is
+        backing off, so the entries are always sent in order.
+
+        :param target:
+        :param limit:
+        :return: a list of OutboxEntry
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT entry_id, target, run_id, part, body, attempts, next_attempt FROM outbox WHERE target = ? '
+                                     'ORDER BY entry_id LIMIT ?', (target, limit)).fetchall()
+
+        # is the oldest entry waiting to be retried
+        if rows and rows[0][-1] > time.time():
+            rows = []
+
+        # return to the caller
+        return [OutboxEntry(*row[:-1]) for row in rows]
+
+    def sent(self, entry: OutboxEntry):
+        """
+        removes an entry that was sent. an entry replaced with a newer body since it was read is kept
+
+        :param entry:
+        :return:
+        """
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM outbox WHERE entry_id = ? AND attempts = ? AND body = ?', (entry.entry_id, entry.attempts, entry.body))
+
+    def failed(self, entry: OutboxEntry, error: str):
+        """
+        schedules the next try of an entry that failed again, which holds back the target until then
+
+        :param entry:
+        :param error: why it failed
+        :return:
+        """
+        # get the backoff delay
+        delay: float = random.uniform(0.5, 1) * min(self.max_delay, self.base_delay * 2 ** entry.attempts)
+
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ? WHERE entry_id = ? AND attempts = ?',
+                              (time.time() + delay, error, entry.entry_id, entry.attempts))
+
+    def get_depth(self, target: str) -> int:
+        """
+        gets the number of entries waiting to be sent
+
+        :param target:
+        :return:
+        """
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM outbox WHERE target = ?', (target,)).fetchone()[0]
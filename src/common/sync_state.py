@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Local state store that remembers what has been synced to each collaborator.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import json
+import sqlite3
+import hashlib
+import threading
+
+from src.common.logger import LoggingUtil
+
+
+class SyncStateStore:
+    """
+    Class that records a content hash per catalog member id in a SQLite database.
+
+    The hashes are kept per sync target so that a member can be compared with the
+    version that target last received. Named progress marks are kept there too.
+    """
+
+    def __init__(self, db_path: str, _logger=None):
+        """
+        Initializes this class
+
+        :param db_path: the path to the SQLite database file
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.PSCSync.SyncStateStore", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # serialize access to the connection across threads
+        self.lock: threading.Lock = threading.Lock()
+
+        # open the database
+        self.conn: sqlite3.Connection = sqlite3.connect(db_path, check_same_thread=False)
+
+        # create the state table if needed
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS member_state (target TEXT NOT NULL, member_id TEXT NOT NULL, catalog_id TEXT NOT NULL, '
+                              'content_hash TEXT NOT NULL, PRIMARY KEY (target, member_id))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS member_state_catalog ON member_state (target, catalog_id)')
+
+            # the named progress marks, e.g. up to when the notifications were received
+            self.conn.execute('CREATE TABLE IF NOT EXISTS sync_mark (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def close(self):
+        """
+        closes the database
+
+        :return:
+        """
+        # close the connection
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def hash_member(member: dict) -> str:
+        """
+        gets a stable content hash of a catalog member
+
+        :param member:
+        :return:
+        """
+        # hash a key-order independent serialization of the member
+        return hashlib.sha256(json.dumps(member, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def get_member_hashes(self, target: str, catalog_ids: list) -> dict:
+        """
+        gets the stored hashes of all members of the catalogs specified
+
+        :param target:
+        :param catalog_ids:
+        :return: a dict of member id to content hash
+        """
+        # init the return
+        ret_val: dict = {}
+
+        # query the catalogs a chunk at a time to stay under the SQLite variable limit
+        with self.lock:
+            for index in range(0, len(catalog_ids), 500):
+                # get this chunk of ids
+                chunk: list = catalog_ids[index:index + 500]
+
+                # get the members
+                rows = self.conn.execute(f'SELECT member_id, content_hash FROM member_state WHERE target = ? AND catalog_id IN '
+                                         f'({",".join("?" * len(chunk))})', [target, *chunk])
+
+                # save them
+                ret_val.update(rows)
+
+        # return to the caller
+        return ret_val
+
+    def update(self, target: str, upserts: list, deletes: list):
+        """
+        records members that were sent and removes the ones that were deleted
+
+        :param target:
+        :param upserts: a list of (member id, catalog id, content hash) tuples
+        :param deletes: a list of member ids
+        :return:
+        """
+        # apply the changes in one transaction
+        with self.lock, self.conn:
+            # save the new and changed members
+            self.conn.executemany('INSERT OR REPLACE INTO member_state (target, member_id, catalog_id, content_hash) VALUES (?, ?, ?, ?)',
+                                  [(target, *item) for item in upserts])
+
+            # remove the deleted members
+            self.conn.executemany('DELETE FROM member_state WHERE target = ? AND member_id = ?', [(target, item) for item in deletes])
+
+        self.logger.debug('Sync state for %s updated: %s members saved, %s removed.', target, len(upserts), len(deletes))
+
+    def get_mark(self, name: str):
+        """
+        gets a progress mark
+
+        :param name:
+        :return: the value or None if it was never set
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM sync_mark WHERE name = ?', (name,)).fetchone()
+
+        # return to the caller
+        return row[0] if row is not None else None
+
+    def set_mark(self, name: str, value: str):
+        """
+        saves a progress mark
+
+        :param name:
+        :param value:
+        :return:
+        """
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO sync_mark (name, value) VALUES (?, ?)', (name, value))
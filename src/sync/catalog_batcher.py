@@ -0,0 +1,201 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Sends the catalog data of a run in batches of whole catalogs.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.common.payload_utils import PayloadUtils
+
+
+class CatalogBatcher:
+    """
+    Class that splits the catalog data of a run into batches that stay under the member and
+    byte limits and pushes them concurrently, retrying only the batches that failed.
+
+    Batching is off unless PSC_SYNC_BATCH_MAX_MEMBERS or PSC_SYNC_BATCH_MAX_BYTES is set.
+    """
+
+    def __init__(self, _sync):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this batches for. its push_to_psc(), outbox sender, logger, metrics and target name are used
+        """
+        # get the sync object
+        self.sync = _sync
+
+        # load the batching settings
+        self.max_members: int = int(os.getenv('PSC_SYNC_BATCH_MAX_MEMBERS', '0'))
+        self.max_bytes: int = int(os.getenv('PSC_SYNC_BATCH_MAX_BYTES', '0'))
+        self.workers: int = int(os.getenv('PSC_SYNC_BATCH_WORKERS', '4'))
+        self.retries: int = int(os.getenv('PSC_SYNC_BATCH_RETRIES', '2'))
+
+    def is_enabled(self) -> bool:
+        """
+        checks if a member or byte limit is set
+
+        :return:
+        """
+        return self.max_members > 0 or self.max_bytes > 0
+
+    def get_catalog_groups(self, catalog_data: dict) -> dict:
+        """
+        Groups the catalog members and tombstones by catalog id.
+
+        :param catalog_data:
+        :return: a dict of catalog id to a list of (kind, entry, size) tuples
+        """
+        # init the return. dicts keep the order the catalogs came in
+        ret_val: dict = {}
+
+        # the members and then the tombstones
+        entries: list = [('members', member['member_def']['id'], member) for member in catalog_data['catalogs']] + \
+                        [('deletes', member_id, member_id) for member_id in catalog_data.get('deleted_members') or []]
+
+        # for each entry
+        for kind, member_id, entry in entries:
+            # get the entry size if we are limiting bytes
+            size: int = len(PayloadUtils.encode_json(entry)) if self.max_bytes > 0 else 0
+
+            # add it to its catalog
+            ret_val.setdefault(self.sync.get_catalog_id(member_id), []).append((kind, entry, size))
+
+        # return to the caller
+        return ret_val
+
+    def is_batch_full(self, batch: dict, count: int, size: int) -> bool:
+        """
+        checks if adding entries to a batch would put it over the limits. an empty batch is never full.
+
+        :param batch:
+        :param count: the number of entries to add
+        :param size: the size of the entries to add
+        :return:
+        """
+        # get the number of entries already in the batch
+        batch_count: int = len(batch['members']) + len(batch['deletes'])
+
+        # check the limits
+        return batch_count > 0 and ((0 < self.max_members < batch_count + count) or (0 < self.max_bytes < batch['size'] + size))
+
+    def get_catalog_batches(self, catalog_data: dict) -> list:
+        """
+        Splits the catalog data into batches of whole catalogs that stay under the
+        member and byte limits. A catalog that is over the limits by itself is split
+        across batches. The past runs go out with the first batch.
+
+        :param catalog_data:
+        :return: a list of (catalog ids, payload) tuples
+        """
+        # init the batches
+        batches: list = [{'catalog_ids': [], 'members': [], 'deletes': [], 'size': 0}]
+
+        # for each catalog
+        for catalog_id, entries in self.get_catalog_groups(catalog_data).items():
+            # start a new batch if the whole catalog does not fit in this one
+            if self.is_batch_full(batches[-1], len(entries), sum(entry[2] for entry in entries)):
+                batches.append({'catalog_ids': [], 'members': [], 'deletes': [], 'size': 0})
+
+            # for each member and tombstone in the catalog
+            for kind, entry, size in entries:
+                # split oversize catalogs across batches
+                if self.is_batch_full(batches[-1], 1, size):
+                    batches.append({'catalog_ids': [], 'members': [], 'deletes': [], 'size': 0})
+
+                # add the catalog id to the batch once
+                if not batches[-1]['catalog_ids'] or batches[-1]['catalog_ids'][-1] != catalog_id:
+                    batches[-1]['catalog_ids'].append(catalog_id)
+
+                # add the entry to the batch
+                batches[-1][kind].append(entry)
+                batches[-1]['size'] += size
+
+        # init the return
+        ret_val: list = []
+
+        # create the payload for each batch that has something in it
+        for index, batch in enumerate(item for item in batches if item['catalog_ids']):
+            # copy the top level data and replace the catalog members
+            payload: dict = dict(catalog_data, catalogs=batch['members'], past_runs=catalog_data.get('past_runs') if index == 0 else None)
+
+            # only include tombstones if this is a delta sync
+            if 'deleted_members' in catalog_data:
+                payload['deleted_members'] = batch['deletes']
+
+            # save the batch
+            ret_val.append((batch['catalog_ids'], payload))
+
+        # return to the caller
+        return ret_val
+
+    def push(self, catalog_data: dict, run_id: str = 'N/A') -> dict:
+        """
+        Pushes the catalog data in concurrent batches, retrying only the batches that failed.
+        Batches of a run that has pushes waiting in the outbox are queued behind them without retries.
+
+        :param catalog_data:
+        :param run_id:
+        :return: a dict of catalog id to success flag
+        """
+        # split the catalogs into batches
+        batches: list = self.get_catalog_batches(catalog_data)
+
+        # init the outcome of each batch
+        outcomes: dict = {}
+
+        # start with all batches pending
+        pending: list = list(range(len(batches)))
+
+        # the batches of a run with pushes waiting in the outbox go straight into it
+        retries: int = 0 if self.sync.components.sender.is_waiting(run_id) else self.retries
+
+        # send the batches, retrying the failures
+        for attempt in range(retries + 1):
+            # wait a bit before retrying
+            if attempt > 0:
+                self.sync.logger.warning('Warning: Retrying %s of %s %s sync batches for run id %s.', len(pending), len(batches), self.sync.target,
+                                         run_id)
+                self.sync.metrics.inc('post_retries_total', len(pending), reason='batch')
+                time.sleep(2 ** (attempt - 1))
+
+            # the batches that fail on the last attempt are saved in the outbox
+            spool: bool = attempt == retries
+
+            # send the pending batches concurrently. the batches are parts 1 and up
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+                outcomes.update(zip(pending, executor.map(lambda index, last=spool: self.sync.push_to_psc(batches[index][1], run_id, index + 1, last),
+                                                          pending)))
+
+            # get the batches that still need to go
+            pending = [index for index in pending if not outcomes[index]]
+
+            # are we done
+            if not pending:
+                break
+
+        # every batch made it, so nothing older for the run is left to send
+        if not pending:
+            self.sync.components.sender.remove_run(run_id)
+
+        # init the return
+        ret_val: dict = {}
+
+        # a catalog succeeded if every batch it is in did
+        for index, (catalog_ids, _) in enumerate(batches):
+            for catalog_id in catalog_ids:
+                ret_val[catalog_id] = ret_val.get(catalog_id, True) and outcomes[index]
+
+        # return to the caller
+        return ret_val
@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Reduces the catalog data of a run to what the collaborator does not have yet.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+
+class CatalogDelta:
+    """
+    Class that compares the catalog members of a run with what the member state store says
+    the collaborator was sent before, and saves the new state after a successful push.
+
+    Everything is sent when there is no state store (PSC_SYNC_STATE_DB is not set).
+    """
+
+    def __init__(self, _sync):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this works for. its state store, logger and target name are used
+        """
+        # get the sync object
+        self.sync = _sync
+
+    def get_delta(self, catalog_data: dict, full_resync: bool = False, catalog_ids: list = None) -> tuple:
+        """
+        removes the catalog members the collaborator already has and adds tombstones for members
+        that are no longer in the catalogs. this is a no-op if there is no state store.
+
+        :param catalog_data:
+        :param full_resync: keep all members but still detect the removed ones
+        :param catalog_ids: the catalog ids in the catalog data if they are already known
+        :return: the catalog data and the state updates to save after a successful push
+        """
+        # get the state store
+        state_store = self.sync.shared.state_store
+
+        # nothing to do without a state store
+        if state_store is None:
+            return catalog_data, None
+
+        # init the state changes
+        upserts: list = []
+
+        # init the members to send
+        members: list = []
+
+        # get the ids of the catalogs in this payload
+        if catalog_ids is None:
+            catalog_ids = self.sync.get_unique_catalog_ids(catalog_data)
+
+        # get what the collaborator was sent before for these catalogs
+        known_hashes: dict = state_store.get_member_hashes(self.sync.target, catalog_ids)
+
+        # init the set of members in the current catalogs
+        current_ids: set = set()
+
+        # for each catalog member
+        for member in catalog_data['catalogs']:
+            # get the member and catalog ids
+            member_id: str = member['member_def']['id']
+            catalog_id: str = self.sync.get_catalog_id(member_id)
+
+            # save the id
+            current_ids.add(member_id)
+
+            # get the hash of the current content
+            content_hash: str = state_store.hash_member(member)
+
+            # send it if it is new or changed (or everything is being resent)
+            if full_resync or known_hashes.get(member_id) != content_hash:
+                members.append(member)
+                upserts.append((member_id, catalog_id, content_hash))
+
+        # anything the collaborator has for these catalogs that we no longer have was removed
+        deletes: list = sorted(set(known_hashes) - current_ids)
+
+        self.sync.logger.debug('%s delta: %s of %s members changed, %s removed.', self.sync.target, len(members), len(current_ids), len(deletes))
+
+        # update the payload
+        catalog_data['catalogs'] = members
+        catalog_data['deleted_members'] = deletes
+
+        # return to the caller
+        return catalog_data, {'upserts': upserts, 'deletes': deletes}
+
+    def save(self, state_updates: dict, catalog_results: dict = None):
+        """
+        remembers what the collaborator has now. this is a no-op if there are no state updates.
+
+        :param state_updates: the state updates from get_delta()
+        :param catalog_results: the success flag of each catalog if the run was batched, only the catalogs that made it are saved
+        :return:
+        """
+        # nothing to do without state updates
+        if state_updates is None:
+            return
+
+        # was the whole run sent
+        if catalog_results is None:
+            self.sync.shared.state_store.update(self.sync.target, state_updates['upserts'], state_updates['deletes'])
+        else:
+            self.sync.shared.state_store.update(self.sync.target, [item for item in state_updates['upserts'] if catalog_results.get(item[1])],
+                                         [item for item in state_updates['deletes'] if catalog_results.get(self.sync.get_catalog_id(item))])
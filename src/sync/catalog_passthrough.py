@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Sends the catalog data of a run as the JSON text from the DB.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+
+from src.common.payload_utils import PayloadUtils
+
+
+class CatalogPassthrough:
+    """
+    Class that sends the catalog member records of a run as the JSON text the DB returned,
+    without decoding and re-encoding it, when every record is already for the collaborator.
+
+    Passthrough is off unless PSC_SYNC_PASSTHROUGH is on, and only used when delta syncs,
+    batching and streaming are off.
+    """
+
+    def __init__(self, _sync):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this sends for. its DB calls, outbox sender, projects, logger and target name are used
+        """
+        # get the sync object
+        self.sync = _sync
+
+        # load the setting
+        self.enabled: bool = os.getenv('PSC_SYNC_PASSTHROUGH', 'false').lower() in ('true', '1', 'yes')
+
+    def push(self, run_id: str, full_resync: bool = False) -> bool:
+        """
+        Gets the catalog member records of a run as JSON text and, if every record is already
+        for the collaborator, sends the text as is. Otherwise the text is decoded and goes
+        through the normal filtering.
+
+        :param run_id:
+        :param full_resync:
+        :return:
+        """
+        # make the DB request to get the catalogs
+        ret_val = self.sync.query_db('catalog_member_records_text', self.sync.db_info.get_catalog_member_records_text, run_id=run_id,
+                                     projects=self.sync.psc_sync_projects)
+
+        # did the DB request fail
+        if ret_val == -1:
+            self.sync.logger.error('Error: Failed to get sync data from the database for run id %s.', run_id)
+
+            # return the failure to the caller
+            return False
+
+        # get the flag and the JSON text. an empty result is no catalogs
+        flag, text = ret_val if ret_val != 0 else ('N', None)
+
+        # no catalogs means nothing to send
+        if flag == 'N':
+            self.sync.logger.warning('Warning: No records found in the database for run id %s.', run_id)
+
+            # nothing to do
+            return True
+
+        # does something need to be filtered out
+        if flag == 'F':
+            # decode it and use the normal path
+            return self.sync.sync_run_catalog_data(PayloadUtils.decode_json(text), run_id, full_resync)
+
+        # add in the system this is coming from by replacing the closing brace of the document
+        body: bytes = text.rstrip()[:-1].encode('utf-8') + b',"system":' + PayloadUtils.encode_json(self.sync.shared.config['system']) + b'}'
+
+        # make the call to push the data to the collaborator
+        success = self.sync.components.sender.push_body(body, run_id)
+
+        # did it fail
+        if not success:
+            self.sync.logger.warning('Error: %s sync failure for run id %s.', self.sync.target, run_id)
+        else:
+            self.sync.logger.info('%s synced for run id %s.', self.sync.target, run_id)
+
+        # return to the caller
+        return success
@@ -0,0 +1,193 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Single-pass catalog processing pipeline with pluggable stages.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import time
+from collections import namedtuple
+
+# the result of a pipeline run. valid is False if a validate stage rejected a record
+CatalogPipelineResult = namedtuple('CatalogPipelineResult', ['valid', 'catalog_data', 'groups', 'timings'])
+
+
+class CatalogValidationError(Exception):
+    """
+    Raised inside the pipeline to stop processing when a validate stage rejects a record
+    """
+
+
+class CatalogPipeline:
+    """
+    Class that runs registered stages over the records of the catalogs and past_runs
+    sections of the catalog data in one pass.
+
+    Each record flows through the stages in kind order: validate, filter, enrich, group.
+     - validate: func(record) -> bool. False rejects the whole document.
+     - filter: func(record) -> bool. False drops the record.
+     - enrich: func(record) -> record. The record returned replaces the original.
+     - group: func(record) -> key. Records are collected per key, a key of None skips the record.
+    """
+
+    # the stage kinds in the order they run
+    STAGE_KINDS: tuple = ('validate', 'filter', 'enrich', 'group')
+
+    def __init__(self):
+        """
+        Initializes this class
+
+        """
+        # the registered stages per kind as (name, section, func) tuples
+        self.stages: dict = {kind: [] for kind in self.STAGE_KINDS}
+
+    def register_stage(self, kind: str, name: str, func, section: str = 'catalogs'):
+        """
+        Registers a stage
+
+        :param kind: one of validate, filter, enrich or group
+        :param name: the name used for the timings and groups
+        :param func: the stage function, called once per record
+        :param section: the section of records the stage runs on, catalogs or past_runs
+        :return:
+        """
+        # make sure this is a legit stage kind
+        if kind not in self.stages:
+            raise ValueError(f'Unknown pipeline stage kind: {kind}')
+
+        # add the stage
+        self.stages[kind].append((name, section, func))
+
+    def process(self, catalog_data: dict) -> CatalogPipelineResult:
+        """
+        Runs the stages over the catalog data. The sections are replaced with the records that
+        made it through, other keys are left alone.
+
+        :param catalog_data:
+        :return:
+        """
+        # init the stage timings and the groups
+        timings: dict = {name: 0.0 for kind in self.STAGE_KINDS for name, _, _ in self.stages[kind]}
+        groups: dict = {name: {} for name, _, _ in self.stages['group']}
+
+        try:
+            # for each section of records
+            for section in ('catalogs', 'past_runs'):
+                # nothing to do if the section is empty
+                if catalog_data.get(section) is None:
+                    continue
+
+                # init the record generator
+                records = iter(catalog_data[section])
+
+                # chain a generator for each stage that runs on this section
+                for kind in self.STAGE_KINDS:
+                    for name, stage_section, func in self.stages[kind]:
+                        if stage_section == section:
+                            records = getattr(self, f'{kind}_records')(records, name, func, timings, groups)
+
+                # pull all the records through in one pass
+                catalog_data[section] = list(records)
+
+        except CatalogValidationError:
+            return CatalogPipelineResult(False, catalog_data, groups, timings)
+
+        # return to the caller
+        return CatalogPipelineResult(True, catalog_data, groups, timings)
+
+    @staticmethod
+    def validate_records(records, name: str, func, timings: dict, _):
+        """
+        Passes records through, stopping the pipeline if one is not valid.
+
+        :return:
+        """
+        # for each record
+        for record in records:
+            # get the start time
+            start: float = time.perf_counter()
+
+            # check it
+            valid: bool = func(record)
+
+            # save the time
+            timings[name] += time.perf_counter() - start
+
+            # stop everything if it is not valid
+            if not valid:
+                raise CatalogValidationError(name)
+
+            yield record
+
+    @staticmethod
+    def filter_records(records, name: str, func, timings: dict, _):
+        """
+        Passes on the records the stage keeps.
+
+        :return:
+        """
+        # for each record
+        for record in records:
+            # get the start time
+            start: float = time.perf_counter()
+
+            # check it
+            keep: bool = func(record)
+
+            # save the time
+            timings[name] += time.perf_counter() - start
+
+            # pass it on if it is a keeper
+            if keep:
+                yield record
+
+    @staticmethod
+    def enrich_records(records, name: str, func, timings: dict, _):
+        """
+        Passes on the records the stage returns.
+
+        :return:
+        """
+        # for each record
+        for record in records:
+            # get the start time
+            start: float = time.perf_counter()
+
+            # update it
+            record = func(record)
+
+            # save the time
+            timings[name] += time.perf_counter() - start
+
+            yield record
+
+    @staticmethod
+    def group_records(records, name: str, func, timings: dict, groups: dict):
+        """
+        Collects the records by the key the stage returns and passes them on.
+
+        :return:
+        """
+        # for each record
+        for record in records:
+            # get the start time
+            start: float = time.perf_counter()
+
+            # get the key
+            key = func(record)
+
+            # collect it
+            if key is not None:
+                groups[name].setdefault(key, []).append(record)
+
+            # save the time
+            timings[name] += time.perf_counter() - start
+
+            yield record
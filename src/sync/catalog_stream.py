@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Streams the catalog data of a run from a DB cursor into the request body.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import itertools
+
+from src.common.payload_utils import PayloadUtils
+
+
+class CatalogRejected(Exception):
+    """
+    Raised to abort a streamed push when a catalog member is not for the collaborator
+    """
+
+
+class CatalogStreamer:
+    """
+    Class that streams the catalog member records of a run from a DB cursor into a chunked
+    request body, so memory use does not depend on the size of the catalogs.
+
+    Runs are streamed when PSC_SYNC_STREAMING is on, or when they have at least
+    PSC_SYNC_STREAM_MIN_MEMBERS catalog members. Delta syncs and batching do not apply to
+    streamed runs.
+    """
+
+    def __init__(self, _sync):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this streams for. its DB connection, transport, projects, logger, metrics and target name are used
+        """
+        # get the sync object
+        self.sync = _sync
+
+        # load the streaming settings. 0 turns streaming by size off
+        self.enabled: bool = os.getenv('PSC_SYNC_STREAMING', 'false').lower() in ('true', '1', 'yes')
+        self.itersize: int = int(os.getenv('PSC_SYNC_STREAM_ITERSIZE', '1000'))
+        self.min_members: int = int(os.getenv('PSC_SYNC_STREAM_MIN_MEMBERS', '0'))
+
+    def is_streamed(self, probe: dict = None) -> bool:
+        """
+        checks if a run is streamed
+
+        :param probe: the probe results, None if the run was not probed
+        :return:
+        """
+        return self.enabled or (self.min_members > 0 and probe is not None and probe['member_count'] >= self.min_members)
+
+    def push(self, run_id: str) -> bool:
+        """
+        Streams the catalog member records of a run to the collaborator. The past runs are
+        filtered on the way through and the push is aborted if a catalog member is not for the
+        collaborator. The request is not started until the first chunk of the body is built.
+
+        :param run_id:
+        :return:
+        """
+        # init the return
+        success = True
+
+        # get the record stream
+        rows = self.sync.db_info.stream_catalog_member_records(run_id=run_id, projects=self.sync.psc_sync_projects, itersize=self.itersize)
+
+        try:
+            # get the first record. catalogs come first, so no catalog records means nothing to send
+            first = next(rows, None)
+
+            # if we got data push it to the collaborator
+            if first is not None and first[0] == 'catalogs':
+                # init the record and byte counters
+                counts: dict = {'catalogs': 0, 'past_runs': 0, 'body_bytes': 0, 'sent_bytes': 0}
+
+                # post the body as it is built
+                ret_val = self.sync.components.transport.post_stream(self.get_stream_body(itertools.chain([first], rows), counts), counts)
+
+                self.sync.logger.info('%s sync stream for run id %s: %s catalog members, %s past runs, %s bytes, %s bytes sent (encoding: %s).',
+                                      self.sync.target, run_id, counts['catalogs'], counts['past_runs'], counts['body_bytes'], counts['sent_bytes'],
+                                      counts.get('encoding', 'identity'))
+
+                # count what was sent
+                self.sync.metrics.count_records({'catalogs': range(counts['catalogs']), 'past_runs': range(counts['past_runs'])}, 'filtered')
+
+                # did the collaborator refuse the encoding
+                if ret_val.status_code == 415 and 'encoding' in counts:
+                    self.sync.logger.warning('Warning: %s does not accept %s encoded requests, disabling compression.', self.sync.target,
+                                             counts['encoding'])
+
+                    # stop compressing
+                    self.sync.components.transport.compression = None
+
+                    # stream it again
+                    rows.close()
+                    return self.push(run_id)
+
+                # was the call unsuccessful
+                if ret_val.status_code != 200:
+                    self.sync.logger.error('Error: %s sync request failure code %s for run id %s.', self.sync.target, ret_val.status_code, run_id)
+
+                    # set the failure flag
+                    success = False
+                else:
+                    self.sync.logger.info('%s synced for run id %s.', self.sync.target, run_id)
+            else:
+                self.sync.logger.warning('Warning: No records found in the database for run id %s.', run_id)
+
+        except CatalogRejected:
+            self.sync.logger.warning('Warning: One or more catalogs for run id %s were not for %s.', run_id, self.sync.target)
+
+        except Exception:
+            self.sync.logger.exception('Exception: %s sync stream failure for run id %s.', self.sync.target, run_id)
+
+            # set the failure return code
+            success = False
+
+        finally:
+            # release the DB cursor
+            rows.close()
+
+        # return the success flag
+        return success
+
+    def get_stream_body(self, rows, counts: dict):
+        """
+        Builds the JSON request body from (section, project code, record JSON) rows.
+
+        :param rows: the catalog records followed by the past run records
+        :param counts: the record counters to update
+        :return: a generator of bytes
+        """
+        # start the document
+        yield b'{"catalogs":['
+
+        # init the current section
+        section: str = 'catalogs'
+
+        # for each record
+        for name, project_code, record in rows:
+            # every catalog member must be for the collaborator
+            if name == 'catalogs':
+                if project_code not in self.sync.psc_sync_projects:
+                    raise CatalogRejected(project_code)
+            else:
+                # start the past runs
+                if section != name:
+                    section = name
+                    yield b'],"past_runs":['
+
+                # only keep the past runs of the collaborator
+                if project_code not in self.sync.psc_sync_projects:
+                    continue
+
+            # add the record
+            yield (b',' if counts[name] else b'') + record.encode('utf-8')
+
+            # count it
+            counts[name] += 1
+
+        # close the past runs, starting them if there were none
+        if section == 'catalogs':
+            yield b'],"past_runs":['
+
+        # add in the system this is coming from and end the document
+        yield b'],"system":' + PayloadUtils.encode_json(self.sync.shared.config['system']) + b'}'
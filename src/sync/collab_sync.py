@@ -0,0 +1,260 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Syncs the catalogs of a run to all the collaborators that get it.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import time
+import contextvars
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from src.common.logger import LoggingUtil
+from src.common.pg_pool import PGConnectionError
+from src.sync.collaborators import CollaboratorRegistry
+from src.sync.psc_sync import PSCDataSync
+
+
+class CollabDataSync:
+    """
+    Class that fetches the catalog member records of a run once and pushes a filtered view
+    of them to each collaborator that gets the runs of its physical location, concurrently.
+
+    There is a PSCDataSync object per collaborator. They share the DB connection, member
+    state, outbox, metrics, profiler and HTTP session of the first one.
+    """
+
+    def __init__(self, _logger=None, _db_info=None, _registry=None):
+        """
+        Initializes this class
+
+        :param _logger:
+        :param _db_info: a DB object to use instead of connecting to the apsviz DB
+        :param _registry: a CollaboratorRegistry to use instead of loading it
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.CollabSync", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # get the collaborators
+        self.registry: CollaboratorRegistry = _registry if _registry is not None else CollaboratorRegistry()
+
+        # create the sync object of the first collaborator, which owns the shared resources
+        self.primary: PSCDataSync = PSCDataSync(self.logger, _db_info, self.registry.collaborators[0])
+
+        # create the sync objects of the others
+        self.targets: dict = {self.primary.target: self.primary}
+
+        for collaborator in self.registry.collaborators[1:]:
+            self.targets[collaborator.name] = PSCDataSync(self.logger, _collaborator=collaborator, _parent=self.primary)
+
+        # get the metrics, the member state and the outbox everyone shares
+        self.metrics = self.primary.metrics
+        self.state_store = self.primary.shared.state_store
+        self.outbox = self.primary.shared.outbox
+
+        # label the metrics of each collaborator when there is more than one
+        if len(self.targets) > 1:
+            for name, target in self.targets.items():
+                target.metrics = self.metrics.child(target=name)
+
+    @property
+    def db_info(self):
+        """
+        Gets the DB connection object everyone shares, connecting on first use
+
+        :return:
+        """
+        return self.primary.db_info
+
+    @property
+    def db_lock(self):
+        """
+        Gets the lock to take to use the DB connection everyone shares
+
+        :return:
+        """
+        return self.primary.db_lock
+
+    def close(self):
+        """
+        Closes the shared resources and writes out the metrics
+
+        :return:
+        """
+        # the first collaborator owns everything
+        self.primary.close()
+
+        # stop serving the metrics
+        self.metrics.close()
+
+    def run(self, run_id: str, physical_location: str, full_resync: bool = False) -> dict:
+        """
+        Syncs a run to every collaborator that gets the runs of the physical location
+
+        :param run_id:
+        :param physical_location:
+        :param full_resync: send all members even if the collaborators already have them
+        :return: a dict of collaborator name to success flag
+        """
+        # get the collaborators for this run
+        targets: list = [self.targets[collaborator.name] for collaborator in self.registry.get_matching(physical_location)]
+
+        # a lone collaborator runs on its own, which keeps the streaming and passthrough modes
+        if len(targets) == 1:
+            return {targets[0].target: targets[0].run(run_id, physical_location, full_resync)}
+
+        # init the return
+        ret_val: dict = {}
+
+        # is there anyone to sync to
+        if targets:
+            # tag the log records with the run id
+            token = LoggingUtil.set_run_id(run_id)
+
+            try:
+                # profile the run if enabled
+                with self.primary.shared.profiler.profile(run_id) if self.primary.shared.profiler is not None else nullcontext():
+                    ret_val = self.sync_targets(targets, run_id, full_resync)
+            finally:
+                LoggingUtil.reset_run_id(token)
+        else:
+            self.logger.debug('%s is not a run for any of %s.', run_id, list(self.targets))
+
+            # record the run
+            self.metrics.inc('runs_total', result='skipped')
+
+        # return to the caller
+        return ret_val
+
+    def run_many(self, jobs: list, full_resync: bool = False) -> dict:
+        """
+        Syncs many runs at once, PSC_SYNC_RUN_WORKERS at a time. The DB fetch of one run overlaps the pushes of another.
+
+        :param jobs: a list of (run_id, physical_location) tuples
+        :param full_resync:
+        :return: a dict of (run_id, physical_location) to the dict of collaborator name to success flag
+        """
+        # remove duplicate jobs but keep the order
+        jobs = list(dict.fromkeys((run_id, physical_location) for run_id, physical_location in jobs))
+
+        # init the return
+        ret_val: dict = {}
+
+        # is there anything to do
+        if jobs:
+            # run the jobs concurrently, each in its own copy of the log context
+            with ThreadPoolExecutor(max_workers=max(1, self.primary.shared.config['run_workers']), thread_name_prefix='collab-sync-run') as executor:
+                futures: dict = {job: executor.submit(contextvars.copy_context().run, self.run, job[0], job[1], full_resync) for job in jobs}
+
+                # collect the results
+                ret_val = {job: future.result() for job, future in futures.items()}
+
+            self.logger.info('Multi-run sync complete: %s of %s runs succeeded.', sum(all(result.values()) for result in ret_val.values()),
+                             len(ret_val))
+
+        # return to the caller
+        return ret_val
+
+    def sync_targets(self, targets: list, run_id: str, full_resync: bool = False) -> dict:
+        """
+        Fetches the catalogs of a run for all the collaborators' project codes and syncs a view of them to each one
+
+        :param targets: the PSCDataSync objects of the collaborators
+        :param run_id:
+        :param full_resync:
+        :return: a dict of collaborator name to success flag
+        """
+        # get the start time
+        start: float = time.perf_counter()
+
+        # init the collaborators the run is fetched for
+        fetch_targets: list = []
+
+        try:
+            # get the project codes and size of the run once for everyone
+            probe: dict = self.primary.components.probe.get(run_id)
+
+            # get the collaborators the run is worth fetching for
+            fetch_targets = [target for target in targets if target.components.probe.check(probe, run_id)]
+
+            # init the catalogs
+            catalog_data = None
+
+            # make one DB request for them, filtered to all their projects in the DB
+            if fetch_targets:
+                catalog_data = self.primary.query_db('catalog_member_records', self.primary.db_info.get_catalog_member_records_filtered,
+                                                     run_id=run_id, projects=set().union(*(target.psc_sync_projects for target in fetch_targets)))
+        except PGConnectionError as e:
+            self.logger.error('Error: Database unavailable for run id %s. %s', run_id, e)
+            catalog_data = -1
+        except Exception:
+            self.logger.exception('Failed to get sync data from the database for run id %s.', run_id)
+            catalog_data = -1
+
+        # did the DB request fail
+        if isinstance(catalog_data, int) and catalog_data == -1:
+            self.logger.error('Error: Failed to get sync data from the database for run id %s.', run_id)
+
+            # everyone failed
+            ret_val: dict = {target.target: False for target in targets}
+        else:
+            # there was nothing to do for the collaborators the run was not fetched for
+            ret_val: dict = {target.target: True for target in targets}
+
+            # push to everyone else at once. each gets its own copy of the top level, the sections are replaced, not changed, by the filtering
+            if fetch_targets:
+                with ThreadPoolExecutor(max_workers=len(fetch_targets), thread_name_prefix='collab-sync-target') as executor:
+                    futures: dict = {target.target: executor.submit(contextvars.copy_context().run, target.sync_run_catalog_data,
+                                                                    dict(catalog_data) if catalog_data else catalog_data, run_id, full_resync)
+                                     for target in fetch_targets}
+
+                    # collect the results
+                    ret_val.update({name: future.result() for name, future in futures.items()})
+
+        # record the run for each collaborator
+        for target in targets:
+            target.metrics.observe('run_seconds', time.perf_counter() - start)
+            target.metrics.inc('runs_total', result='success' if ret_val[target.target] else 'failure')
+            target.metrics.set('last_run_timestamp_seconds', time.time())
+
+        self.logger.info('Collaborator sync for run id %s: %s', run_id, ret_val)
+
+        # return to the caller
+        return ret_val
+
+    def backfill(self, *args, **kwargs) -> dict:
+        """
+        Re-syncs runs to each collaborator in turn. See PSCDataSync.backfill()
+
+        :return: a dict of collaborator name to the dict of run id to success flag
+        """
+        return {name: target.backfill(*args, **kwargs) for name, target in self.targets.items()}
+
+    def drain_outbox(self, limit: int = 100) -> tuple:
+        """
+        Sends the outbox entries that are due to each collaborator
+
+        :param limit: the most entries sent per collaborator
+        :return: the number of entries sent and the number that are still waiting
+        """
+        # drain each collaborator
+        results: list = [target.drain_outbox(limit) for target in self.targets.values()]
+
+        # return the totals
+        return sum(sent for sent, _ in results), sum(depth for _, depth in results)
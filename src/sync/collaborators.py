@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Registry of the collaborators the catalogs are synced to.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import json
+from collections import namedtuple
+
+# a collaborator sync target
+Collaborator = namedtuple('Collaborator', ['name', 'url', 'auth_header', 'projects', 'physical_locations'])
+
+
+class CollaboratorRegistry:
+    """
+    Class that holds the collaborators, each with its endpoint URL, auth, project codes and
+    the physical locations whose runs it gets.
+
+    The collaborators are loaded from the JSON file in COLLAB_SYNC_CONFIG, a list of objects like:
+
+        {"name": "PSC", "url": "https://...", "token_env": "PSC_SYNC_TOKEN", "projects": ["..."], "physical_locations": ["PSC", "TWI"]}
+
+    The token is taken from the environment variable named in token_env, or from token. Without
+    a config file there is just PSC, set up from the PSC_SYNC_* environment variables.
+    """
+
+    def __init__(self, collaborators: list = None, config_path: str = None):
+        """
+        Initializes this class
+
+        :param collaborators: a list of Collaborator to use instead of loading them
+        :param config_path: the collaborator config file, defaults to COLLAB_SYNC_CONFIG
+        """
+        # use the collaborators passed in, or load them
+        if collaborators is not None:
+            self.collaborators: list = list(collaborators)
+        else:
+            # get the config file
+            config_path = config_path or os.getenv('COLLAB_SYNC_CONFIG')
+
+            self.collaborators: list = self.load(config_path) if config_path else [self.get_psc_collaborator()]
+
+        # there must be at least one and the names are used as keys
+        names: list = [collaborator.name for collaborator in self.collaborators]
+
+        if not names or len(names) != len(set(names)):
+            raise ValueError(f'The collaborator names must be unique and there must be at least one: {names}')
+
+    @staticmethod
+    def get_auth_header(token: str) -> dict:
+        """
+        Gets the request headers for a bearer token
+
+        :param token:
+        :return:
+        """
+        return {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+
+    @staticmethod
+    def get_psc_collaborator() -> Collaborator:
+        """
+        Gets the PSC collaborator from the PSC_SYNC_* environment variables
+
+        :return:
+        """
+        return Collaborator('PSC', os.getenv('PSC_SYNC_URL'), CollaboratorRegistry.get_auth_header(os.environ.get('PSC_SYNC_TOKEN')),
+                            frozenset(os.environ.get('PSC_SYNC_PROJECTS').split(',')), ('PSC', 'TWI'))
+
+    @staticmethod
+    def load(config_path: str) -> list:
+        """
+        Loads the collaborators from a JSON config file
+
+        :param config_path:
+        :return: a list of Collaborator
+        """
+        # read the config
+        with open(config_path, 'r', encoding='utf-8') as fp:
+            config: list = json.load(fp)
+
+        # init the return
+        ret_val: list = []
+
+        # for each collaborator
+        for item in config:
+            try:
+                # get the token, preferably from the environment
+                token: str = os.environ.get(item['token_env']) if item.get('token_env') else item.get('token')
+
+                # save it
+                ret_val.append(Collaborator(item['name'], item['url'], CollaboratorRegistry.get_auth_header(token), frozenset(item['projects']),
+                                            tuple(item['physical_locations'])))
+            except (KeyError, TypeError) as e:
+                raise ValueError(f'Invalid collaborator in {config_path}: {item}') from e
+
+        # return to the caller
+        return ret_val
+
+    def get_matching(self, physical_location: str) -> list:
+        """
+        Gets the collaborators that get the runs of a physical location
+
+        :param physical_location:
+        :return:
+        """
+        return [collaborator for collaborator in self.collaborators if physical_location in collaborator.physical_locations]
@@ -0,0 +1,183 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Sends the sync request bodies through the outbox of failed pushes.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+from src.common.sync_outbox import OutboxEntry
+
+
+class OutboxSender:
+    """
+    Class that pushes request bodies to a collaborator while keeping the outbox in step, and
+    drains the outbox.
+
+    If there is an outbox a failed push is saved in it to be sent later. A run that already
+    has pushes waiting there is queued behind them instead of being sent, so it never
+    overtakes them. A successful push of a whole run clears anything still waiting for it.
+    """
+
+    def __init__(self, _sync):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this sends for. its outbox, transport, logger, metrics and target name are used
+        """
+        # get the sync object
+        self.sync = _sync
+
+    def update_depth(self):
+        """
+        Sets the outbox depth metric
+
+        :return: the number of entries waiting
+        """
+        # get the depth
+        depth: int = self.sync.shared.outbox.get_depth(self.sync.target)
+
+        self.sync.metrics.set('outbox_depth', depth)
+
+        # return to the caller
+        return depth
+
+    def is_waiting(self, run_id: str) -> bool:
+        """
+        Checks if a run has pushes waiting in the outbox
+
+        :param run_id:
+        :return:
+        """
+        return self.sync.shared.outbox is not None and run_id is not None and self.sync.shared.outbox.has_run(self.sync.target, run_id)
+
+    def remove_run(self, run_id: str):
+        """
+        Removes everything waiting for a run, e.g. once all its batches made it
+
+        :param run_id:
+        :return:
+        """
+        if self.sync.shared.outbox is not None:
+            self.sync.shared.outbox.remove(self.sync.target, run_id)
+            self.update_depth()
+
+    def push_body(self, body: bytes, run_id: str = 'N/A', part: int = 0, spool: bool = True) -> bool:
+        """
+        Pushes an already serialized JSON body to the collaborator.
+
+        :param body:
+        :param run_id:
+        :param part: the batch number of the body, 0 if the run is not batched
+        :param spool: save the body in the outbox if the push fails
+        :return:
+        """
+        # init the return code
+        success = True
+
+        # init the failure reason
+        error: str = None
+
+        # queue the push behind the ones of the run that are waiting
+        if self.is_waiting(run_id):
+            self.sync.shared.outbox.add(OutboxEntry(None, self.sync.target, run_id, part, body), 'queued behind earlier pushes')
+
+            # update the depth
+            self.update_depth()
+
+            # it was not sent
+            return False
+
+        try:
+            # execute the post
+            ret_val = self.sync.components.transport.post_body(body, run_id)
+
+            # was the call unsuccessful
+            if ret_val.status_code != 200:
+                # log the error
+                self.sync.logger.error('Error: %s sync request failure code %s for run id %s.', self.sync.target, ret_val.status_code, run_id)
+
+                # set the failure flag
+                success = False
+                error = f'HTTP {ret_val.status_code}'
+        except Exception as e:
+            self.sync.logger.exception('Exception: %s sync request failure for run id %s.', self.sync.target, run_id)
+
+            # set the failure return code
+            success = False
+            error = repr(e)
+
+        # keep the outbox in step
+        if self.sync.shared.outbox is not None:
+            if not success and spool:
+                self.sync.shared.outbox.add(OutboxEntry(None, self.sync.target, run_id, part, body), error)
+            elif success:
+                self.sync.shared.outbox.remove(self.sync.target, run_id, None if part == 0 else part)
+
+            # update the depth
+            self.update_depth()
+
+        # return the success flag
+        return success
+
+    def drain(self, limit: int = 100) -> tuple:
+        """
+        Sends the outbox entries again, oldest first. The drain stops at the first failure,
+        which holds back the whole outbox until it is retried with backoff, so newer data never
+        overtakes older data.
+
+        :param limit: the most entries sent
+        :return: the number of entries sent and the number that are still waiting
+        """
+        # init the count sent
+        sent: int = 0
+
+        # nothing to do if there is no outbox
+        if self.sync.shared.outbox is None:
+            return sent, 0
+
+        # for each entry that is due
+        for entry in self.sync.shared.outbox.get_due(self.sync.target, limit):
+            # init the failure reason
+            error: str = None
+
+            try:
+                # send it again
+                ret_val = self.sync.components.transport.post_body(entry.body, entry.run_id)
+
+                # was the call unsuccessful
+                if ret_val.status_code != 200:
+                    error = f'HTTP {ret_val.status_code}'
+            except Exception as e:
+                error = repr(e)
+
+            # did it fail again
+            if error is not None:
+                self.sync.logger.warning('Warning: Outbox push for run id %s (part %s, attempt %s) failed: %s', entry.run_id, entry.part,
+                                         entry.attempts + 1, error)
+
+                # try again later and stop here to keep the order
+                self.sync.shared.outbox.failed(entry, error)
+                self.sync.metrics.inc('post_retries_total', reason='outbox')
+                break
+
+            # it made it
+            self.sync.shared.outbox.sent(entry)
+            self.sync.metrics.inc('outbox_drained_total')
+
+            sent += 1
+
+        # get what is left
+        depth: int = self.update_depth()
+
+        if sent or depth:
+            self.sync.logger.info('%s outbox drain: %s sent, %s waiting.', self.sync.target, sent, depth)
+
+        # return to the caller
+        return sent, depth
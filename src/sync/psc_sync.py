@@ -12,11 +12,29 @@
     Author: Phil Owen, 05/10/2023
 """
 
-import os
-import requests
+import time
+import threading
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 from src.common.logger import LoggingUtil
-from src.common.pg_impl import PGImplementation
+from src.common.pg_pool import PGConnectionError
+from src.common.payload_utils import PayloadUtils
+from src.common.metrics import SyncMetrics
+from src.sync.catalog_pipeline import CatalogPipeline
+from src.sync.collaborators import Collaborator, CollaboratorRegistry
+from src.sync.sync_resources import SyncResources
+from src.sync.run_probe import RunProbe
+from src.sync.psc_transport import PSCTransport
+from src.sync.outbox_sender import OutboxSender
+from src.sync.catalog_batcher import CatalogBatcher
+from src.sync.catalog_stream import CatalogStreamer
+from src.sync.catalog_passthrough import CatalogPassthrough
+from src.sync.catalog_delta import CatalogDelta
+
+# the parts of a sync object that probe, filter and send the catalogs of a run
+SyncComponents = namedtuple('SyncComponents', ['probe', 'transport', 'sender', 'batcher', 'streamer', 'passthrough', 'delta'])
 
 
 class PSCDataSync:
@@ -25,10 +43,14 @@ class PSCDataSync:
 
     """
 
-    def __init__(self, _logger=None):
+    def __init__(self, _logger=None, _db_info=None, _collaborator=None, _parent=None):
         """
         Initializes this class
 
+        :param _logger:
+        :param _db_info: a DB object to use instead of connecting to the apsviz DB
+        :param _collaborator: the Collaborator to sync to, defaults to PSC
+        :param _parent: a sync object whose DB connection, member state, outbox, metrics, profiler and HTTP session are shared
         """
         # if a reference to a logger passed in use it
         if _logger is not None:
@@ -41,116 +63,494 @@ class PSCDataSync:
             # create a logger
             self.logger = LoggingUtil.init_logging("APSVIZ.PSCSync", level=log_level, line_format='medium', log_file_path=log_path)
 
-        # specify the DBs to gain connectivity to
-        db_names: tuple = ('apsviz',)
+        # get the collaborator this object syncs to. the name keys the member state and the outbox
+        self.collaborator: Collaborator = _collaborator if _collaborator is not None else CollaboratorRegistry.get_psc_collaborator()
 
-        # create a DB connection object
-        self.db_info = PGImplementation(db_names, self.logger)
+        # the collaborators of a run share the run settings, DB connection, member state, outbox, metrics and profiler
+        self.shared: SyncResources = _parent.shared if _parent is not None else SyncResources(self.logger, _db_info)
 
-        # load environment variables specific for PSC operations
-        self.psc_sync_url: str = os.getenv('PSC_SYNC_URL')
-        self.psc_auth_header: dict = {'Content-Type': 'application/json', 'Authorization': f'Bearer {os.environ.get("PSC_SYNC_TOKEN")}'}
-        self.psc_sync_projects: list = os.environ.get('PSC_SYNC_PROJECTS').split(',')
-        self.psc_physical_location: list = ['PSC', 'TWI']
+        # get the metrics. CollabDataSync gives each collaborator a labeled view of them
+        self.metrics: SyncMetrics = self.shared.metrics
 
-        # get the system we are running on
-        self.system = os.getenv('SYSTEM', "Not set")
+        # create the catalog processing pipeline. more stages can be registered on it
+        self.pipeline: CatalogPipeline = self.create_pipeline()
 
-    def run(self, run_id: str, physical_location: str) -> bool:
+        # create the request body senders, the ways a run can be sent besides a single push and the delta sync filter.
+        # the collaborators of a run share the HTTP session
+        transport: PSCTransport = PSCTransport(self, self.collaborator, _parent.components.transport if _parent is not None else None)
+
+        self.components: SyncComponents = SyncComponents(probe=RunProbe(self), transport=transport, sender=OutboxSender(self),
+                                                         batcher=CatalogBatcher(self), streamer=CatalogStreamer(self),
+                                                         passthrough=CatalogPassthrough(self), delta=CatalogDelta(self))
+
+    @property
+    def target(self) -> str:
+        """
+        Gets the name of the collaborator this object syncs to
+
+        :return:
+        """
+        return self.collaborator.name
+
+    @property
+    def psc_sync_projects(self) -> frozenset:
+        """
+        Gets the project codes of the collaborator this object syncs to
+
+        :return:
+        """
+        return self.collaborator.projects
+
+    @property
+    def db_info(self):
+        """
+        Gets the DB connection object, connecting to the apsviz DB on first use
+
+        :return:
+        """
+        # the DB driver is only loaded when it is needed
+        from src.common.pg_impl import PGImplementation  # pylint: disable=import-outside-toplevel
+
+        # return to the caller
+        return self.shared.get_lazy('db_info', lambda: PGImplementation(('apsviz',), self.logger))
+
+    @property
+    def db_lock(self):
+        """
+        Gets the lock concurrent runs take to use the DB connection
+
+        :return:
+        """
+        # a single DB connection is shared, so concurrent runs take turns using it. a pooled one is thread-safe
+        return self.shared.get_lazy('db_lock', lambda: nullcontext() if self.db_info.is_pooled('apsviz') else threading.Lock())
+
+    def create_pipeline(self) -> CatalogPipeline:
+        """
+        Creates the catalog processing pipeline: validate the catalog project codes,
+        filter the past runs by project code and group the members by catalog id.
+
+        :return:
+        """
+        # create the pipeline
+        pipeline = CatalogPipeline()
+
+        # all catalogs must be for PSC
+        pipeline.register_stage('validate', 'project_codes', lambda record: record['project_code'] in self.psc_sync_projects)
+
+        # only PSC past runs are sent
+        pipeline.register_stage('filter', 'past_run_projects', lambda record: record['project_code'] in self.psc_sync_projects, 'past_runs')
+
+        # get the catalog ids
+        pipeline.register_stage('group', 'catalog_ids', lambda record: self.get_catalog_id(record['member_def']['id']))
+
+        # return to the caller
+        return pipeline
+
+    def close(self):
+        """
+        Closes the HTTP session and any pooled connections and writes out the metrics
+
+        :return:
+        """
+        # close the session if one was made
+        self.components.transport.close()
+
+        # write out the metrics and close the outbox
+        self.shared.close()
+
+    def run(self, run_id: str, physical_location: str, full_resync: bool = False) -> bool:
+        """
+        Gets the catalog member records for the run id and sends them to PSC, tagging the log
+        records with the run id and profiling the run if enabled
+
+        :param run_id:
+        :param physical_location:
+        :param full_resync: send all members even if PSC already has them
+        :return:
+        """
+        # tag the log records with the run id
+        token = LoggingUtil.set_run_id(run_id)
+
+        try:
+            # is profiling off
+            if self.shared.profiler is None:
+                return self.sync_run(run_id, physical_location, full_resync)
+
+            # profile the run
+            with self.shared.profiler.profile(run_id):
+                return self.sync_run(run_id, physical_location, full_resync)
+        finally:
+            LoggingUtil.reset_run_id(token)
+
+    def sync_run(self, run_id: str, physical_location: str, full_resync: bool = False) -> bool:
         """
         Gets the catalog member records for the run id and sends them to PSC
 
         :param run_id:
         :param physical_location:
+        :param full_resync: send all members even if PSC already has them
         :return:
         """
         # init the return
         success = True
 
+        # get the start time
+        start: float = time.perf_counter()
+
         # is this coming from PSC
-        if physical_location in self.psc_physical_location:
+        if physical_location in self.collaborator.physical_locations:
             try:
-                # make the DB request to get the catalogs
-                catalog_data: dict = self.db_info.get_catalog_member_records(run_id=run_id)  # , filter_event_type='nowcast'
-
-                # if we got data push it to PSC
-                if catalog_data is not None and catalog_data['catalogs'] is not None:
-                    # clean up the past run data
-                    catalog_data = self.filter_catalog_past_runs(catalog_data)
-
-                    # make sure that all catalogs are have the proper target project code
-                    if self.check_project_codes(catalog_data):
-                        # make the call to push the data to PSC
-                        success = self.push_to_psc(catalog_data, run_id)
-
-                        # did it fail
-                        if not success:
-                            self.logger.warning('Error: PSC sync failure for run id %s.', run_id)
-                        else:
-                            self.logger.info('PSC synced for run id %s.', run_id)
+                # get the project codes and size of the run
+                probe: dict = self.components.probe.get(run_id)
+
+                # is the run worth fetching
+                if self.components.probe.check(probe, run_id):
+                    # get how to sync it
+                    sync_path: str = self.get_sync_path(probe, run_id)
+
+                    # are we streaming the records straight through
+                    if sync_path == 'stream':
+                        # the DB connection is in use for the whole push
+                        with self.db_lock:
+                            success = self.components.streamer.push(run_id)
+
+                        # a streamed body cannot be saved in the outbox, so a failed stream is fetched and pushed, which saves it if it fails again
+                        if not success and self.shared.outbox is not None:
+                            self.logger.warning('Warning: %s sync stream failed for run id %s, fetching it for the outbox.', self.target, run_id)
+
+                            success = self.fetch_and_sync(run_id, full_resync)
+
+                    # can the DB JSON text be sent as is
+                    elif sync_path == 'passthrough':
+                        success = self.components.passthrough.push(run_id, full_resync)
+
                     else:
-                        self.logger.warning('Warning: One or more catalogs for run id %s were not for PSC.', run_id)
-                else:
-                    self.logger.warning('Warning: No records found in the database for run id %s.', run_id)
+                        # make the DB request to get the catalogs, filtered to the PSC projects in the DB
+                        success = self.fetch_and_sync(run_id, full_resync)
+
+            except PGConnectionError as e:
+                self.logger.error('Error: Database unavailable for run id %s. %s', run_id, e)
+
+                # set the failure code
+                success = False
 
             except Exception:
                 self.logger.exception('Failed to get sync data from the database for run id %s.', run_id)
 
                 # set the failure code
                 success = False
+
+            # record the run
+            self.metrics.observe('run_seconds', time.perf_counter() - start)
+            self.metrics.inc('runs_total', result='success' if success else 'failure')
         else:
-            self.logger.debug('%s is not a %s run.', run_id, self.psc_physical_location)
+            self.logger.debug('%s is not a %s run.', run_id, self.collaborator.physical_locations)
+
+            # record the run
+            self.metrics.inc('runs_total', result='skipped')
+
+        # save when this run finished
+        self.metrics.set('last_run_timestamp_seconds', time.time())
 
         # return the data to the caller
         return success
 
-    def check_project_codes(self, catalog_data: dict) -> bool:
+    def get_sync_path(self, probe: dict = None, run_id: str = None) -> str:
         """
-        checks to make sure all catalog member entries have PSC project codes.
+        Gets how a run is synced: streamed from a DB cursor, passed through as the DB JSON text or
+        fetched and pushed, whole or in batches. Runs with at least PSC_SYNC_STREAM_MIN_MEMBERS
+        catalog members are streamed, unless the run has pushes waiting in the outbox, since a
+        streamed body cannot be queued behind them.
+
+        :param probe: the probe results, None if the run was not probed
+        :param run_id:
+        :return: stream, passthrough or fetch
+        """
+        # does the run have pushes waiting in the outbox
+        waiting: bool = self.components.sender.is_waiting(run_id)
+
+        # are we streaming the records straight through
+        if not waiting and self.components.streamer.is_streamed(probe):
+            ret_val = 'stream'
+        # can the DB JSON text be sent as is
+        elif self.components.passthrough.enabled and self.shared.state_store is None and not self.components.batcher.is_enabled():
+            ret_val = 'passthrough'
+        else:
+            ret_val = 'fetch'
+
+        # return to the caller
+        return ret_val
+
+    def fetch_and_sync(self, run_id: str, full_resync: bool = False) -> bool:
+        """
+        Gets the catalog member records for the run id and syncs them
+
+        :param run_id:
+        :param full_resync:
+        :return:
+        """
+        # init the return
+        success = True
+
+        # make the DB request to get the catalogs, filtered to the PSC projects in the DB
+        catalog_data: dict = self.query_db('catalog_member_records', self.db_info.get_catalog_member_records_filtered, run_id=run_id,
+                                           projects=self.psc_sync_projects)  # , filter_event_type='nowcast'
+
+        # did the DB request fail
+        if catalog_data == -1:
+            self.logger.error('Error: Failed to get sync data from the database for run id %s.', run_id)
+
+            # set the failure code
+            success = False
+        else:
+            # filter, check and send the catalogs
+            success = self.sync_run_catalog_data(catalog_data, run_id, full_resync)
+
+        # return to the caller
+        return success
+
+    def query_db(self, query: str, func, **kwargs):
+        """
+        Makes a catalog DB call, recording how long it took and the size of the result
+
+        :param query: the name of the query for the metrics
+        :param func: the DB call
+        :param kwargs: the DB call arguments
+        :return: the DB call result
+        """
+        # the DB driver is only loaded when it is needed
+        from src.common.pg_utils_multi import PGUtilsMultiConnect  # pylint: disable=import-outside-toplevel
+
+        # reset the result size count of this thread
+        PGUtilsMultiConnect.take_json_result_size()
+
+        try:
+            # make the DB call. the DB connection may be shared
+            with self.db_lock, self.metrics.timer('db_query_seconds', query=query):
+                ret_val = func(**kwargs)
+        except Exception:
+            # count the failure
+            self.metrics.inc('db_errors_total', query=query)
+            raise
+
+        # did the DB call fail
+        if isinstance(ret_val, int) and ret_val == -1:
+            self.metrics.inc('db_errors_total', query=query)
+        else:
+            # get the size of the decoded JSON results and of any results returned as text
+            size: int = PGUtilsMultiConnect.take_json_result_size()
+
+            if isinstance(ret_val, tuple):
+                size += PGUtilsMultiConnect.get_text_size(ret_val[1])
+
+            self.metrics.observe('db_result_bytes', size, query=query)
+
+        # update the DB connection metrics. nothing is done before the DB is connected
+        self.metrics.collect_db_stats(self.shared.lazy['db_info'])
+
+        # return to the caller
+        return ret_val
+
+    def backfill(self, run_ids: list = None, window: dict = None, full_resync: bool = False) -> dict:
+        """
+        Re-syncs a list of runs or all the runs of a project code and/or time window. The catalogs
+        are fetched a chunk of runs per DB call and the runs of a chunk are pushed concurrently.
+
+        :param run_ids:
+        :param window: the project_code, start_date and/or end_date of the runs to sync if a list is not passed
+        :param full_resync:
+        :return: a dict of run id to success flag
+        """
+        # init the return
+        ret_val: dict = {}
+
+        # get the runs in the window if a list was not passed
+        if run_ids is None:
+            try:
+                run_ids = self.query_db('catalog_run_ids', self.db_info.get_catalog_run_ids, **(window or {}))
+            except PGConnectionError as e:
+                self.logger.error('Error: Database unavailable for the backfill run ids. %s', e)
+
+                # set the failure code
+                run_ids = -1
+
+            # did the lookup fail
+            if run_ids == -1:
+                self.logger.error('Error: Failed to get the run ids to backfill.')
+                return ret_val
+
+        self.logger.info('%s backfill starting for %s runs.', self.target, len(run_ids))
+
+        # for each chunk of runs
+        for index in range(0, len(run_ids), max(1, self.shared.config['backfill_chunk_size'])):
+            # get this chunk of runs
+            chunk: list = run_ids[index:index + max(1, self.shared.config['backfill_chunk_size'])]
+
+            try:
+                # get the catalogs for all the runs in the chunk in one call
+                catalogs: dict = self.query_db('catalog_member_records_bulk', self.db_info.get_catalog_member_records_bulk, run_ids=chunk,
+                                               projects=self.psc_sync_projects)
+            except PGConnectionError as e:
+                self.logger.error('Error: Database unavailable for %s backfill runs. %s', len(chunk), e)
+
+                # set the failure code
+                catalogs = -1
+
+            # did the fetch fail
+            if catalogs == -1:
+                self.logger.error('Error: Failed to get the catalogs to backfill for %s runs.', len(chunk))
+                ret_val.update({run_id: False for run_id in chunk})
+                continue
+
+            # push the runs in this chunk concurrently
+            with ThreadPoolExecutor(max_workers=max(1, self.shared.config['run_workers']), thread_name_prefix='psc-sync-backfill') as executor:
+                futures: dict = {run_id: executor.submit(self.sync_run_catalog_data, catalogs.get(run_id), run_id, full_resync) for run_id in chunk}
+
+                # collect the results
+                ret_val.update({run_id: future.result() for run_id, future in futures.items()})
+
+        self.logger.info('%s backfill complete: %s of %s runs succeeded.', self.target, sum(ret_val.values()), len(ret_val))
+
+        # return to the caller
+        return ret_val
+
+    def sync_run_catalog_data(self, catalog_data: dict, run_id: str, full_resync: bool = False) -> bool:
+        """
+        Syncs the catalog data fetched for a run, treating a run without records as nothing to do.
 
         :param catalog_data:
+        :param run_id:
+        :param full_resync:
         :return:
         """
-        # init the return value
-        success: bool = True
+        # init the return
+        success = True
 
-        # loop through the catalog entries
-        for catalog in catalog_data['catalogs']:
-            # is this a legit PSC entry
-            if catalog['project_code'] not in self.psc_sync_projects:
-                # set the not found flag
-                success = False
+        try:
+            # if we got data push it to PSC
+            if catalog_data and catalog_data.get('catalogs') is not None:
+                # filter, check and send the catalogs
+                success = self.sync_catalog_data(catalog_data, run_id, full_resync)
+            else:
+                self.logger.warning('Warning: No records found in the database for run id %s.', run_id)
+        except Exception:
+            self.logger.exception('Failed to sync the catalog data for run id %s.', run_id)
 
-                # no need to continue
-                break
+            # set the failure code
+            success = False
 
         # return to the caller
         return success
 
-    def push_to_psc(self, catalog_data: dict, run_id: str = 'N/A') -> bool:
+    def sync_catalog_data(self, catalog_data: dict, run_id: str, full_resync: bool = False) -> bool:
+        """
+        Filters and checks the catalog data for a run and pushes what PSC does not have yet.
+
+        :param catalog_data:
+        :param run_id:
+        :param full_resync:
+        :return:
+        """
+        # init the return
+        success = True
+
+        # count what we got
+        self.metrics.count_records(catalog_data, 'fetched')
+        self.metrics.observe('members_per_run', len(catalog_data['catalogs']))
+
+        # check the catalogs, clean up the past run data and group the members by catalog in one pass
+        result = self.pipeline.process(catalog_data)
+
+        self.logger.debug('%s catalog pipeline timings for run id %s: %s', self.target, run_id, result.timings)
+
+        # record the stage times
+        for stage, seconds in result.timings.items():
+            self.metrics.inc('pipeline_stage_seconds_total', seconds, stage=stage)
+
+        # add in the system this is coming from
+        catalog_data = result.catalog_data
+        catalog_data['system'] = self.shared.config['system']
+
+        # make sure that all catalogs are have the proper target project code, the DB may have already found some that do not
+        if result.valid and not catalog_data.get('excluded_project_codes'):
+            # reduce the catalogs to the members PSC does not have yet
+            catalog_data, state_updates = self.components.delta.get_delta(catalog_data, full_resync, list(result.groups['catalog_ids']))
+
+            # count what is left to send
+            self.metrics.count_records(catalog_data, 'filtered')
+
+            # is there anything to send
+            if state_updates is not None and not catalog_data['catalogs'] and not catalog_data['deleted_members']:
+                self.logger.info('%s already up to date for run id %s.', self.target, run_id)
+            # are we sending the catalogs in batches
+            elif self.components.batcher.is_enabled():
+                # push the batches and get the result for each catalog
+                catalog_results: dict = self.components.batcher.push(catalog_data, run_id)
+
+                # it is only a success if every catalog made it
+                success = all(catalog_results.values())
+
+                # did it fail
+                if not success:
+                    self.logger.warning('Error: %s sync failure for run id %s, catalogs: %s.', self.target, run_id,
+                                        sorted(catalog_id for catalog_id, result in catalog_results.items() if not result))
+                else:
+                    self.logger.info('%s synced for run id %s, %s catalogs.', self.target, run_id, len(catalog_results))
+
+                # remember what PSC has now for the catalogs that made it
+                self.components.delta.save(state_updates, catalog_results)
+            else:
+                # make the call to push the data to PSC
+                success = self.push_to_psc(catalog_data, run_id)
+
+                # did it fail
+                if not success:
+                    self.logger.warning('Error: %s sync failure for run id %s.', self.target, run_id)
+                else:
+                    self.logger.info('%s synced for run id %s.', self.target, run_id)
+
+                    # remember what PSC has now
+                    self.components.delta.save(state_updates)
+        else:
+            self.logger.warning('Warning: One or more catalogs for run id %s were not for %s. %s', run_id, self.target,
+                                catalog_data.get('excluded_project_codes') or '')
+
+        # return to the caller
+        return success
+
+    def check_project_codes(self, catalog_data: dict) -> bool:
+        """
+        checks to make sure all catalog member entries have PSC project codes.
+
+        :param catalog_data:
+        :return:
+        """
+        # every catalog entry must be a legit PSC entry, including the ones the DB already left out
+        return not catalog_data.get('excluded_project_codes') and all(catalog['project_code'] in self.psc_sync_projects
+                                                                      for catalog in catalog_data['catalogs'])
+
+    def push_to_psc(self, catalog_data: dict, run_id: str = 'N/A', part: int = 0, spool: bool = True) -> bool:
         """
         Pushes data to the PSC web service endpoint
 
         :param run_id
         :param catalog_data:
+        :param part: the batch number of the data, 0 if the run is not batched
+        :param spool: save the data in the outbox if the push fails
         :return:
         """
         # init the return code
         success = True
 
         try:
-            # execute the post
-            ret_val = requests.post(self.psc_sync_url, headers=self.psc_auth_header, json=catalog_data, timeout=10)
-
-            # was the call unsuccessful
-            if ret_val.status_code != 200:
-                # log the error
-                self.logger.error('Error: PSC sync request failure code %s for run id %s.', ret_val.status_code, run_id)
+            # serialize the catalog data
+            with self.metrics.timer('serialize_seconds'):
+                body: bytes = PayloadUtils.encode_json(catalog_data)
 
-                # set the failure flag
-                success = False
+            # send it
+            success = self.components.sender.push_body(body, run_id, part, spool)
         except Exception:
-            self.logger.exception('Exception: PSC sync request failure for run id %s.', run_id)
+            self.logger.exception('Exception: %s sync request failure for run id %s.', self.target, run_id)
 
             # set the failure return code
             success = False
@@ -158,6 +558,29 @@ class PSCDataSync:
         # return the success flag
         return success
 
+    def drain_outbox(self, limit: int = 100) -> tuple:
+        """
+        Sends the outbox entries again, oldest first. The drain stops at the first failure,
+        which holds back the whole outbox until it is retried with backoff, so newer data never
+        overtakes older data.
+
+        :param limit: the most entries sent
+        :return: the number of entries sent and the number that are still waiting
+        """
+        # the outbox sender keeps the order
+        return self.components.sender.drain(limit)
+
+    @staticmethod
+    def get_catalog_id(member_id: str) -> str:
+        """
+        gets the catalog ID a catalog member ID belongs to
+
+        :param member_id:
+        :return:
+        """
+        # the catalog id is the member id less the last part
+        return '-'.join(member_id.split('-')[:-1])
+
     @staticmethod
     def get_unique_catalog_ids(catalog_data: dict) -> list:
         """
@@ -167,7 +590,7 @@ class PSCDataSync:
         :return:
         """
         # get the unique keys in the dict
-        ret_val: list = list(set('-'.join(x['member_def']['id'].split('-')[:-1]) for x in catalog_data['catalogs']))
+        ret_val: list = list(set(PSCDataSync.get_catalog_id(x['member_def']['id']) for x in catalog_data['catalogs']))
 
         # return to the caller
         return ret_val
@@ -182,10 +605,10 @@ class PSCDataSync:
         # make sure we have something to filter
         if catalog_data['past_runs'] is not None:
             # filter out non-PSC data from the past_runs
-            catalog_data['past_runs'] = list(filter(lambda item: (item['project_code'] in self.psc_sync_projects), catalog_data['past_runs']))
+            catalog_data['past_runs'] = [item for item in catalog_data['past_runs'] if item['project_code'] in self.psc_sync_projects]
 
         # add in the system this is coming from
-        catalog_data['system'] = self.system
+        catalog_data['system'] = self.shared.config['system']
 
         # return to the caller
         return catalog_data
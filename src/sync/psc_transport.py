@@ -0,0 +1,270 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    HTTP transport of the sync request bodies.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import time
+import itertools
+import threading
+
+from src.common.payload_utils import PayloadUtils
+
+
+class PSCTransport:
+    """
+    Class that posts the request bodies to a collaborator over a keep-alive HTTP session,
+    compressing them when enabled and large enough.
+
+    If the collaborator rejects the content encoding (HTTP 415) compression is turned off
+    for this instance and the body is resent uncompressed.
+    """
+
+    # guards the creation of the HTTP sessions
+    session_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, _sync, collaborator, _parent=None):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this posts for. its logger, metrics and target name are used
+        :param collaborator: the Collaborator to post to
+        :param _parent: a transport whose HTTP session is shared
+        """
+        # get the sync object
+        self.sync = _sync
+
+        # load the collaborator endpoint
+        self.url: str = collaborator.url
+        self.auth_header: dict = collaborator.auth_header
+
+        # load the HTTP connection settings. the timeouts are in seconds
+        self.config: dict = {'pool_size': int(os.getenv('PSC_SYNC_POOL_SIZE', '10')),
+                             'timeout': (float(os.getenv('PSC_SYNC_CONNECT_TIMEOUT', '5')), float(os.getenv('PSC_SYNC_READ_TIMEOUT', '10'))),
+                             'compression_min_bytes': int(os.getenv('PSC_SYNC_COMPRESSION_MIN_BYTES', '1024'))}
+
+        # load the request body compression setting. bodies smaller than the minimum are sent as is
+        self.compression: str = self.get_compression(os.getenv('PSC_SYNC_COMPRESSION', 'none'))
+
+        # the HTTP session is created on first use, so runs that are not for the collaborator never touch the network
+        self.lazy_session = None
+
+        # the collaborators of a run share the HTTP session
+        self.parent = _parent
+
+    @property
+    def http_session(self):
+        """
+        Gets the HTTP session, creating it on first use, so connections to the collaborators are reused across pushes
+
+        :return:
+        """
+        # the collaborators of a run share the HTTP session
+        if self.parent is not None:
+            return self.parent.http_session
+
+        with self.session_lock:
+            if self.lazy_session is None:
+                self.lazy_session = self.create_http_session()
+
+        # return to the caller
+        return self.lazy_session
+
+    def create_http_session(self):
+        """
+        Creates a keep-alive HTTP session with a bounded connection pool.
+
+        :return:
+        """
+        # the HTTP client is only loaded when it is needed
+        import requests  # pylint: disable=import-outside-toplevel
+        from requests.adapters import HTTPAdapter  # pylint: disable=import-outside-toplevel
+
+        # create the session
+        session = requests.Session()
+
+        # create an adapter that keeps up to the pool size of connections open per host
+        adapter = HTTPAdapter(pool_connections=self.config['pool_size'], pool_maxsize=self.config['pool_size'])
+
+        # use the pooled adapter for all requests
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        # ask the server to keep the connection open
+        session.headers.update({'Connection': 'keep-alive'})
+
+        # return to the caller
+        return session
+
+    def get_compression(self, compression: str):
+        """
+        validates the requested content encoding against what is available
+
+        :param compression:
+        :return: the content encoding to use or None for no compression
+        """
+        # normalize the setting
+        compression = compression.strip().lower()
+
+        # no compression requested
+        if compression in ('', 'none', 'identity'):
+            ret_val = None
+        # is the requested encoding available
+        elif compression in PayloadUtils.supported_encodings():
+            ret_val = compression
+        else:
+            self.sync.logger.warning('Warning: %s compression is not available, using gzip.', compression)
+
+            # fall back to the one that is always there
+            ret_val = 'gzip'
+
+        # return to the caller
+        return ret_val
+
+    def close(self):
+        """
+        Closes the HTTP session if one was made
+
+        :return:
+        """
+        if self.lazy_session is not None:
+            self.lazy_session.close()
+
+    def post_request(self, headers: dict, data):
+        """
+        Posts a request body, recording the latency and the HTTP status
+
+        :param headers:
+        :param data: the body bytes or a generator of bytes
+        :return: the HTTP response
+        """
+        # get the start time
+        start: float = time.perf_counter()
+
+        try:
+            # execute the post
+            ret_val = self.http_session.post(self.url, headers=headers, data=data, timeout=self.config['timeout'])
+        except Exception:
+            # record the failure
+            self.sync.metrics.observe('post_seconds', time.perf_counter() - start, status='error')
+            self.sync.metrics.inc('post_requests_total', status='error')
+            raise
+
+        # record the latency and status
+        self.sync.metrics.observe('post_seconds', time.perf_counter() - start, status=str(ret_val.status_code))
+        self.sync.metrics.inc('post_requests_total', status=str(ret_val.status_code))
+
+        # return to the caller
+        return ret_val
+
+    def post_body(self, body: bytes, run_id: str = 'N/A'):
+        """
+        Posts a JSON body, compressing it when enabled and large enough.
+
+        :param body:
+        :param run_id:
+        :return: the HTTP response
+        """
+        # copy the headers so the encoding does not leak into other requests
+        headers: dict = dict(self.auth_header)
+
+        # only compress bodies worth compressing
+        encoding = self.compression if len(body) >= self.config['compression_min_bytes'] else None
+
+        # compress the body if requested
+        if encoding is not None:
+            # compress the body
+            send_body: bytes = PayloadUtils.compress(body, encoding)
+
+            # tell the collaborator how it is encoded
+            headers['Content-Encoding'] = encoding
+        else:
+            send_body: bytes = body
+
+        self.sync.logger.info('%s sync payload for run id %s: %s bytes, %s bytes sent (encoding: %s).', self.sync.target, run_id, len(body),
+                              len(send_body), encoding or 'identity')
+
+        # record the sizes
+        self.sync.metrics.observe('request_bytes', len(body))
+        self.sync.metrics.inc('sent_bytes_total', len(send_body))
+
+        # execute the post
+        ret_val = self.post_request(headers, send_body)
+
+        # did the collaborator refuse the encoding
+        if encoding is not None and ret_val.status_code == 415:
+            self.sync.logger.warning('Warning: %s does not accept %s encoded requests, disabling compression.', self.sync.target, encoding)
+
+            # stop compressing
+            self.compression = None
+
+            # resend the body as is
+            self.sync.metrics.inc('post_retries_total', reason='encoding')
+            self.sync.metrics.inc('sent_bytes_total', len(body))
+
+            ret_val = self.post_request(self.auth_header, body)
+
+        # return to the caller
+        return ret_val
+
+    def post_stream(self, body, counts: dict):
+        """
+        Posts a streamed JSON body with chunked transfer encoding, compressing it when enabled.
+
+        :param body: a generator of bytes
+        :param counts: the byte counters to update. the encoding used is added
+        :return: the HTTP response
+        """
+        # copy the headers so the encoding does not leak into other requests
+        headers: dict = dict(self.auth_header)
+
+        # count the body bytes and send them in reasonably sized chunks
+        chunks = PayloadUtils.buffer_stream(self.count_bytes(body, counts, 'body_bytes'))
+
+        # compress the body if requested
+        if self.compression is not None:
+            # compress the chunks
+            chunks = PayloadUtils.compress_stream(chunks, self.compression)
+
+            # tell the collaborator how it is encoded
+            headers['Content-Encoding'] = counts['encoding'] = self.compression
+
+        # build the first chunk before connecting, so a run rejected in its first chunk sends nothing
+        chunks = itertools.chain([next(chunks, b'')], chunks)
+
+        # execute the post. a generator body is sent chunked
+        ret_val = self.post_request(headers, self.count_bytes(chunks, counts, 'sent_bytes'))
+
+        # record the sizes
+        self.sync.metrics.observe('request_bytes', counts['body_bytes'])
+        self.sync.metrics.inc('sent_bytes_total', counts['sent_bytes'])
+
+        # return to the caller
+        return ret_val
+
+    @staticmethod
+    def count_bytes(chunks, counts: dict, key: str):
+        """
+        Passes chunks through while adding up their size.
+
+        :param chunks:
+        :param counts:
+        :param key:
+        :return:
+        """
+        # for each chunk
+        for chunk in chunks:
+            # count it
+            counts[key] += len(chunk)
+
+            # pass it on
+            yield chunk
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Cheap look at a run before its catalogs are fetched.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+
+class RunProbe:
+    """
+    Class that gets the distinct project codes and the number of catalog members of a run
+    and decides from them whether the run is worth fetching for the collaborator.
+
+    Probing is turned off with PSC_SYNC_PROBE=false, in which case every run is fetched.
+    """
+
+    def __init__(self, _sync):
+        """
+        Initializes this class
+
+        :param _sync: the PSCDataSync this probes for. its DB connection, logger, metrics and projects are used
+        """
+        # get the sync object
+        self.sync = _sync
+
+    def get(self, run_id: str):
+        """
+        Gets the distinct project codes and the number of catalog members of a run with a cheap DB query
+
+        :param run_id:
+        :return: a dict with project_codes and member_count, or None if probing is off or failed
+        """
+        # is probing turned off
+        if not self.sync.shared.config['probe']:
+            return None
+
+        # make the DB request
+        ret_val = self.sync.query_db('catalog_member_probe', self.sync.db_info.get_catalog_member_probe, run_id=run_id)
+
+        # did it fail. the run is fetched without it
+        if not isinstance(ret_val, dict):
+            self.sync.logger.warning('Warning: Failed to probe the catalogs of run id %s, fetching them.', run_id)
+
+            ret_val = None
+
+        # return to the caller
+        return ret_val
+
+    def check(self, probe: dict, run_id: str) -> bool:
+        """
+        Checks that a probed run has catalog members and that they are all for this collaborator
+
+        :param probe: the probe results, None if the run was not probed
+        :param run_id:
+        :return: True if the run should be fetched
+        """
+        # fetch it if we know nothing about it
+        if probe is None:
+            return True
+
+        # get the project codes that are not for this collaborator. members without one are left to the fetch to reject
+        excluded: list = sorted(set(probe['project_codes']) - self.sync.psc_sync_projects - {None})
+
+        # are there catalogs to fetch
+        if not probe['member_count']:
+            self.sync.logger.warning('Warning: No records found in the database for run id %s.', run_id)
+
+            # count the skip
+            self.sync.metrics.inc('probe_skipped_total', reason='empty')
+        # are they all for this collaborator
+        elif excluded:
+            self.sync.logger.warning('Warning: One or more catalogs for run id %s were not for %s. %s', run_id, self.sync.target, excluded)
+
+            # count the skip
+            self.sync.metrics.inc('probe_skipped_total', reason='ineligible')
+        else:
+            return True
+
+        # nothing to fetch
+        return False
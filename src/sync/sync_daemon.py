@@ -0,0 +1,362 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Long-running daemon for the APSViz collaborator synchronizer.
+
+    Keeps a single CollabDataSync instance (and with it the DB connection and
+    HTTP session) alive and feeds it run_id/physical_location jobs from a
+    local queue. Jobs arrive either as lines on stdin or over a Unix socket.
+    The jobs waiting in the queue are run together, up to PSC_SYNC_RUN_WORKERS
+    at a time.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import sys
+import json
+import queue
+import signal
+import threading
+import socketserver
+
+from src.common.logger import LoggingUtil
+from src.sync.collab_sync import CollabDataSync
+from src.sync.sync_listener import SyncListener
+
+
+class SyncDaemon:
+    """
+    Class that runs collaborator sync jobs from a local job queue using warm resources.
+
+    """
+
+    def __init__(self, _logger=None, _psc_sync=None):
+        """
+        Initializes this class
+
+        :param _logger:
+        :param _psc_sync:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.PSCSync.Daemon", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # if a sync object was passed in use it, otherwise create the one and only instance
+        if _psc_sync is not None:
+            self.psc_sync = _psc_sync
+        else:
+            self.psc_sync = CollabDataSync(self.logger)
+
+        # create the job queue
+        self.job_queue: queue.Queue = queue.Queue()
+
+        # the flag that signals all threads to stop
+        self.shutdown_event: threading.Event = threading.Event()
+
+        # the job consumer thread and the optional socket server
+        self.worker: threading.Thread = None
+        self.socket_server = None
+
+    @staticmethod
+    def parse_job(line: str):
+        """
+        Parses a job line into a run_id/physical_location tuple.
+
+        Accepted formats are "<run_id> <physical_location>" or a JSON object
+        with run_id and physical_location keys.
+
+        :param line:
+        :return: a (run_id, physical_location) tuple or None if the line is not a job
+        """
+        # init the return
+        ret_val = None
+
+        # remove any surrounding whitespace
+        line = line.strip()
+
+        # skip empty lines and comments
+        if line and not line.startswith('#'):
+            # is this a JSON job
+            if line.startswith('{'):
+                try:
+                    # parse the job
+                    job: dict = json.loads(line)
+
+                    # get the job parameters
+                    ret_val = (job['run_id'], job['physical_location'])
+                except (ValueError, KeyError):
+                    ret_val = None
+            else:
+                # split the line into its parts
+                parts: list = line.split()
+
+                # we need exactly a run id and a physical location
+                if len(parts) == 2:
+                    ret_val = (parts[0], parts[1])
+
+        # return to the caller
+        return ret_val
+
+    def submit(self, line: str) -> bool:
+        """
+        Parses a job line and adds it to the job queue.
+
+        :param line:
+        :return: True if the line was a valid job
+        """
+        # parse the job
+        job = self.parse_job(line)
+
+        # was it a legit job
+        if job is not None:
+            # add it to the queue
+            self.job_queue.put(job)
+        elif line.strip():
+            self.logger.warning('Warning: Invalid sync job request: %s', line.strip())
+
+        # return to the caller
+        return job is not None
+
+    def get_jobs(self, max_jobs: int) -> list:
+        """
+        Gets the next jobs to run together: waits up to a second for one, then takes the others that are waiting.
+
+        :param max_jobs: the most jobs to take
+        :return: a list of (run_id, physical_location) tuples
+        """
+        # init the return
+        ret_val: list = []
+
+        try:
+            # wait for the next job
+            ret_val.append(self.job_queue.get(timeout=1))
+
+            # take the ones waiting behind it
+            while len(ret_val) < max_jobs:
+                ret_val.append(self.job_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        # return to the caller
+        return ret_val
+
+    def process_jobs(self):
+        """
+        Consumes jobs from the queue until shutdown is requested and the queue is drained.
+        The jobs that are waiting are run at the same time, up to PSC_SYNC_RUN_WORKERS of them.
+
+        :return:
+        """
+        # get the most jobs run at once
+        max_jobs: int = max(1, int(os.getenv('PSC_SYNC_RUN_WORKERS', '4')))
+
+        # until we are told to stop and there is nothing left to do
+        while not (self.shutdown_event.is_set() and self.job_queue.empty()):
+            # get the next jobs
+            jobs: list = self.get_jobs(max_jobs)
+
+            # was there anything to do
+            if not jobs:
+                continue
+
+            try:
+                # run the syncs using the warm sync object
+                self.psc_sync.run_many(jobs)
+            except Exception:
+                self.logger.exception('Exception: Sync job failure for run ids %s.', [job[0] for job in jobs])
+            finally:
+                # mark the jobs complete
+                for _ in jobs:
+                    self.job_queue.task_done()
+
+    def start(self):
+        """
+        Starts the job consumer thread
+
+        :return:
+        """
+        # create and start the worker
+        self.worker = threading.Thread(target=self.process_jobs, name='collab-sync-worker', daemon=True)
+        self.worker.start()
+
+        # resend the failed pushes in the background if there is an outbox
+        if getattr(self.psc_sync, 'outbox', None) is not None:
+            threading.Thread(target=self.drain_outbox, name='collab-sync-outbox', daemon=True).start()
+
+    def drain_outbox(self):
+        """
+        Sends the outbox entries that are due every PSC_SYNC_OUTBOX_DRAIN_SECONDS until shutdown.
+
+        :return:
+        """
+        # get the time between drains
+        interval: float = float(os.getenv('PSC_SYNC_OUTBOX_DRAIN_SECONDS', '30'))
+
+        # until we are told to stop
+        while not self.shutdown_event.wait(interval):
+            try:
+                # send what is due
+                self.psc_sync.drain_outbox()
+            except Exception:
+                self.logger.exception('Exception: Outbox drain failure.')
+
+    def stop(self, *_):
+        """
+        Signals shutdown and waits for the queued jobs to finish.
+
+        :return:
+        """
+        # signal everyone to stop
+        self.shutdown_event.set()
+
+        # stop accepting socket connections
+        if self.socket_server is not None:
+            # shutdown() blocks until serve_forever() exits, so run it out of band
+            threading.Thread(target=self.socket_server.shutdown, daemon=True).start()
+
+    def run_stdin(self, stream=None):
+        """
+        Reads jobs from stdin (one per line) until EOF.
+
+        :param stream:
+        :return:
+        """
+        # default to stdin
+        if stream is None:
+            stream = sys.stdin
+
+        # start the consumer
+        self.start()
+
+        self.logger.info('Collab sync daemon reading jobs from stdin.')
+
+        # read each job line
+        for line in stream:
+            # stop reading if we were told to
+            if self.shutdown_event.is_set():
+                break
+
+            # queue up the job
+            self.submit(line)
+
+        # wait for the remaining jobs to finish
+        self.stop()
+        self.worker.join()
+
+    def run_socket(self, socket_path: str):
+        """
+        Accepts jobs over a Unix socket (one per line) until shutdown.
+
+        :param socket_path:
+        :return:
+        """
+        # get a reference to this daemon for the request handler
+        daemon = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            """
+            Reads job lines from a socket client and acknowledges each one.
+            """
+            def handle(self):
+                # for each line the client sends
+                for raw_line in self.rfile:
+                    # queue it up
+                    queued: bool = daemon.submit(raw_line.decode('utf-8', errors='replace'))
+
+                    # let the client know how it went
+                    self.wfile.write(b'QUEUED\n' if queued else b'INVALID\n')
+
+        # remove a stale socket file
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        # start the consumer
+        self.start()
+
+        # create the server
+        self.socket_server = socketserver.ThreadingUnixStreamServer(socket_path, JobHandler)
+
+        self.logger.info('Collab sync daemon listening for jobs on %s.', socket_path)
+
+        try:
+            # handle requests until shutdown
+            self.socket_server.serve_forever()
+        finally:
+            # clean up the server
+            self.socket_server.server_close()
+
+            # remove the socket file
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+            # wait for the remaining jobs to finish
+            self.shutdown_event.set()
+            self.worker.join()
+
+    def run_listener(self):
+        """
+        Takes jobs from Postgres notifications of catalog member inserts until shutdown.
+
+        :return:
+        """
+        # create the listener
+        listener: SyncListener = SyncListener(self.logger, self)
+
+        # the notifications are bare run ids, so there is nothing to queue without the run properties
+        if not listener.run_props.is_configured():
+            self.logger.error('Error: The run properties DB (COLLAB_SYNC_RUN_PROPS_DB=%s) connection settings are not set, not listening.',
+                              listener.run_props.db_name)
+            return
+
+        # start the consumer
+        self.start()
+
+        # queue up the notified runs until we are told to stop
+        listener.run()
+
+        # wait for the remaining jobs to finish
+        self.stop()
+        self.worker.join()
+
+    def run(self, socket_path: str = None, listen: bool = False):
+        """
+        Runs the daemon using Postgres notifications if listening, a Unix socket if a path was specified, otherwise stdin.
+
+        :param socket_path:
+        :param listen:
+        :return:
+        """
+        # stop cleanly on termination
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        # serve the sync metrics if a port was specified
+        if os.getenv('PSC_SYNC_METRICS_PORT'):
+            self.psc_sync.metrics.start_http_server(int(os.getenv('PSC_SYNC_METRICS_PORT')), os.getenv('PSC_SYNC_METRICS_ADDRESS', '0.0.0.0'))
+
+        # pick the job source
+        if listen:
+            self.run_listener()
+        elif socket_path is not None:
+            self.run_socket(socket_path)
+        else:
+            self.run_stdin()
+
+        # release the pooled HTTP connections and stop serving the metrics
+        self.psc_sync.close()
+
+        self.logger.info('Collab sync daemon stopped.')
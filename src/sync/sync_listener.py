@@ -0,0 +1,389 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Event-driven sync jobs from Postgres LISTEN/NOTIFY.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import time
+import datetime
+from contextlib import nullcontext
+
+from src.common.logger import LoggingUtil
+
+
+class RunDebouncer:
+    """
+    Class that holds the notified runs until their notifications have stopped for the debounce
+    time, or for the max debounce time in all, so a steady stream of inserts does not hold a run forever.
+    """
+
+    def __init__(self):
+        """
+        Initializes this class
+        """
+        # load the settings. the times are in seconds
+        self.config: dict = {'debounce': float(os.getenv('COLLAB_SYNC_DEBOUNCE_SECONDS', '10')),
+                             'debounce_max': float(os.getenv('COLLAB_SYNC_DEBOUNCE_MAX_SECONDS', '60')),
+                             'heartbeat': float(os.getenv('COLLAB_SYNC_LISTEN_HEARTBEAT_SECONDS', '5'))}
+
+        # the runs waiting to be queued: run id: [physical location, when it is due, when it is due at the latest]
+        self.pending: dict = {}
+
+    def add(self, run_id: str, physical_location: str):
+        """
+        Adds a run, or pushes back when it is due if it is already waiting
+
+        :param run_id:
+        :param physical_location:
+        :return:
+        """
+        # get the time
+        now: float = time.monotonic()
+
+        # a run keeps its latest due time
+        entry: list = self.pending.setdefault(run_id, [physical_location, now, now + self.config['debounce_max']])
+
+        # wait for the notifications to stop
+        entry[0] = physical_location
+        entry[1] = min(now + self.config['debounce'], entry[2])
+
+    def pop_due(self, flush: bool = False) -> list:
+        """
+        Removes the runs that are due
+
+        :param flush: remove all of them
+        :return: a list of (run id, physical location) tuples
+        """
+        # get the runs that are due
+        now: float = time.monotonic()
+        due: list = [run_id for run_id, entry in self.pending.items() if flush or entry[1] <= now]
+
+        # return to the caller
+        return [(run_id, self.pending.pop(run_id)[0]) for run_id in due]
+
+    def get_wait(self) -> float:
+        """
+        Gets how long to wait for notifications: until the next run is due or the next heartbeat
+
+        :return:
+        """
+        return max(0.0, min([self.config['heartbeat']] + [entry[1] - time.monotonic() for entry in self.pending.values()]))
+
+
+class ChannelWatermark:
+    """
+    Class that keeps the DB time up to which every notification on a channel was received, in
+    the member state store if there is one, so the runs missed while the listener was not
+    connected can be caught up on.
+    """
+
+    def __init__(self, state_store, channel: str):
+        """
+        Initializes this class
+
+        :param state_store: the member state store to keep the watermark in, None if there is not one
+        :param channel:
+        """
+        # get the member state store and the channel
+        self.state_store = state_store
+        self.channel: str = channel
+
+        # get the margin that covers the transactions that were still open, in seconds
+        self.catchup_margin: float = float(os.getenv('COLLAB_SYNC_CATCHUP_MARGIN_SECONDS', '60'))
+
+        # get the saved value, None if it was never known
+        value: str = self.state_store.get_mark(f'listen_watermark:{self.channel}') if self.state_store is not None else None
+
+        self.value: datetime.datetime = datetime.datetime.fromisoformat(value) if value else None
+
+    def save(self, value: datetime.datetime):
+        """
+        Sets the time up to which every notification was received, saving it if there is a state store
+
+        :param value:
+        :return:
+        """
+        # save it if it moved
+        if value != self.value and self.state_store is not None:
+            self.state_store.set_mark(f'listen_watermark:{self.channel}', value.isoformat())
+
+        self.value = value
+
+    def get_catchup_start(self):
+        """
+        Gets the start of the window of runs to catch up on, a margin before the watermark
+
+        :return: the DB time or None if nothing was ever received
+        """
+        return (self.value - datetime.timedelta(seconds=self.catchup_margin)).isoformat(sep=' ') if self.value is not None else None
+
+
+class RunProperties:
+    """
+    Class that looks up the physical location of a run in the ASGS run properties, connecting on first use.
+    """
+
+    def __init__(self, _logger):
+        """
+        Initializes this class
+
+        :param _logger:
+        """
+        # get the logger
+        self.logger = _logger
+
+        # the DB with the run properties and its connection object
+        self.db_name: str = os.getenv('COLLAB_SYNC_RUN_PROPS_DB', 'asgs')
+        self.db = None
+
+    def is_configured(self) -> bool:
+        """
+        Checks that the connection settings of the run properties DB are in the environment
+
+        :return:
+        """
+        # get the env parameter prefix of the DB
+        prefix: str = self.db_name.upper().replace('-', '_')
+
+        # a connection that was passed in needs no settings
+        return self.db is not None or all(os.getenv(f'{prefix}_DB_{name}') for name in ('USERNAME', 'PASSWORD', 'DATABASE', 'HOST', 'PORT'))
+
+    def get_physical_location(self, run_id: str):
+        """
+        Gets the physical location of a run from the run properties
+
+        :param run_id:
+        :return: the physical location or None if it is not known
+        """
+        try:
+            # connect on first use
+            if self.db is None:
+                # the DB driver is only loaded when it is needed
+                from src.common.pg_impl import PGImplementation  # pylint: disable=import-outside-toplevel
+
+                self.db = PGImplementation((self.db_name,), self.logger)
+
+            # get the location
+            return self.db.get_run_physical_location(run_id, self.db_name)
+        except Exception:
+            self.logger.exception('Exception: Failed to get the physical location of run id %s.', run_id)
+
+            return None
+
+    def close(self):
+        """
+        Closes the connection if one was made
+
+        :return:
+        """
+        if self.db is not None:
+            self.db.close_conn(self.db_name)
+
+
+class SyncListener:
+    """
+    Class that LISTENs on a Postgres channel for catalog member inserts and queues a sync job
+    on the daemon for each run, once its notifications have stopped for the debounce time.
+
+    A notification payload is a job in the daemon format ("<run_id> <physical_location>" or
+    JSON) or just a run id, whose physical location is looked up in the ASGS run properties.
+    A run whose physical location is not known is not queued. On startup and after a lost
+    connection is back the runs that got catalog members since the last notification received
+    are queued too. When there is a member state store that time is kept there across restarts.
+
+    The notifications are sent by the trigger in migrations/003_catalog_member_notify.sql.
+    """
+
+    def __init__(self, _logger, _daemon, _db_info=None):
+        """
+        Initializes this class
+
+        :param _logger:
+        :param _daemon: the SyncDaemon that runs the jobs
+        :param _db_info: a DB object of its own to listen with, defaults to the shared one of the daemon's sync object
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.PSCSync.Listener", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # get the daemon
+        self.daemon = _daemon
+
+        # get the DB object and the lock to take to use it, which is only needed if it is shared
+        if _db_info is not None:
+            self.db_info, self.db_lock = _db_info, nullcontext()
+        else:
+            self.db_info, self.db_lock = self.daemon.psc_sync.db_info, self.daemon.psc_sync.db_lock
+
+        # the run properties with the physical locations
+        self.run_props: RunProperties = RunProperties(self.logger)
+
+        # the runs waiting for their notifications to stop
+        self.debouncer: RunDebouncer = RunDebouncer()
+
+        # the DB time up to which every notification on the channel was received, kept in the member state store if there is one
+        self.watermark: ChannelWatermark = ChannelWatermark(getattr(self.daemon.psc_sync, 'state_store', None),
+                                                            os.getenv('COLLAB_SYNC_LISTEN_CHANNEL', 'catalog_member_inserted'))
+
+    def add_notification(self, payload: str):
+        """
+        Adds the run of a notification, or pushes back when it is due if it is already waiting
+
+        :param payload:
+        :return:
+        """
+        # parse the job
+        job = self.daemon.parse_job(payload)
+
+        # was it a legit job
+        if job is not None:
+            self.add_run(*job)
+        # is it a bare run id
+        elif len(payload.split()) == 1:
+            self.add_run_id(payload.strip())
+        else:
+            self.logger.warning('Warning: Invalid sync notification: %s', payload)
+
+    def add_run_id(self, run_id: str):
+        """
+        Adds a run with the physical location from its run properties. It is not added if the location is not known.
+
+        :param run_id:
+        :return:
+        """
+        # get the physical location
+        physical_location: str = self.run_props.get_physical_location(run_id)
+
+        # was it found
+        if physical_location is None:
+            self.logger.warning('Warning: The physical location of run id %s is not known, it is not queued.', run_id)
+        else:
+            self.add_run(run_id, physical_location)
+
+    def add_run(self, run_id: str, physical_location: str):
+        """
+        Adds a run, or pushes back when it is due if it is already waiting. The cached catalogs of the run are dropped.
+
+        :param run_id:
+        :param physical_location:
+        :return:
+        """
+        # the cached catalogs of the run are out of date
+        self.db_info.invalidate_run(run_id)
+
+        # wait for the notifications to stop
+        self.debouncer.add(run_id, physical_location)
+
+    def queue_due_runs(self, flush: bool = False) -> int:
+        """
+        Queues the runs that are due on the daemon
+
+        :param flush: queue all of them
+        :return: the number of runs queued
+        """
+        # get the runs that are due
+        due: list = self.debouncer.pop_due(flush)
+
+        # queue them
+        for job in due:
+            self.daemon.job_queue.put(job)
+
+            self.logger.debug('Queued a sync job for run id %s.', job[0])
+
+        # return to the caller
+        return len(due)
+
+    def catch_up(self):
+        """
+        Adds the runs that got catalog members since the last time every notification is known to have been received
+
+        :return:
+        """
+        # get the start of the window. the margin covers transactions that were still open
+        start_date: str = self.watermark.get_catchup_start()
+
+        # nothing to catch up on if we never received anything
+        if start_date is None:
+            return
+
+        # get the runs. the DB connection may be shared
+        with self.db_lock:
+            run_ids = self.db_info.get_catalog_run_ids(start_date=start_date)
+
+        # did the lookup fail
+        if not isinstance(run_ids, list):
+            self.logger.error('Error: Failed to get the runs to catch up on since %s.', start_date)
+        else:
+            self.logger.info('Catching up on %s runs since %s.', len(run_ids), start_date)
+
+            # add them
+            for run_id in run_ids:
+                self.add_run_id(run_id)
+
+    def run(self):
+        """
+        Listens for notifications and queues the sync jobs until the daemon is stopped
+
+        :return:
+        """
+        # init the listening connection
+        conn = None
+
+        # until we are told to stop
+        while not self.daemon.shutdown_event.is_set():
+            try:
+                # connect and listen if needed, then pick up anything missed while the connection was down
+                if conn is None:
+                    conn = self.db_info.listen('apsviz', (self.watermark.channel,))
+
+                    self.catch_up()
+
+                    self.logger.info('Listening for sync notifications on %s.', self.watermark.channel)
+
+                # add the runs of the notifications
+                for _, payload in self.db_info.get_notifications(conn, self.debouncer.get_wait()):
+                    self.add_notification(payload)
+
+                # everything up to now was received. this also checks the connection
+                self.watermark.save(self.db_info.get_db_time(conn))
+            except Exception:
+                self.logger.exception('Exception: Sync notification connection failure, reconnecting.')
+
+                # keep what was received before the failure
+                if conn is not None:
+                    for notify in conn.notifies:
+                        self.add_notification(notify.payload)
+
+                    conn.close()
+                    conn = None
+
+                # wait a bit before reconnecting
+                self.daemon.shutdown_event.wait(1)
+
+            # queue the runs that are due
+            self.queue_due_runs()
+
+        # close the connections
+        if conn is not None:
+            conn.close()
+
+        self.run_props.close()
+
+        # queue what is left so it runs before the daemon stops
+        self.queue_due_runs(flush=True)
@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Resources shared by the sync objects of the collaborators of a run.
+
+    Author: Phil Owen, RENCI.org
+"""
+
+import os
+import threading
+
+from src.common.logger import LoggingUtil
+from src.common.sync_state import SyncStateStore
+from src.common.sync_outbox import SyncOutbox
+from src.common.metrics import SyncMetrics
+from src.common.profiler import SyncProfiler
+
+
+class SyncResources:
+    """
+    Class that holds the run settings, DB connection, member state, outbox, metrics and
+    profiler that the sync objects of the collaborators share.
+
+    The DB connection is created on first use, so runs that are not for a collaborator
+    never touch the network.
+    """
+
+    def __init__(self, _logger, _db_info=None):
+        """
+        Initializes this class
+
+        :param _logger: the logger of the sync object that creates the resources
+        :param _db_info: a DB object to use instead of connecting to the apsviz DB
+        """
+        # load the run settings
+        self.config: dict = {
+            # the system we are running on
+            'system': os.getenv('SYSTEM', "Not set"),
+            # the number of runs synced at the same time by CollabDataSync.run_many() and backfill()
+            'run_workers': int(os.getenv('PSC_SYNC_RUN_WORKERS', '4')),
+            # the number of runs fetched per DB call in a backfill
+            'backfill_chunk_size': int(os.getenv('PSC_SYNC_BACKFILL_CHUNK_SIZE', '50')),
+            # probe the project codes and member count of a run before fetching it
+            'probe': os.getenv('PSC_SYNC_PROBE', 'true').lower() in ('true', '1', 'yes'),
+            # the textfile collector file the metrics are written to on close
+            'metrics_textfile': os.getenv('PSC_SYNC_METRICS_TEXTFILE')}
+
+        # the resources created on first use. see get_lazy()
+        self.lazy: dict = {'db_info': _db_info, 'db_lock': None}
+
+        # guards the creation of the lazy resources. creating the DB lock needs the DB connection
+        self.init_lock: threading.RLock = threading.RLock()
+
+        # create the member state store if delta syncs are enabled
+        state_db_path: str = os.getenv('PSC_SYNC_STATE_DB')
+        self.state_store = SyncStateStore(state_db_path, _logger) if state_db_path else None
+
+        # create the outbox of failed pushes if enabled
+        outbox_db_path: str = os.getenv('PSC_SYNC_OUTBOX_DB')
+        self.outbox = SyncOutbox(outbox_db_path, _logger, float(os.getenv('PSC_SYNC_OUTBOX_BASE_DELAY', '30')),
+                                 float(os.getenv('PSC_SYNC_OUTBOX_MAX_DELAY', '3600'))) if outbox_db_path else None
+
+        # create the sync metrics. the collaborators get views of them
+        self.metrics: SyncMetrics = SyncMetrics('psc_sync', _logger)
+
+        # bring the DB connection counters up to date on each scrape. nothing is done before the DB is connected
+        self.metrics.add_collector(lambda: self.metrics.collect_db_stats(self.lazy['db_info']))
+
+        # create the run profiler if profiling is turned on. the results go in the log directory
+        profile_modes: list = SyncProfiler.get_modes(os.getenv('PSC_SYNC_PROFILE'))
+        self.profiler = SyncProfiler(profile_modes, LoggingUtil.prep_for_logging()[1], _logger) if profile_modes else None
+
+    def get_lazy(self, name: str, create):
+        """
+        Gets a resource that is created on first use
+
+        :param name: the resource name
+        :param create: a function that creates the resource
+        :return:
+        """
+        with self.init_lock:
+            # is this the first use
+            if self.lazy[name] is None:
+                self.lazy[name] = create()
+
+        # return to the caller
+        return self.lazy[name]
+
+    def close(self):
+        """
+        Writes out the metrics and closes the outbox
+
+        :return:
+        """
+        # save the metrics for the textfile collector
+        if self.config['metrics_textfile']:
+            self.metrics.write_textfile(self.config['metrics_textfile'])
+
+        # stop serving the metrics
+        self.metrics.close()
+
+        # close the outbox
+        if self.outbox is not None:
+            self.outbox.close()
@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the offline benchmarks at a small scale
+
+    Author: Phil Owen, RENCI.org
+"""
+import json
+
+from src.benchmark.catalog_generator import CatalogGenerator
+from src.benchmark.psc_sync_benchmark import run_benchmarks
+
+
+def test_catalog_generator():
+    """
+    method to test that the synthetic catalogs are the size asked for and repeatable
+
+    :return:
+    """
+    # create the catalog data
+    catalog_data: dict = CatalogGenerator(('psc_test',)).generate(100)
+
+    # check the counts
+    assert len(catalog_data['catalogs']) == 100 and len(catalog_data['past_runs']) == 20
+
+    # the members are grouped into run catalogs
+    assert len({'-'.join(item['member_def']['id'].split('-')[:-1]) for item in catalog_data['catalogs']}) == 13
+
+    # the same seed gets the same data
+    assert CatalogGenerator(('psc_test',)).generate(100) == catalog_data
+
+
+def test_run_benchmarks(monkeypatch):
+    """
+    method to test a small benchmark run against the local stand-ins
+
+    :return:
+    """
+    # the benchmark sets the projects, let them be restored
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+
+    # run the benchmarks
+    results: dict = run_benchmarks([10, 100], repeat=1)
+
+    # every benchmark ran for every size
+    assert len(results['results']) == 10 and results['psc_stand_in']['requests'] > 0
+
+    # a run that no collaborator gets does not load the DB driver, the HTTP client or the Slack SDK
+    assert results['startup']['heavy_modules'] == [] and results['startup']['seconds_min'] > 0
+
+    # the results can be saved as JSON
+    assert json.loads(json.dumps(results)) == results
+    assert all(item['seconds_min'] >= 0 and item['peak_bytes'] > 0 for item in results['results'])
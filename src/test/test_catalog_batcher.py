@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test sending the catalog data to PSC in batches
+
+    Author: Phil Owen, RENCI.org
+"""
+import os
+import logging
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.common.payload_utils import PayloadUtils
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_catalog_batches(monkeypatch):
+    """
+    method to test that the batches keep whole catalogs under the limits and split the oversize ones
+
+    :return:
+    """
+    # set the PSC projects and the batch limit
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_BATCH_MAX_MEMBERS', '10')
+
+    # 3 catalogs of 8 members
+    catalog_data: dict = CatalogGenerator(('psc_test',)).generate(24)
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(catalog_data))
+
+    # two catalogs do not fit in one batch
+    batches: list = psc_sync.components.batcher.get_catalog_batches(catalog_data)
+
+    assert [len(payload['catalogs']) for _, payload in batches] == [8, 8, 8]
+    assert [len(catalog_ids) for catalog_ids, _ in batches] == [1, 1, 1]
+
+    # the past runs only go out with the first batch
+    assert batches[0][1]['past_runs'] == catalog_data['past_runs'] and batches[1][1]['past_runs'] is None
+
+    # a catalog over the limit by itself is split across batches
+    psc_sync.components.batcher.max_members = 5
+    batches = psc_sync.components.batcher.get_catalog_batches(catalog_data)
+
+    assert [len(payload['catalogs']) for _, payload in batches] == [5, 3, 5, 3, 5, 3]
+    assert [catalog_ids for catalog_ids, _ in batches][:2] == [[psc_sync.get_catalog_id(catalog_data['catalogs'][0]['member_def']['id'])]] * 2
+
+    # the byte limit keeps each batch under it unless a single member is over it
+    psc_sync.components.batcher.max_members = 0
+    psc_sync.components.batcher.max_bytes = 3 * len(PayloadUtils.encode_json(catalog_data['catalogs'][0]))
+
+    assert all(1 <= len(payload['catalogs']) <= 3 for _, payload in psc_sync.components.batcher.get_catalog_batches(catalog_data))
+
+    psc_sync.close()
+
+
+def test_push_batches(tmp_path, monkeypatch):
+    """
+    method to test that only the failed batches are retried and the state only advances for the catalogs that made it
+
+    :return:
+    """
+    # set the PSC projects, the state store and one batch per catalog sent in order
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_STATE_DB', str(os.path.join(tmp_path, 'state.db')))
+    monkeypatch.setenv('PSC_SYNC_BATCH_MAX_MEMBERS', '10')
+    monkeypatch.setenv('PSC_SYNC_BATCH_WORKERS', '1')
+    monkeypatch.setenv('PSC_SYNC_BATCH_RETRIES', '1')
+
+    # do not wait to retry
+    monkeypatch.setattr('src.sync.catalog_batcher.time.sleep', lambda _: None)
+
+    # 3 catalogs of 8 members
+    catalog_data: dict = CatalogGenerator(('psc_test',)).generate(24)
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(catalog_data))
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+        psc.server.keep_bodies = True
+
+        # the second batch fails once and only it is resent
+        psc.server.statuses = [200, 500, 200]
+
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 4 and [len(body['catalogs']) for body in psc.server.bodies] == [8, 8, 8]
+        assert psc.server.bodies[2]['catalogs'] == catalog_data['catalogs'][8:16]
+
+        # start over without retries, the second catalog fails
+        psc_sync.shared.state_store.update(psc_sync.target, [], [item['member_def']['id'] for item in catalog_data['catalogs']])
+        psc_sync.components.batcher.retries = 0
+        psc.server.statuses = [200, 500, 200]
+
+        assert not psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 7
+
+        # only the catalog that failed is sent on the next run
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 8 and psc.server.bodies[-1]['catalogs'] == catalog_data['catalogs'][8:16]
+
+    psc_sync.close()
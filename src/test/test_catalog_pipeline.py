@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the catalog processing pipeline
+
+    Author: Phil Owen, RENCI.org
+"""
+import pytest
+
+from src.sync.catalog_pipeline import CatalogPipeline
+
+
+def test_pipeline():
+    """
+    method to test the pipeline stages in a single pass
+
+    :return:
+    """
+    # create a pipeline like the one PSC uses
+    projects: set = {'psc_test'}
+    pipeline = CatalogPipeline()
+    pipeline.register_stage('validate', 'project_codes', lambda record: record['project_code'] in projects)
+    pipeline.register_stage('filter', 'past_run_projects', lambda record: record['project_code'] in projects, 'past_runs')
+    pipeline.register_stage('group', 'catalog_ids', lambda record: '-'.join(record['member_def']['id'].split('-')[:-1]))
+
+    # unknown stage kinds are an error
+    with pytest.raises(ValueError):
+        pipeline.register_stage('sort', 'bad', sorted)
+
+    # create some catalog data
+    catalog_data: dict = {'catalogs': [{'project_code': 'psc_test', 'member_def': {'id': f'4409-{x % 2}-swan-{x}'}} for x in range(4)],
+                          'past_runs': [{'project_code': 'psc_test'}, {'project_code': 'nopp'}]}
+
+    # process it
+    result = pipeline.process(catalog_data)
+
+    # the past runs were filtered and the members grouped by catalog
+    assert result.valid and len(result.catalog_data['past_runs']) == 1
+    assert sorted(result.groups['catalog_ids']) == ['4409-0-swan', '4409-1-swan'] and len(result.groups['catalog_ids']['4409-0-swan']) == 2
+    assert set(result.timings) == {'project_codes', 'past_run_projects', 'catalog_ids'}
+
+    # a catalog for another project rejects the document
+    catalog_data['catalogs'].append({'project_code': 'nopp', 'member_def': {'id': '4410-0-swan-1'}})
+    assert not pipeline.process(catalog_data).valid
+
+    # empty sections are skipped
+    assert pipeline.process({'catalogs': None, 'past_runs': None}).valid
@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test streaming the catalog data from the DB cursor to PSC
+
+    Author: Phil Owen, RENCI.org
+"""
+import logging
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_stream_body(monkeypatch):
+    """
+    method to test that a streamed run sends the same document as a buffered one, compressed or not
+
+    :return:
+    """
+    # set the PSC projects
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+
+    # the past runs are for PSC and other projects
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(CatalogGenerator(('psc_test',)).generate(50)))
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+        psc.server.keep_bodies = True
+
+        # send the run buffered and then streamed, plain and compressed
+        for streaming, compression in ((False, None), (True, None), (True, 'gzip')):
+            psc_sync.components.streamer.enabled = streaming
+            psc_sync.components.transport.compression = compression
+
+            assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+
+        # the streamed documents are the buffered one
+        assert psc.server.stats['requests'] == 3 and psc.server.bodies[1] == psc.server.bodies[0] and psc.server.bodies[2] == psc.server.bodies[0]
+        assert len(psc.server.bodies[0]['catalogs']) == 50 and all(item['project_code'] == 'psc_test' for item in psc.server.bodies[0]['past_runs'])
+
+    psc_sync.close()
+
+
+def test_stream_rejected(monkeypatch):
+    """
+    method to test that a streamed run with a catalog member not for PSC is not sent
+
+    :return:
+    """
+    # set the PSC projects and stream every run
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_STREAMING', 'true')
+    monkeypatch.setenv('PSC_SYNC_PROBE', 'false')
+
+    # the second run catalog is not for PSC
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(CatalogGenerator(('psc_test', 'nopp')).generate(16)))
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+
+        # the run is not a failure but nothing gets to PSC
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 0
+
+    psc_sync.close()
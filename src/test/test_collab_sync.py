@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the multi-collaborator sync
+
+    Author: Phil Owen, RENCI.org
+"""
+import json
+import logging
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.common.pg_pool import PGConnectionError
+from src.sync.collaborators import CollaboratorRegistry
+from src.sync.collab_sync import CollabDataSync
+
+
+def test_collab_sync(tmp_path, monkeypatch):
+    """
+    method to test that one catalog fetch is pushed to every matching collaborator
+
+    :return:
+    """
+    # create the DB stand-in with past runs for both collaborators
+    db_info = FakePGImplementation(CatalogGenerator(('psc_test',), ('nopp',)).generate(40, past_run_ratio=1))
+
+    with PSCStandIn() as psc, PSCStandIn() as nopp:
+        # create the collaborator config
+        config_path = tmp_path / 'collaborators.json'
+        config_path.write_text(json.dumps([{'name': 'PSC', 'url': psc.url, 'token': 'psc', 'projects': ['psc_test'],
+                                            'physical_locations': ['PSC', 'TWI']},
+                                           {'name': 'NOPP', 'url': nopp.url, 'token_env': 'NOPP_SYNC_TOKEN', 'projects': ['psc_test', 'nopp'],
+                                            'physical_locations': ['PSC']}]), encoding='utf-8')
+
+        monkeypatch.setenv('COLLAB_SYNC_CONFIG', str(config_path))
+        monkeypatch.setenv('NOPP_SYNC_TOKEN', 'nopp')
+
+        # create the sync object
+        collab_sync = CollabDataSync(logging.getLogger(__name__), db_info)
+
+        assert collab_sync.targets['NOPP'].components.transport.auth_header['Authorization'] == 'Bearer nopp'
+
+        # a run for both is fetched once and sent to each
+        assert collab_sync.run('4441-2023072106-gfsforecast', 'PSC') == {'PSC': True, 'NOPP': True}
+        assert db_info.calls == 1 and psc.server.stats['requests'] == 1 and nopp.server.stats['requests'] == 1
+
+        # each got its own view, NOPP gets the nopp past runs too
+        assert nopp.server.stats['bytes'] > psc.server.stats['bytes']
+
+        # a run for one goes to that one, a run for none goes nowhere
+        assert collab_sync.run('4441-2023072106-gfsforecast', 'TWI') == {'PSC': True}
+        assert not collab_sync.run('4441-2023072106-gfsforecast', 'RENCI')
+        assert psc.server.stats['requests'] == 2 and nopp.server.stats['requests'] == 1
+
+        collab_sync.close()
+
+    # the metrics are by collaborator, the shared fetch is not
+    text: str = collab_sync.metrics.render()
+
+    assert 'psc_sync_runs_total{result="success",target="NOPP"} 1\n' in text and 'psc_sync_runs_total{result="success",target="PSC"} 2\n' in text
+    assert 'psc_sync_db_query_seconds_count{query="catalog_member_records"} 2\n' in text
+
+
+def test_registry_default(monkeypatch):
+    """
+    method to test that PSC is the only collaborator without a config
+
+    :return:
+    """
+    # set the PSC settings
+    monkeypatch.delenv('COLLAB_SYNC_CONFIG', raising=False)
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test,psc_prod')
+
+    # load the registry
+    registry = CollaboratorRegistry()
+
+    assert [(item.name, item.projects) for item in registry.get_matching('TWI')] == [('PSC', frozenset(('psc_test', 'psc_prod')))]
+    assert not registry.get_matching('RENCI')
+
+
+def test_probe(monkeypatch):
+    """
+    method to test that the probe skips the fetch of a run that is not for the collaborator and picks the push path
+
+    :return:
+    """
+    # set the PSC projects and stream the big runs
+    monkeypatch.delenv('COLLAB_SYNC_CONFIG', raising=False)
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_STREAM_MIN_MEMBERS', '100')
+
+    # create the sync object with catalogs for another project
+    db_info = FakePGImplementation(CatalogGenerator(('nopp',)).generate(20))
+    collab_sync = CollabDataSync(logging.getLogger(__name__), db_info)
+
+    # the run is skipped without fetching the catalogs
+    assert collab_sync.run('4441-2023072106-gfsforecast', 'PSC') == {'PSC': True}
+    assert db_info.probe_calls == 1 and db_info.calls == 0
+    assert 'psc_sync_probe_skipped_total{reason="ineligible"} 1\n' in collab_sync.metrics.render()
+
+    # the member count picks the push path
+    assert collab_sync.primary.get_sync_path({'project_codes': ['psc_test'], 'member_count': 99}) == 'fetch'
+    assert collab_sync.primary.get_sync_path({'project_codes': ['psc_test'], 'member_count': 100}) == 'stream'
+
+    # a member without a project code does not break the probe, the fetch rejects it
+    assert collab_sync.primary.components.probe.check({'project_codes': [None, 'psc_test'], 'member_count': 2}, '4441-2023072106-gfsforecast')
+    assert not collab_sync.primary.components.probe.check({'project_codes': [None, 'nopp'], 'member_count': 2}, '4441-2023072106-gfsforecast')
+
+    collab_sync.close()
+
+
+def test_backfill_db_unavailable(monkeypatch):
+    """
+    method to test that a backfill chunk is failed, not raised, when the DB is unavailable
+
+    :return:
+    """
+    # set the PSC projects
+    monkeypatch.delenv('COLLAB_SYNC_CONFIG', raising=False)
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+
+    # create a DB stand-in that cannot reach the DB for the catalogs
+    db_info = FakePGImplementation(CatalogGenerator(('psc_test',)).generate(4))
+
+    def get_bulk(**_):
+        raise PGConnectionError('apsviz is down')
+
+    db_info.get_catalog_member_records_bulk = get_bulk
+
+    collab_sync = CollabDataSync(logging.getLogger(__name__), db_info)
+
+    # the runs are failed and counted
+    assert collab_sync.backfill(['4441-2023072106-a', '4441-2023072106-b']) == {'PSC': {'4441-2023072106-a': False, '4441-2023072106-b': False}}
+    assert 'psc_sync_db_errors_total{query="catalog_member_records_bulk"} 1\n' in collab_sync.metrics.render()
+
+    collab_sync.close()
@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the logging utilities
+
+    Author: Phil Owen, RENCI.org
+"""
+import json
+import logging
+
+from src.common.logger import LoggingUtil
+
+
+def test_queued_json_logging(tmp_path, monkeypatch):
+    """
+    method to test queued JSON line logging with the run id and rate limiting
+
+    :return:
+    """
+    # turn on the queue, JSON lines and rate limiting
+    monkeypatch.setenv('LOG_QUEUE', 'true')
+    monkeypatch.setenv('LOG_FORMAT', 'json')
+    monkeypatch.setenv('LOG_RATE_LIMIT_COUNT', '2')
+
+    # create the logger
+    logger = LoggingUtil.init_logging('APSVIZ.Test.QueuedJson', level=logging.INFO, line_format='medium', log_file_path=str(tmp_path))
+
+    # the same logger is returned on the next call
+    assert LoggingUtil.init_logging('APSVIZ.Test.QueuedJson', log_file_path=str(tmp_path)) is logger and len(logger.handlers) == 1
+
+    # log a message for a run
+    token = LoggingUtil.set_run_id('4441-2023072106-gfsforecast')
+    logger.info('Synced %s catalogs.', 3)
+    LoggingUtil.reset_run_id(token)
+
+    # repeat a message past the limit
+    for attempt in range(5):
+        logger.warning('Retrying the DB connection, attempt %s.', attempt)
+
+    # write out what is queued
+    LoggingUtil.stop_listeners()
+
+    # get the log lines
+    lines: list = [json.loads(line) for line in (tmp_path / 'APSVIZ.Test.QueuedJson.log').read_text(encoding='utf-8').splitlines()]
+
+    # the first one has the run id, only two repeats made it
+    assert lines[0]['message'] == 'Synced 3 catalogs.' and lines[0]['run_id'] == '4441-2023072106-gfsforecast' and lines[0]['level'] == 'INFO'
+    assert len(lines) == 3 and lines[2]['run_id'] is None
@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the sync metrics
+
+    Author: Phil Owen, RENCI.org
+"""
+import logging
+import urllib.request
+
+from src.common.metrics import SyncMetrics
+from src.common.pg_utils_multi import PGUtilsMultiConnect
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_render(tmp_path):
+    """
+    method to test the Prometheus text format output
+
+    :return:
+    """
+    # create the metrics
+    metrics = SyncMetrics('test', logging.getLogger(__name__))
+
+    # add some values
+    metrics.inc('post_requests_total', status='200')
+    metrics.inc('post_requests_total', 2, status='200')
+    metrics.observe('post_seconds', 0.02, status='200')
+    metrics.observe('post_seconds', 1000, status='200')
+
+    # get the text
+    text: str = metrics.render()
+
+    # the counters add up and the histogram buckets are cumulative
+    assert 'test_post_requests_total{status="200"} 3\n' in text and '# TYPE test_post_seconds histogram' in text
+    assert 'test_post_seconds_bucket{status="200",le="0.025"} 1\n' in text and 'test_post_seconds_bucket{status="200",le="300"} 1\n' in text
+    assert 'test_post_seconds_bucket{status="200",le="+Inf"} 2\n' in text and 'test_post_seconds_count{status="200"} 2\n' in text
+
+    # write the textfile
+    metrics.write_textfile(str(tmp_path / 'sync.prom'))
+    assert (tmp_path / 'sync.prom').read_text(encoding='utf-8') == text
+
+    # serve it over HTTP
+    server = metrics.start_http_server(0, '127.0.0.1')
+
+    with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics', timeout=5) as response:
+        assert response.read().decode('utf-8') == text
+
+    metrics.close()
+
+
+def test_run_metrics(monkeypatch):
+    """
+    method to test that a run records the stage metrics
+
+    :return:
+    """
+    # set the PSC projects
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+
+    # create the sync object with the DB and PSC stand-ins
+    with PSCStandIn() as psc:
+        psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(CatalogGenerator(('psc_test',)).generate(50)))
+        psc_sync.components.transport.url = psc.url
+
+        # run a sync
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC') and psc_sync.run('4441-2023072106-gfsforecast', 'RENCI')
+
+        psc_sync.close()
+
+    # get the text
+    text: str = psc_sync.metrics.render()
+
+    # check the stage metrics
+    assert 'psc_sync_runs_total{result="success"} 1\n' in text and 'psc_sync_runs_total{result="skipped"} 1\n' in text
+    assert 'psc_sync_members_total{stage="fetched"} 50\n' in text and 'psc_sync_members_total{stage="filtered"} 50\n' in text
+    assert 'psc_sync_past_runs_total{stage="fetched"} 10\n' in text and 'psc_sync_post_requests_total{status="200"} 1\n' in text
+    assert 'psc_sync_db_query_seconds_count{query="catalog_member_records"} 1\n' in text and 'psc_sync_serialize_seconds_count 1\n' in text
+
+    # the members are counted in record buckets and the DB results are measured in bytes
+    assert 'psc_sync_members_per_run_bucket{le="25"} 0\n' in text and 'psc_sync_members_per_run_bucket{le="50"} 1\n' in text
+    assert PGUtilsMultiConnect.get_text_size('{"id": "abc"}') == 13 and PGUtilsMultiConnect.get_text_size('{"id": "\u00e9"}') == 12
+
+
+class PooledFakePGImplementation(FakePGImplementation):
+    """
+    Class that adds the reconnect and pool counters of a pooled DB to the DB stand-in
+    """
+    def __init__(self, catalog_data: dict):
+        super().__init__(catalog_data)
+
+        # the counters returned
+        self.reconnect_stats: dict = {'attempts': 3, 'failures': 1, 'wait_seconds': 0.5, 'exhausted': 0}
+        self.pool_stats: dict = {'created': 2, 'closed': 0, 'checkouts': 5, 'waits': 1, 'timeouts': 0, 'evicted_idle': 0, 'evicted_lifetime': 0,
+                                 'discarded': 0, 'failed_checks': 1, 'size': 2, 'idle': 1, 'in_use': 1}
+
+    def get_reconnect_stats(self) -> dict:
+        """
+        gets the reconnect counters
+
+        :return:
+        """
+        return dict(self.reconnect_stats)
+
+    def get_pool_stats(self) -> dict:
+        """
+        gets the pool counters
+
+        :return:
+        """
+        return {'apsviz': dict(self.pool_stats)}
+
+
+def test_db_metrics(monkeypatch):
+    """
+    method to test that the DB reconnect and pool counters are exported on each scrape
+
+    :return:
+    """
+    # set the PSC projects
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+
+    # create the sync object
+    db_info = PooledFakePGImplementation({'catalogs': [], 'past_runs': []})
+    psc_sync = PSCDataSync(logging.getLogger(__name__), db_info)
+
+    # the counters are there without a DB call
+    text: str = psc_sync.metrics.render()
+
+    assert 'psc_sync_db_reconnect_total{event="attempt"} 3\n' in text and 'psc_sync_db_reconnect_wait_seconds_total 0.5\n' in text
+    assert 'psc_sync_db_pool_connections{db="apsviz",state="in_use"} 1\n' in text
+    assert 'psc_sync_db_pool_events_total{db="apsviz",event="failed_checks"} 1\n' in text
+
+    # and are current on the next scrape
+    db_info.pool_stats['timeouts'] = 2
+
+    assert 'psc_sync_db_pool_events_total{db="apsviz",event="timeouts"} 2\n' in psc_sync.metrics.render()
+
+    psc_sync.close()
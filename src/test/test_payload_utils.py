@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test payload serialization and compression
+
+    Author: Phil Owen, RENCI.org
+"""
+import gzip
+import json
+
+import pytest
+
+from src.common.payload_utils import PayloadUtils
+
+
+def test_compress():
+    """
+    method to test that a repetitive catalog payload compresses and round trips
+
+    :return:
+    """
+    # create a repetitive payload like the ones we send to PSC
+    catalog_data: dict = {'catalogs': [{'project_code': 'psc_test', 'member_def': {'id': f'4409-003-ofcl-swan-{x}'}} for x in range(500)],
+                          'past_runs': None}
+
+    # serialize it
+    body: bytes = PayloadUtils.encode_json(catalog_data)
+
+    # compress it
+    compressed: bytes = PayloadUtils.compress(body, 'gzip')
+
+    # it should be much smaller and decompress to the same data
+    assert len(compressed) < len(body) / 5
+    assert json.loads(gzip.decompress(compressed)) == catalog_data
+
+    # gzip is always available
+    assert 'gzip' in PayloadUtils.supported_encodings()
+
+    # unknown encodings are an error
+    with pytest.raises(ValueError):
+        PayloadUtils.compress(body, 'br')
+
+
+def test_json_backend():
+    """
+    method to test that the JSON backend in use round trips a catalog payload
+
+    :return:
+    """
+    # create a payload
+    catalog_data: dict = {'catalogs': [{'project_code': 'psc_test', 'member_def': {'id': '4409-003-ofcl-swan-1', 'name': 'Öl – swan'}}],
+                          'past_runs': None, 'system': 'Dev'}
+
+    # encode it
+    body: bytes = PayloadUtils.encode_json(catalog_data)
+
+    # it is compact bytes that decode to the same data
+    assert isinstance(body, bytes) and b', ' not in body
+    assert PayloadUtils.decode_json(body) == catalog_data
+    assert PayloadUtils.decode_json(body.decode('utf-8')) == catalog_data
+    assert PayloadUtils.json_backend() in ('orjson', 'json')
@@ -0,0 +1,214 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the DB connection pool and reconnect policy
+
+    Author: Phil Owen, RENCI.org
+"""
+import time
+import logging
+import threading
+
+import pytest
+
+from src.common.pg_pool import PGConnectionPool, PGPoolTimeout
+from src.common.pg_utils_multi import PGUtilsMultiConnect, PGConnectionError
+
+
+class FakeCursor:
+    """
+    Stands in for a psycopg2 cursor, failing every query if its connection is broken
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def execute(self, _sql: str):
+        """
+        runs a query
+
+        :return:
+        """
+        self.conn.queries += 1
+
+        if self.conn.broken:
+            raise OSError('server closed the connection unexpectedly')
+
+
+class FakeConnection:
+    """
+    Stands in for a psycopg2 connection
+    """
+    def __init__(self):
+        self.closed: int = 0
+        self.autocommit: bool = True
+        self.broken: bool = False
+        self.queries: int = 0
+
+    def cursor(self) -> FakeCursor:
+        """
+        gets a cursor
+
+        :return:
+        """
+        return FakeCursor(self)
+
+    def close(self):
+        """
+        closes the connection
+
+        :return:
+        """
+        self.closed = 1
+
+    def rollback(self):
+        """
+        nothing to roll back
+
+        :return:
+        """
+
+
+def test_checkout_checkin():
+    """
+    method to test that connections are reused and the pool size is bounded
+
+    :return:
+    """
+    # create a pool of up to two connections
+    pool = PGConnectionPool('apsviz', FakeConnection, {'min_size': 1, 'max_size': 2, 'checkout_timeout': 0.1}, _logger=logging.getLogger(__name__))
+
+    # the minimum is opened up front
+    assert pool.get_stats()['created'] == 1
+
+    # get both connections
+    conn_1 = pool.checkout()
+    conn_2 = pool.checkout()
+
+    # they are different and the pool is now exhausted
+    assert conn_1 is not conn_2
+    with pytest.raises(PGPoolTimeout):
+        pool.checkout()
+
+    # return one and get it back again
+    pool.checkin(conn_1)
+    assert pool.checkout() is conn_1
+
+    # a waiting thread gets the connection when it is returned
+    threading.Timer(0.02, pool.checkin, [conn_2]).start()
+    assert pool.checkout(timeout=2) is conn_2
+
+    # a discarded connection is closed and replaced
+    pool.checkin(conn_2, discard=True)
+    assert conn_2.closed and pool.checkout() is not conn_2
+
+    # check the statistics
+    stats: dict = pool.get_stats()
+    assert stats['created'] == 3 and stats['timeouts'] == 1 and stats['discarded'] == 1 and stats['in_use'] == 2
+
+
+def test_eviction():
+    """
+    method to test the idle and lifetime eviction
+
+    :return:
+    """
+    # create a pool with very short limits
+    pool = PGConnectionPool('apsviz', FakeConnection, {'min_size': 1, 'max_size': 3, 'max_idle': 0.01, 'max_lifetime': 60},
+                            _logger=logging.getLogger(__name__))
+
+    # open and return three connections
+    conns: list = [pool.checkout() for _ in range(3)]
+    for conn in conns:
+        pool.checkin(conn)
+
+    # let them go idle
+    time.sleep(0.05)
+    pool.evict_idle()
+
+    # only the minimum is kept
+    assert pool.get_stats()['size'] == 1 and pool.get_stats()['evicted_idle'] == 2
+
+    # expire the remaining one
+    pool.config['max_lifetime'] = 0
+    pool.evict_idle()
+
+    # it was retired and a new one is opened on demand
+    assert pool.get_stats()['evicted_lifetime'] == 1 and pool.checkout() not in conns
+
+    # close the pool
+    pool.close()
+
+
+def test_idle_check():
+    """
+    method to test that a connection idle past the check time is tested and replaced if it broke
+
+    :return:
+    """
+    # create a pool that tests connections idle for more than 10ms
+    pool = PGConnectionPool('apsviz', FakeConnection, {'min_size': 1, 'max_size': 2, 'check_idle': 0.01}, _logger=logging.getLogger(__name__))
+
+    # a connection just returned is not tested
+    conn = pool.checkout()
+    pool.checkin(conn)
+    assert pool.checkout() is conn and conn.queries == 0
+
+    # an idle one that still works is tested and reused
+    pool.checkin(conn)
+    time.sleep(0.02)
+    assert pool.checkout() is conn and conn.queries == 1
+
+    # one that broke while idle without the driver noticing is replaced
+    pool.checkin(conn)
+    conn.broken = True
+    time.sleep(0.02)
+
+    new_conn = pool.checkout()
+    stats: dict = pool.get_stats()
+    assert new_conn is not conn and conn.closed and stats['failed_checks'] == 1 and stats['size'] == 1 and stats['checkouts'] == 4
+
+    pool.close()
+
+
+def test_reconnect_policy(monkeypatch):
+    """
+    method to test that a pooled DB gives up reconnecting within the policy limits
+
+    :return:
+    """
+    # configure a pooled DB that does not connect up front and retries quickly
+    for name, value in {'APSVIZ_DB_HOST': 'localhost', 'APSVIZ_DB_PORT': '5432', 'APSVIZ_DB_POOL_MAX_SIZE': '2', 'APSVIZ_DB_POOL_MIN_SIZE': '0',
+                        'APSVIZ_DB_RECONNECT_BASE_DELAY': '0.01', 'APSVIZ_DB_RECONNECT_MAX_ATTEMPTS': '3'}.items():
+        monkeypatch.setenv(name, value)
+
+    # create the DB object
+    db_info = PGUtilsMultiConnect('test', ('apsviz',), _logger=logging.getLogger(__name__))
+
+    # make every connection attempt fail
+    def fail_to_connect(conn_str):
+        raise OSError(f'no DB at {conn_str}')
+
+    monkeypatch.setattr(db_info, 'create_connection', fail_to_connect)
+
+    # the call fails with a clear error once the attempts are used up
+    with pytest.raises(PGConnectionError):
+        db_info.exec_sql('apsviz', 'SELECT version()')
+
+    # check the counters
+    stats: dict = db_info.get_reconnect_stats()
+    assert stats['attempts'] == 3 and stats['failures'] == 3 and stats['exhausted'] == 1 and stats['wait_seconds'] <= 0.03
+
+    # the pool slot was released
+    assert db_info.get_pool_stats()['apsviz']['size'] == 0
@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the run profiler
+
+    Author: Phil Owen, RENCI.org
+"""
+import time
+import logging
+
+import pytest
+
+from src.common.profiler import SyncProfiler
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_profile(tmp_path):
+    """
+    method to test that a profiled block writes its results with the run id in the file names
+
+    :return:
+    """
+    # check the mode settings
+    assert not SyncProfiler.get_modes(None) and SyncProfiler.get_modes('true') == ['cprofile', 'tracemalloc']
+
+    with pytest.raises(ValueError):
+        SyncProfiler(['perf'], str(tmp_path))
+
+    # create the profiler
+    profiler = SyncProfiler(SyncProfiler.MODES, str(tmp_path), logging.getLogger(__name__), interval=0.001)
+
+    # profile some work
+    with profiler.profile('4441-2023072106-gfsforecast'):
+        data: list = [str(x) * 10 for x in range(20000)]
+        time.sleep(0.05)
+
+    # there is a result file per mode
+    assert data and sorted(path.name.split('.', 1)[1] for path in tmp_path.iterdir()) == ['prof', 'stacks.txt', 'tracemalloc.txt']
+    assert all(path.name.startswith('profile-4441-2023072106-gfsforecast-') for path in tmp_path.iterdir())
+
+    # the stack samples caught this test
+    assert 'test_profile' in next(tmp_path.glob('*.stacks.txt')).read_text(encoding='utf-8')
+
+
+def test_profile_off(monkeypatch):
+    """
+    method to test that there is no profiler unless it is turned on
+
+    :return:
+    """
+    # set the PSC projects
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.delenv('PSC_SYNC_PROFILE', raising=False)
+
+    # create the sync object
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(CatalogGenerator().generate(10)))
+
+    # profiling is off
+    assert psc_sync.shared.profiler is None
@@ -134,6 +134,24 @@ def test_get_catalogs():
     # check the record count
     assert catalog_data != -1 and catalog_data['catalogs'] is None and catalog_data['past_runs'] is None
 
+    # get the catalog data filtered to the PSC projects in the DB
+    catalog_data: dict = psc_sync.db_info.get_catalog_member_records_filtered(run_id='4441-2023072106-gfsforecast',
+                                                                              projects=psc_sync.psc_sync_projects)
+
+    # the run is either rejected in the DB or only has PSC past runs left
+    assert catalog_data != -1 and ('excluded_project_codes' in catalog_data or
+                                   all(item['project_code'] in psc_sync.psc_sync_projects for item in catalog_data['past_runs'] or []))
+
+    # a run rejected in the DB fails the project code check
+    assert not psc_sync.check_project_codes({'catalogs': [], 'excluded_project_codes': ['nopp']})
+
+    # the probe of a run agrees with its catalogs
+    probe: dict = psc_sync.db_info.get_catalog_member_probe(run_id='4441-2023072106-gfsforecast')
+    catalog_data: dict = psc_sync.db_info.get_catalog_member_records(run_id='4441-2023072106-gfsforecast')
+
+    assert probe['member_count'] == len(catalog_data['catalogs'] or [])
+    assert sorted(probe['project_codes']) == sorted({item['project_code'] for item in catalog_data['catalogs'] or []})
+
 
 @pytest.mark.skip(reason="Local test only")
 def test_push_to_psc():
@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the PSC request compression
+
+    Author: Phil Owen, RENCI.org
+"""
+import logging
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.common.payload_utils import PayloadUtils
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_compression_threshold(monkeypatch):
+    """
+    method to test that only the bodies over the size threshold are compressed
+
+    :return:
+    """
+    # set the PSC projects and compress bodies of 1K or more
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_COMPRESSION', 'gzip')
+    monkeypatch.setenv('PSC_SYNC_COMPRESSION_MIN_BYTES', '1024')
+
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation({'catalogs': [], 'past_runs': []}))
+
+    # a small body and a large one
+    small: bytes = PayloadUtils.encode_json({'catalogs': [], 'past_runs': []})
+    large: bytes = PayloadUtils.encode_json(CatalogGenerator(('psc_test',)).generate(20))
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+        psc.server.keep_bodies = True
+
+        # the small body is sent as is
+        assert psc_sync.components.transport.post_body(small).status_code == 200 and psc.server.stats['bytes'] == len(small)
+
+        # the large one is compressed
+        assert psc_sync.components.transport.post_body(large).status_code == 200 and psc.server.stats['bytes'] - len(small) < len(large)
+
+        # both arrive intact
+        assert psc.server.bodies == [PayloadUtils.decode_json(small), PayloadUtils.decode_json(large)]
+
+    psc_sync.close()
+
+
+def test_encoding_fallback(monkeypatch):
+    """
+    method to test that compression is turned off and the body resent when PSC refuses the encoding
+
+    :return:
+    """
+    # set the PSC projects and compress everything
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_COMPRESSION', 'gzip')
+    monkeypatch.setenv('PSC_SYNC_COMPRESSION_MIN_BYTES', '0')
+
+    catalog_data: dict = CatalogGenerator(('psc_test',)).generate(20)
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(catalog_data))
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+        psc.server.keep_bodies = True
+        psc.server.accept_encoding = False
+
+        # the compressed body is refused and then sent as is
+        assert psc_sync.components.transport.post_body(PayloadUtils.encode_json(catalog_data)).status_code == 200
+        assert psc.server.stats['requests'] == 2 and psc.server.bodies == [catalog_data] and psc_sync.components.transport.compression is None
+        assert 'psc_sync_post_retries_total{reason="encoding"} 1\n' in psc_sync.metrics.render()
+
+        # a streamed run is streamed again uncompressed
+        psc_sync.components.transport.compression = 'gzip'
+        psc_sync.components.streamer.enabled = True
+
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 4 and len(psc.server.bodies) == 2 and psc_sync.components.transport.compression is None
+        assert psc.server.bodies[1]['catalogs'] == catalog_data['catalogs']
+
+    psc_sync.close()
+
+
+def test_passthrough_empty(monkeypatch):
+    """
+    method to test that a run with no catalogs is not a failure on the passthrough path
+
+    :return:
+    """
+    # set the PSC projects and pass the DB text through
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_PASSTHROUGH', 'true')
+    monkeypatch.setenv('PSC_SYNC_PROBE', 'false')
+
+    # create a DB stand-in where the SP returns nothing
+    db_info = FakePGImplementation(CatalogGenerator(('psc_test',)).generate(4))
+    db_info.get_catalog_member_records_text = lambda **_: 0
+
+    with PSCStandIn() as psc:
+        psc_sync = PSCDataSync(logging.getLogger(__name__), db_info)
+        psc_sync.components.transport.url = psc.url
+
+        # there is nothing to send
+        assert psc_sync.get_sync_path() == 'passthrough'
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC') and psc.server.stats['requests'] == 0
+
+        psc_sync.close()
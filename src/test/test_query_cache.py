@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the DB query result cache
+
+    Author: Phil Owen, RENCI.org
+"""
+import time
+import logging
+
+from src.common.payload_utils import PayloadUtils
+from src.common.query_cache import QueryCache
+
+
+def test_query_cache():
+    """
+    method to test the cache limits, expiry and invalidation
+
+    :return:
+    """
+    # create a cache that holds two entries
+    cache = QueryCache(max_entries=2, max_bytes=1024, ttl=0.2, _logger=logging.getLogger(__name__))
+    cache.check_version(1)
+
+    # add a couple of results
+    cache.put('run-1', {'catalogs': [1]})
+    cache.put('run-2', {'catalogs': [2]})
+
+    # a hit is a new copy
+    result: dict = cache.get('run-1')
+    result['catalogs'].append(3)
+
+    assert cache.get('run-1') == {'catalogs': [1]} and cache.get('run-3') is None
+
+    # the least recently used one is evicted
+    cache.put('run-3', {'catalogs': [3]})
+    assert cache.get('run-2') is None and cache.get('run-3') == {'catalogs': [3]}
+
+    # a result too big for the cache is not kept, nor is one read before the data changed
+    cache.put('run-4', {'catalogs': ['x' * 2048]})
+    cache.put('run-5', {'catalogs': [5]}, version=0)
+    assert cache.get('run-4') is None and cache.get('run-5') is None
+
+    # check the counts and size
+    stats: dict = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['entries']) == (3, 4, 1, 2)
+    assert stats['bytes'] == 2 * len(PayloadUtils.encode_json({'catalogs': [1]}))
+
+    # the entries expire
+    time.sleep(0.25)
+    assert cache.get('run-1') is None and cache.get_stats()['expirations'] == 1
+
+    # entries can be dropped by key
+    cache.put(('run-1', 'PSC'), {'catalogs': [1]}, version=1)
+    cache.put(('run-2', 'PSC'), {'catalogs': [2]}, version=1)
+    cache.invalidate(lambda key: key[0] == 'run-1')
+    assert cache.get(('run-1', 'PSC')) is None and cache.get(('run-2', 'PSC')) == {'catalogs': [2]}
+    assert cache.get_stats()['invalidations'] == 1
+
+    # a data change empties the cache
+    cache.put('run-1', {'catalogs': [1]}, version=1)
+    cache.check_version(2)
+    stats = cache.get_stats()
+    assert cache.get('run-1') is None and (stats['entries'], stats['bytes'], stats['invalidations']) == (0, 0, 2)
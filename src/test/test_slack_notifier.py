@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the Slack notifier against a stub client
+
+    Author: Phil Owen, RENCI.org
+"""
+import logging
+
+from slack_sdk.errors import SlackApiError
+
+from src.common.slack_notifier import SlackNotifier
+from src.common.general_utils import GeneralUtils
+
+
+class StubResponse:
+    """
+    Stands in for a rate limited Slack response
+    """
+    status_code: int = 429
+    headers: dict = {'Retry-After': '0'}
+
+
+class StubClient:
+    """
+    Stands in for the Slack WebClient
+    """
+    def __init__(self, token: str, posts: list, rate_limits: int = 0):
+        self.token: str = token
+        self.posts: list = posts
+        self.rate_limits: int = rate_limits
+
+    def chat_postMessage(self, channel: str, text: str):  # pylint: disable=invalid-name
+        """
+        records the message, rate limiting the first calls
+
+        :return:
+        """
+        if self.rate_limits:
+            self.rate_limits -= 1
+            raise SlackApiError('ratelimited', StubResponse())
+
+        self.posts.append((self.token, channel, text))
+
+
+def test_notifier(monkeypatch):
+    """
+    method to test that messages are combined per channel, rate limits are retried and close sends what is left
+
+    :return:
+    """
+    # init the posts and the clients created
+    posts: list = []
+    tokens: list = []
+
+    def client_factory(token):
+        tokens.append(token)
+        return StubClient(token, posts, rate_limits=1)
+
+    # send messages through GeneralUtils for a system that posts to Slack
+    monkeypatch.setenv('SYSTEM', 'Dev')
+    monkeypatch.setenv('SLACK_STATUS_CHANNEL', 'status')
+    monkeypatch.setenv('SLACK_ISSUES_CHANNEL', 'issues')
+    monkeypatch.setenv('SLACK_STATUS_TOKEN', 'status-token')
+    monkeypatch.setenv('SLACK_ISSUES_TOKEN', 'issues-token')
+
+    notifier = SlackNotifier(logging.getLogger(__name__), client_factory, window=60)
+    general_utils = GeneralUtils(logging.getLogger(__name__), notifier)
+
+    for run in range(3):
+        general_utils.send_slack_msg(f'run {run} synced', 'slack_status_channel')
+
+    general_utils.send_slack_msg('run 3 failed', 'slack_issues_channel')
+
+    # nothing is sent until the window closes
+    assert not posts
+
+    # close sends everything left
+    general_utils.close()
+
+    # there is one client per token and one digest per channel
+    assert sorted(tokens) == ['issues-token', 'status-token'] and len(posts) == 2
+    assert posts[0][1] == 'status' and posts[0][2].startswith('3 messages:\n') and 'run 2 synced' in posts[0][2]
+    assert posts[1] == ('issues-token', 'issues', 'APSViz PSCSync (Dev) - run 3 failed')
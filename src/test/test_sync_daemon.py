@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the sync daemon job handling
+
+    Author: Phil Owen, RENCI.org
+"""
+import io
+import logging
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.sync.collab_sync import CollabDataSync
+from src.sync.sync_daemon import SyncDaemon
+
+
+class StubSync:
+    """
+    Records the jobs it was asked to run
+    """
+    def __init__(self):
+        self.jobs: list = []
+
+    def run(self, run_id: str, physical_location: str) -> bool:
+        """
+        records the job
+
+        :param run_id:
+        :param physical_location:
+        :return:
+        """
+        self.jobs.append((run_id, physical_location))
+
+        return True
+
+    def run_many(self, jobs: list) -> dict:
+        """
+        records the jobs in order
+
+        :param jobs:
+        :return:
+        """
+        return {job: self.run(*job) for job in jobs}
+
+    def close(self):
+        """
+        nothing to release
+
+        :return:
+        """
+
+
+def test_parse_job():
+    """
+    method to test parsing the supported job line formats
+
+    :return:
+    """
+    # the plain text format
+    assert SyncDaemon.parse_job('4441-2023073100-gfsforecast PSC\n') == ('4441-2023073100-gfsforecast', 'PSC')
+
+    # the JSON format
+    assert SyncDaemon.parse_job('{"run_id": "4443-009-trackRight50", "physical_location": "TWI"}') == ('4443-009-trackRight50', 'TWI')
+
+    # blank lines, comments and malformed lines are not jobs
+    assert SyncDaemon.parse_job('') is None
+    assert SyncDaemon.parse_job('# a comment') is None
+    assert SyncDaemon.parse_job('only-a-run-id') is None
+    assert SyncDaemon.parse_job('{"run_id": "no-location"}') is None
+
+
+def test_run_stdin():
+    """
+    method to test that every valid stdin job is run by the one warm sync object
+
+    :return:
+    """
+    # create the daemon with a stub sync object
+    stub = StubSync()
+    daemon = SyncDaemon(_logger=logging.getLogger(__name__), _psc_sync=stub)
+
+    # feed it some jobs
+    daemon.run_stdin(io.StringIO('run-1 PSC\nbad\nrun-2 RENCI\n{"run_id": "run-3", "physical_location": "TWI"}\n'))
+
+    # all the valid jobs should have been run in order
+    assert stub.jobs == [('run-1', 'PSC'), ('run-2', 'RENCI'), ('run-3', 'TWI')]
+
+
+def test_run_jobs(monkeypatch):
+    """
+    method to test that the queued jobs are run together against the DB and PSC stand-ins
+
+    :return:
+    """
+    # set the PSC projects and run two jobs at a time
+    monkeypatch.delenv('COLLAB_SYNC_CONFIG', raising=False)
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_RUN_WORKERS', '2')
+
+    # create the daemon with a sync object on the stand-ins
+    db_info = FakePGImplementation(CatalogGenerator(('psc_test',)).generate(20))
+    collab_sync = CollabDataSync(logging.getLogger(__name__), db_info)
+    daemon = SyncDaemon(_logger=logging.getLogger(__name__), _psc_sync=collab_sync)
+
+    with PSCStandIn() as psc:
+        collab_sync.primary.components.transport.url = psc.url
+
+        # the same run from two locations is two jobs, a run from elsewhere is not sent
+        daemon.run_stdin(io.StringIO('run-1 PSC\nrun-1 TWI\nrun-2 RENCI\nrun-3 PSC\n'))
+
+        assert psc.server.stats['requests'] == 3 and db_info.calls == 3
+
+    # the results are by job
+    with PSCStandIn() as psc:
+        collab_sync.primary.components.transport.url = psc.url
+
+        assert collab_sync.run_many([('run-1', 'PSC'), ('run-1', 'TWI'), ('run-1', 'PSC')]) == {('run-1', 'PSC'): {'PSC': True},
+                                                                                                 ('run-1', 'TWI'): {'PSC': True}}
+        assert psc.server.stats['requests'] == 2
+
+    collab_sync.close()
@@ -0,0 +1,293 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the Postgres notification sync listener
+
+    Author: Phil Owen, RENCI.org
+"""
+import os
+import types
+import logging
+import datetime
+import threading
+
+import pytest
+
+from src.common.pg_impl import PGImplementation
+from src.common.sync_state import SyncStateStore
+from src.sync.sync_daemon import SyncDaemon
+from src.sync.sync_listener import SyncListener
+
+
+class FakeConn:
+    """
+    A listening connection stand-in
+    """
+    def __init__(self):
+        self.notifies: list = []
+        self.closed: bool = False
+
+    def close(self):
+        """
+        marks the connection closed
+
+        :return:
+        """
+        self.closed = True
+
+
+class FakeListenDB:
+    """
+    Hands out batches of notification payloads, a None batch is a lost connection
+    """
+    def __init__(self, daemon: SyncDaemon, batches: list):
+        self.daemon: SyncDaemon = daemon
+        self.batches: list = batches
+        self.conns: list = []
+        self.catchups: list = []
+        self.invalidated: list = []
+
+    def listen(self, _db_name: str, _channels: tuple) -> FakeConn:
+        """
+        returns a new connection
+
+        :return:
+        """
+        self.conns.append(FakeConn())
+
+        return self.conns[-1]
+
+    def invalidate_run(self, run_id: str):
+        """
+        records the run whose cached catalogs were dropped
+
+        :param run_id:
+        :return:
+        """
+        self.invalidated.append(run_id)
+
+    @staticmethod
+    def get_run_physical_location(run_id: str, _db_name: str):
+        """
+        returns PSC unless the run is unknown
+
+        :param run_id:
+        :return:
+        """
+        return None if run_id.endswith('unknown') else 'PSC'
+
+    def close_conn(self, _db_name: str):
+        """
+        nothing to close
+
+        :return:
+        """
+
+    def get_notifications(self, _conn: FakeConn, _timeout: float) -> list:
+        """
+        returns the next batch, stops the daemon when there are none left
+
+        :return:
+        """
+        if not self.batches:
+            self.daemon.shutdown_event.set()
+
+            return []
+
+        batch = self.batches.pop(0)
+
+        if batch is None:
+            raise ConnectionError('connection lost')
+
+        return [('catalog_member_inserted', payload) for payload in batch]
+
+    @staticmethod
+    def get_db_time(_conn: FakeConn) -> datetime.datetime:
+        """
+        returns a fixed DB time
+
+        :return:
+        """
+        return datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+    def get_catalog_run_ids(self, start_date: str) -> list:
+        """
+        records the catch-up window and returns a missed run
+
+        :param start_date:
+        :return:
+        """
+        self.catchups.append(start_date)
+
+        return ['4441-2023072106-missed']
+
+
+def get_jobs(daemon: SyncDaemon) -> list:
+    """
+    gets the queued jobs
+
+    :param daemon:
+    :return:
+    """
+    return [daemon.job_queue.get_nowait() for _ in range(daemon.job_queue.qsize())]
+
+
+def test_listener(monkeypatch):
+    """
+    method to test the notification formats, the debounce and the catch-up after a lost connection
+
+    :return:
+    """
+    # queue the runs as soon as their notifications stop
+    monkeypatch.setenv('COLLAB_SYNC_DEBOUNCE_SECONDS', '0')
+    monkeypatch.setenv('COLLAB_SYNC_CATCHUP_MARGIN_SECONDS', '60')
+
+    # create the listener. the run properties are in the same DB stand-in
+    daemon = SyncDaemon(logging.getLogger(__name__), object())
+    db_info = FakeListenDB(daemon, [['4441-2023072106-gfsforecast', '4441-2023072106-gfsforecast', '4443-009-trackRight50 TWI', 'not a job',
+                                     '4445-001-unknown'], None, ['{"run_id": "4444-001-nhc", "physical_location": "RENCI"}']])
+
+    listener = SyncListener(logging.getLogger(__name__), daemon, db_info)
+    listener.run_props.db = db_info
+    listener.run()
+
+    # each run is queued once with its location, the missed run is caught up on after reconnecting. the run without a known location is not queued
+    assert get_jobs(daemon) == [('4441-2023072106-gfsforecast', 'PSC'), ('4443-009-trackRight50', 'TWI'), ('4441-2023072106-missed', 'PSC'),
+                                ('4444-001-nhc', 'RENCI')]
+
+    # there was nothing to catch up on at the start, then the window starts a margin before the last DB time. every connection was closed
+    assert db_info.catchups == ['2024-01-01 11:59:00'] and len(db_info.conns) == 2 and all(conn.closed for conn in db_info.conns)
+
+    # the cached catalogs of each notified run were dropped
+    assert sorted(set(db_info.invalidated)) == ['4441-2023072106-gfsforecast', '4441-2023072106-missed', '4443-009-trackRight50', '4444-001-nhc']
+
+
+def test_watermark(tmp_path, monkeypatch):
+    """
+    method to test that the runs missed while the listener was stopped are caught up on when it starts again
+
+    :return:
+    """
+    # queue the runs as soon as their notifications stop
+    monkeypatch.setenv('COLLAB_SYNC_DEBOUNCE_SECONDS', '0')
+
+    # the watermark is kept in the member state store of the sync object
+    sync = types.SimpleNamespace(state_store=SyncStateStore(str(os.path.join(tmp_path, 'state.db')), logging.getLogger(__name__)))
+
+    # each run of the listener gets a batch of notifications
+    for _ in range(2):
+        daemon = SyncDaemon(logging.getLogger(__name__), sync)
+        db_info = FakeListenDB(daemon, [['4441-2023072106-gfsforecast PSC']])
+
+        listener = SyncListener(logging.getLogger(__name__), daemon, db_info)
+        listener.run_props.db = db_info
+        listener.run()
+
+    # the second run caught up from the saved watermark when it connected
+    assert db_info.catchups == ['2024-01-01 11:59:00'] and listener.watermark.value == datetime.datetime(2024, 1, 1, 12, 0, 0)
+    assert get_jobs(daemon) == [('4441-2023072106-missed', 'PSC'), ('4441-2023072106-gfsforecast', 'PSC')]
+
+    sync.state_store.close()
+
+
+def test_debounce(monkeypatch):
+    """
+    method to test that a run waits for its notifications to stop, but not past the max
+
+    :return:
+    """
+    # wait 10 seconds for the notifications to stop, but no more than 15 in all
+    monkeypatch.setenv('COLLAB_SYNC_DEBOUNCE_SECONDS', '10')
+    monkeypatch.setenv('COLLAB_SYNC_DEBOUNCE_MAX_SECONDS', '15')
+
+    daemon = SyncDaemon(logging.getLogger(__name__), object())
+    listener = SyncListener(logging.getLogger(__name__), daemon, FakeListenDB(daemon, []))
+    listener.run_props.db = listener.db_info
+
+    # control the time
+    now: list = [100.0]
+    monkeypatch.setattr('src.sync.sync_listener.time.monotonic', lambda: now[0])
+
+    # each notification pushes the run back
+    listener.add_run('4441-2023072106-gfsforecast', 'PSC')
+    now[0] = 104.0
+    listener.add_notification('4441-2023072106-gfsforecast')
+
+    assert listener.debouncer.get_wait() == 5.0 and listener.queue_due_runs() == 0
+
+    # up to the max
+    now[0] = 112.0
+    listener.add_notification('4441-2023072106-gfsforecast')
+    assert listener.debouncer.pending['4441-2023072106-gfsforecast'][1] == 115.0
+
+    now[0] = 115.0
+    assert listener.queue_due_runs() == 1 and get_jobs(daemon) == [('4441-2023072106-gfsforecast', 'PSC')]
+
+
+def test_listener_run_props(monkeypatch):
+    """
+    method to test that the daemon does not listen without the run properties DB settings
+
+    :return:
+    """
+    # point the run properties at a DB with no settings
+    monkeypatch.setenv('COLLAB_SYNC_RUN_PROPS_DB', 'run_props_test')
+
+    # create the daemon
+    daemon = SyncDaemon(logging.getLogger(__name__), types.SimpleNamespace(db_info=None, db_lock=None, state_store=None))
+
+    # it gives up before starting the consumer
+    daemon.run_listener()
+    assert daemon.worker is None
+
+    # the settings are enough to listen
+    for name in ('USERNAME', 'PASSWORD', 'DATABASE', 'HOST', 'PORT'):
+        monkeypatch.setenv(f'RUN_PROPS_TEST_DB_{name}', 'x')
+
+    assert SyncListener(logging.getLogger(__name__), daemon).run_props.is_configured()
+
+
+@pytest.mark.skip(reason="Local test only")
+def test_listener_postgres(monkeypatch):
+    """
+    method to test a notification from a catalog member insert into a local Postgres
+
+    :return:
+    """
+    # queue the runs as soon as their notifications stop
+    monkeypatch.setenv('COLLAB_SYNC_DEBOUNCE_SECONDS', '0')
+
+    # install the trigger on an autocommit connection
+    db_info = PGImplementation(('apsviz',), logging.getLogger(__name__))
+    conn = db_info.listen('apsviz', ())
+
+    with conn.cursor() as cursor:
+        with open(os.path.join(os.path.dirname(__file__), '..', '..', 'migrations', '003_catalog_member_notify.sql'), encoding='utf-8') as sql_file:
+            cursor.execute(sql_file.read())
+
+    # create the listener
+    daemon = SyncDaemon(logging.getLogger(__name__), object())
+    listener = SyncListener(logging.getLogger(__name__), daemon, db_info)
+    listener.run_props.db = db_info
+
+    listener_thread = threading.Thread(target=listener.run)
+    listener_thread.start()
+
+    # send a notification like the trigger does once the listener is connected
+    daemon.shutdown_event.wait(2)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_notify('catalog_member_inserted', '4441-2023072106-gfsforecast PSC');")
+
+    # give it a heartbeat to arrive
+    daemon.shutdown_event.wait(listener.debouncer.config['heartbeat'] + 1)
+    daemon.shutdown_event.set()
+    listener_thread.join()
+    conn.close()
+
+    assert ('4441-2023072106-gfsforecast', 'PSC') in get_jobs(daemon)
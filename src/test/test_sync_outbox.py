@@ -0,0 +1,136 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the outbox of failed pushes
+
+    Author: Phil Owen, RENCI.org
+"""
+import os
+import logging
+
+from src.common.sync_outbox import SyncOutbox, OutboxEntry
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_outbox(tmp_path):
+    """
+    method to test the outbox order, deduplication and backoff
+
+    :return:
+    """
+    # create the outbox
+    outbox = SyncOutbox(str(os.path.join(tmp_path, 'outbox.db')), logging.getLogger(__name__), base_delay=60)
+
+    # add a few failed pushes, one of them twice
+    outbox.add(OutboxEntry(None, 'PSC', 'run-1', 0, b'{"v":1}'))
+    outbox.add(OutboxEntry(None, 'PSC', 'run-2', 0, b'{"v":2}'))
+    outbox.add(OutboxEntry(None, 'PSC', 'run-1', 0, b'{"v":3}'))
+    outbox.add(OutboxEntry(None, 'PSC', 'run-1', 2, b'{"v":4}'))
+
+    # the newer body replaced the older one but kept its place in line
+    entries: list = outbox.get_due('PSC')
+    assert [(entry.run_id, entry.part, entry.body) for entry in entries] == [('run-1', 0, b'{"v":3}'), ('run-2', 0, b'{"v":2}'),
+                                                                             ('run-1', 2, b'{"v":4}')]
+
+    # a failure holds back the newer entries until the backoff is over
+    outbox.failed(entries[0], 'HTTP 503')
+    assert not outbox.get_due('PSC') and outbox.get_depth('PSC') == 3
+
+    # a newer body for the whole run replaces its parts but does not cut the backoff short
+    outbox.add(OutboxEntry(None, 'PSC', 'run-1', 0, b'{"v":5}'))
+    assert not outbox.get_due('PSC') and outbox.has_run('PSC', 'run-1') and outbox.get_depth('PSC') == 2
+
+    # once it is due the entries are handed out oldest first again
+    outbox.base_delay = 0
+    outbox.failed(entries[0]._replace(attempts=1), 'HTTP 503')
+    assert [(entry.run_id, entry.body) for entry in outbox.get_due('PSC')] == [('run-1', b'{"v":5}'), ('run-2', b'{"v":2}')]
+
+    # a sent entry is removed, as are all parts of a run
+    outbox.sent(entries[1])
+    outbox.add(OutboxEntry(None, 'PSC', 'run-1', 1, b'{"v":6}'))
+    outbox.remove('PSC', 'run-1')
+    assert outbox.get_depth('PSC') == 0 and not outbox.has_run('PSC', 'run-1')
+
+    # clean up
+    outbox.close()
+
+
+def test_outbox_drain(tmp_path, monkeypatch):
+    """
+    method to test that a failed push is saved and sent when PSC is back
+
+    :return:
+    """
+    # set the PSC projects and the outbox
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_OUTBOX_DB', str(os.path.join(tmp_path, 'outbox.db')))
+
+    # create the sync object pointing at a port nothing listens on
+    psc_sync = PSCDataSync(logging.getLogger(__name__), FakePGImplementation(CatalogGenerator(('psc_test',)).generate(20)))
+    psc_sync.components.transport.url = 'http://127.0.0.1:9/sync'
+
+    # the push fails and is saved
+    assert not psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+    assert psc_sync.shared.outbox.get_depth('PSC') == 1
+
+    # PSC is back
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+
+        # a new push of the run is queued behind the waiting one instead of overtaking it
+        assert not psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 0 and psc_sync.shared.outbox.get_depth('PSC') == 1
+
+        # send what is waiting
+        assert psc_sync.drain_outbox() == (1, 0)
+        assert psc.server.stats['requests'] == 1
+
+        # the run is sent straight away again
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 2
+
+    # check the metrics
+    assert 'psc_sync_outbox_depth 0\n' in psc_sync.metrics.render()
+
+    psc_sync.close()
+
+
+def test_outbox_stream(tmp_path, monkeypatch):
+    """
+    method to test that a failed streamed push is saved in the outbox
+
+    :return:
+    """
+    # set the PSC projects, the outbox and stream every run
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_OUTBOX_DB', str(os.path.join(tmp_path, 'outbox.db')))
+    monkeypatch.setenv('PSC_SYNC_STREAMING', 'true')
+
+    # create the sync object
+    db_info = FakePGImplementation(CatalogGenerator(('psc_test',)).generate(20))
+    psc_sync = PSCDataSync(logging.getLogger(__name__), db_info)
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+
+        # the stream and the push of the fetched run both fail
+        psc.server.statuses = [500, 500]
+
+        # the run is fetched after the failed stream and saved
+        assert not psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 2 and db_info.calls == 2
+        assert psc_sync.shared.outbox.has_run('PSC', '4441-2023072106-gfsforecast')
+
+        # send what is waiting
+        assert psc_sync.drain_outbox() == (1, 0)
+        assert psc.server.stats['requests'] == 3
+
+    psc_sync.close()
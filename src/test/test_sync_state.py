@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test the sync state store
+
+    Author: Phil Owen, RENCI.org
+"""
+import os
+import logging
+
+from src.benchmark.catalog_generator import CatalogGenerator, FakePGImplementation
+from src.benchmark.psc_sync_benchmark import PSCStandIn
+from src.common.payload_utils import PayloadUtils
+from src.common.sync_state import SyncStateStore
+from src.sync.psc_sync import PSCDataSync
+
+
+def test_state_store(tmp_path):
+    """
+    method to test saving, reading and removing member hashes
+
+    :return:
+    """
+    # create the store
+    store = SyncStateStore(str(os.path.join(tmp_path, 'state.db')), logging.getLogger(__name__))
+
+    # the hash does not depend on key order
+    assert store.hash_member({'a': 1, 'b': {'c': 2}}) == store.hash_member({'b': {'c': 2}, 'a': 1})
+
+    # save a couple of members for two targets
+    store.update('PSC', [('4409-003-ofcl-swan-1', '4409-003-ofcl-swan', 'h1'), ('4409-003-ofcl-swan-2', '4409-003-ofcl-swan', 'h2')], [])
+    store.update('OTHER', [('4409-003-ofcl-swan-1', '4409-003-ofcl-swan', 'x1')], [])
+
+    # the hashes are kept per target
+    assert store.get_member_hashes('PSC', ['4409-003-ofcl-swan']) == {'4409-003-ofcl-swan-1': 'h1', '4409-003-ofcl-swan-2': 'h2'}
+    assert store.get_member_hashes('OTHER', ['4409-003-ofcl-swan']) == {'4409-003-ofcl-swan-1': 'x1'}
+
+    # change one and remove the other
+    store.update('PSC', [('4409-003-ofcl-swan-1', '4409-003-ofcl-swan', 'h3')], ['4409-003-ofcl-swan-2'])
+
+    # check the result
+    assert store.get_member_hashes('PSC', ['4409-003-ofcl-swan', 'unknown']) == {'4409-003-ofcl-swan-1': 'h3'}
+
+    # a progress mark is kept until it is replaced
+    store.set_mark('listen_watermark', '2024-01-01T12:00:00')
+    store.set_mark('listen_watermark', '2024-01-01T12:00:05')
+    assert store.get_mark('listen_watermark') == '2024-01-01T12:00:05' and store.get_mark('unknown') is None
+
+    # clean up
+    store.close()
+
+
+def test_catalog_delta(tmp_path, monkeypatch):
+    """
+    method to test that only the new, changed and removed catalog members are sent to PSC
+
+    :return:
+    """
+    # set the PSC projects and the state store
+    monkeypatch.setenv('PSC_SYNC_PROJECTS', 'psc_test')
+    monkeypatch.setenv('PSC_SYNC_STATE_DB', str(os.path.join(tmp_path, 'state.db')))
+
+    # create the sync object on a catalog of 3 runs
+    catalog_data: dict = CatalogGenerator(('psc_test',)).generate(24)
+    db_info = FakePGImplementation(catalog_data)
+    psc_sync = PSCDataSync(logging.getLogger(__name__), db_info)
+
+    with PSCStandIn() as psc:
+        psc_sync.components.transport.url = psc.url
+        psc.server.keep_bodies = True
+
+        # the first sync sends every member and no tombstones
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 1 and len(psc.server.bodies[-1]['catalogs']) == 24
+        assert not psc.server.bodies[-1]['deleted_members']
+
+        # nothing changed so nothing is sent
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 1
+
+        # change a member and remove another one from the same catalog
+        changed: dict = catalog_data['catalogs'][0]
+        changed['member_def']['url'] += '&styles=new'
+        removed: dict = catalog_data['catalogs'].pop(1)
+        db_info.catalog_text = PayloadUtils.encode_json(catalog_data).decode('utf-8')
+
+        # only the changed member and a tombstone for the removed one are sent
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC')
+        assert psc.server.stats['requests'] == 2 and psc.server.bodies[-1]['catalogs'] == [changed]
+        assert psc.server.bodies[-1]['deleted_members'] == [removed['member_def']['id']]
+
+        # a full resync sends everything again, the tombstone is already known
+        assert psc_sync.run('4441-2023072106-gfsforecast', 'PSC', full_resync=True)
+        assert psc.server.stats['requests'] == 3 and len(psc.server.bodies[-1]['catalogs']) == 23
+        assert not psc.server.bodies[-1]['deleted_members']
+
+    psc_sync.close()